@@ -1,12 +1,40 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.v1 import dependencies
-from app.api.v1.schemas.portfolio import PortfolioSnapshot
+from app.api.v1.schemas.portfolio import PortfolioSnapshot, PortfolioSnapshotBatch, PortfolioSnapshotRequest
+from app.core.config import settings
 from app.services.portfolio_service import portfolio_service
+from app.services.portfolio_stream import portfolio_streams
 
 router = APIRouter()
 
+@router.post(
+    "/snapshots",
+    response_model=PortfolioSnapshotBatch,
+    summary="Get Portfolio Snapshots",
+    description="Snapshots for a list or range of users, computed with one query over tax lots and one over prices.",
+)
+async def read_portfolio_snapshots(
+    request: PortfolioSnapshotRequest,
+    db: AsyncSession = Depends(dependencies.get_db),
+):
+    """
+    Retrieves snapshots for many users at once.
+    - **user_ids**: the users to include, or
+    - **user_id_from** / **user_id_to**: an inclusive range of user IDs
+
+    Users without open positions are left out of the response.
+    """
+    user_id_range = None
+    if request.user_ids is None:
+        user_id_range = (request.user_id_from, request.user_id_to)
+    snapshots = await portfolio_service.get_portfolio_snapshots(
+        db, user_ids=request.user_ids, user_id_range=user_id_range
+    )
+    return PortfolioSnapshotBatch(snapshots=snapshots)
+
 @router.get(
     "/{user_id}/snapshot",
     response_model=PortfolioSnapshot,
@@ -27,4 +55,39 @@ async def read_portfolio_snapshot(
     #     raise HTTPException(status_code=403, detail="Not authorized")
         
     snapshot = await portfolio_service.get_portfolio_snapshot(db=db, user_id=user_id)
-    return snapshot
\ No newline at end of file
+    return snapshot
+
+@router.get(
+    "/{user_id}/stream",
+    summary="Stream Portfolio Updates",
+    description="Server-sent events: a full snapshot, then position and summary deltas as trades and prices change.",
+)
+async def stream_portfolio(
+    user_id: int,
+    min_interval_ms: int = Query(
+        settings.PORTFOLIO_STREAM_MIN_INTERVAL_MS,
+        ge=settings.PORTFOLIO_STREAM_MIN_INTERVAL_MS,
+        description="Minimum time between two events; changes in between are coalesced.",
+    ),
+):
+    """
+    Streams a user's portfolio as server-sent events.
+    - **snapshot**: the full PortfolioSnapshot, sent once on connect; ``{"summary": null, "positions": []}`` if the user has no portfolio yet
+    - **delta**: changed summary, new or changed positions and removed security_ids
+    """
+    async def events():
+        async for event, data in portfolio_streams.stream(
+            user_id,
+            min_interval=min_interval_ms / 1000,
+            keepalive=settings.PORTFOLIO_STREAM_KEEPALIVE_SECONDS,
+        ):
+            if data is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -16,9 +16,23 @@ async def simulate_trade_event(
     FAKED ENDPOINT: Simulates receiving a trade from a broker/cash tracker.
     This triggers the core FIFO and P&L logic.
     """
-    await processing_service.process_trade(db, trade)
+    if not await processing_service.process_trade(db, trade):
+        return {"message": f"Trade {trade.trade_id} was already processed."}
     return {"message": "Trade accepted for processing."}
 
+@router.post("/trades:batch", status_code=202)
+async def simulate_trade_batch(
+    trades: list[Trade],
+    db: AsyncSession = Depends(dependencies.get_db)
+):
+    """
+    FAKED ENDPOINT: Simulates receiving a batch of trades (e.g. an end-of-day
+    broker drop). Trades are grouped per user/security, matched FIFO in
+    timestamp order and committed in a single transaction.
+    """
+    processed = await processing_service.process_trades(db, trades)
+    return {"message": f"{processed} trades accepted for processing."}
+
 @router.post("/prices", status_code=200)
 async def simulate_price_update(
     price_update: PriceUpdate,
@@ -33,6 +47,22 @@ async def simulate_price_update(
     await db.commit()
     return {"message": f"Price for security {price_update.security_id} updated to {price_update.price}."}
 
+@router.post("/prices:batch", status_code=200)
+async def simulate_price_batch(
+    price_updates: list[PriceUpdate],
+    db: AsyncSession = Depends(dependencies.get_db)
+):
+    """
+    FAKED ENDPOINT: Simulates a price feed pushing many prices at once.
+    All prices are upserted with bulk INSERT ... ON CONFLICT statements and
+    committed together; the last price wins if a security repeats.
+    """
+    from app.repositories.crud_operations import crud_ops
+    prices = {update.security_id: update.price for update in price_updates}
+    changed = await crud_ops.upsert_prices(db, prices)
+    await db.commit()
+    return {"message": f"{len(prices)} prices received, {changed} changed."}
+
 @router.post("/eod-taxes", status_code=200)
 async def simulate_eod_taxes(
     user_id: int = Body(...),
@@ -1,29 +1,114 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+import base64
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.api.v1 import dependencies
+from app.core.config import settings
+from app.database.connection import AsyncSessionLocal
 from app.database.models.tax_lot import TaxLot, LotStatus
+from app.repositories.crud_portfolio import crud_portfolio
 from app.api.v1.schemas.tax_lot import TaxLotRead
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 router = APIRouter()
 
+# Response header carrying the cursor of the next page of a lot listing
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+_LIMIT = Query(None, ge=1, le=settings.TAXLOT_PAGE_MAX_LIMIT, description="Page size; all lots if omitted.")
+_CURSOR = Query(None, description="next_cursor of the previous page.")
+
+
+def _encode_cursor(lot: TaxLot) -> str:
+    raw = f"{lot.open_date.isoformat()}|{lot.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        open_date, lot_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(open_date), int(lot_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _paginate(stmt, cursor: Optional[str], limit: Optional[int]):
+    """
+    Order by (open_date, id) and continue after ``cursor``. Fetches one row
+    past ``limit`` so the caller can tell whether another page exists.
+    """
+    stmt = stmt.order_by(TaxLot.open_date.asc(), TaxLot.id.asc())
+    if cursor is not None:
+        stmt = stmt.where(tuple_(TaxLot.open_date, TaxLot.id) > tuple_(*_decode_cursor(cursor)))
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+    return stmt
+
+
+def _split_page(lots, limit: Optional[int]) -> tuple[list, Optional[str]]:
+    """The page and the cursor of the next one (None on the last page)."""
+    if limit is None or len(lots) <= limit:
+        return lots, None
+    lots = lots[:limit]
+    return lots, _encode_cursor(lots[-1])
+
+
 @router.get("/", response_model=list[TaxLotRead])
 async def list_taxlots(
+    response: Response,
     user_id: int = Query(...),
     security_id: int | None = Query(None),
     status: LotStatus | None = Query(None),
+    stream: bool = Query(False, description="Stream the lots as NDJSON, one TaxLotRead per line."),
+    limit: int | None = _LIMIT,
+    cursor: str | None = _CURSOR,
     db: AsyncSession = Depends(dependencies.get_db),
 ):
+    """
+    Lists a user's lots by open date. With ``limit`` the listing is paged:
+    the cursor of the next page is returned in the X-Next-Cursor header,
+    which is absent on the last page. Streamed listings are not paged but
+    can resume from a cursor.
+    """
     stmt = select(TaxLot).where(TaxLot.user_id == user_id)
     if security_id is not None:
         stmt = stmt.where(TaxLot.security_id == security_id)
     if status is not None:
         stmt = stmt.where(TaxLot.status == status)
-    stmt = stmt.order_by(TaxLot.open_date.asc())
-    res = await db.execute(stmt)
-    return res.scalars().all()
+    if stream:
+        return StreamingResponse(
+            _stream_ndjson(_paginate(stmt, cursor, None), TaxLotRead.model_validate, scalars=True),
+            media_type="application/x-ndjson",
+        )
+    res = await db.execute(_paginate(stmt, cursor, limit))
+    lots, next_cursor = _split_page(res.scalars().all(), limit)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return lots
+
+
+async def _stream_ndjson(stmt, dump, head: Optional[BaseModel] = None, scalars: bool = False):
+    """
+    Yield NDJSON chunks of ``dump(row)`` for rows read through a server-side
+    cursor, so memory stays flat however many lots match. ``head`` is sent
+    as the first line.
+    """
+    if head is not None:
+        yield head.model_dump_json() + "\n"
+    batch_size = settings.TAXLOT_STREAM_BATCH_SIZE
+    # Own session, held open for as long as the body is being sent
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        if scalars:
+            result = result.scalars()
+        async for partition in result.partitions():
+            # Sent rows are only weakly referenced by the session and are freed here
+            yield "".join(dump(row).model_dump_json() + "\n" for row in partition)
 
 
 # Event Master Integration Schema
@@ -42,10 +127,111 @@ class EventMasterSecurityResponse(BaseModel):
     total_remaining_qty: float
     total_users_affected: int
     lots: List[EventMasterResponse]
+    next_cursor: Optional[str] = None  # Set when more lots follow this page
+
+class EventMasterBulkRequest(BaseModel):
+    security_ids: List[int] = Field(..., min_length=1, max_length=settings.EVENT_MASTER_BULK_MAX_SECURITIES)
+    include_lots: bool = False
+
+class EventMasterBulkResponse(BaseModel):
+    securities: List[EventMasterSecurityResponse]  # Securities with open lots, by security_id
+    not_found: List[int]  # Requested securities without open lots
+
+def _open_lot_filter():
+    return (
+        TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL]),
+        TaxLot.remaining_qty > 0,
+    )
+
+
+# Lot columns reported to the Event Master, read as plain rows rather than ORM objects
+_EVENT_LOT_COLUMNS = (
+    TaxLot.id, TaxLot.user_id, TaxLot.security_id, TaxLot.open_qty,
+    TaxLot.remaining_qty, TaxLot.open_price, TaxLot.open_date, TaxLot.status,
+)
+
+
+def _event_lot(row) -> EventMasterResponse:
+    return EventMasterResponse(
+        user_id=row.user_id,
+        security_id=row.security_id,
+        open_qty=float(row.open_qty),
+        remaining_qty=float(row.remaining_qty),
+        open_price=float(row.open_price),
+        open_date=row.open_date.isoformat(),
+        status=row.status.value
+    )
+
+
+async def _event_master_totals(db: AsyncSession, security_ids) -> dict:
+    """(open lots, remaining quantity, users) per security with open lots, in one grouped query."""
+    if settings.EVENT_MASTER_USE_EXPOSURE:
+        exposures = await crud_portfolio.get_security_exposures(db, security_ids)
+        return {
+            security_id: (row.open_lots, float(row.remaining_qty), row.holders)
+            for security_id, row in exposures.items()
+        }
+    result = await db.execute(
+        select(
+            TaxLot.security_id,
+            func.count(TaxLot.id),
+            func.sum(TaxLot.remaining_qty),
+            func.count(TaxLot.user_id.distinct()),
+        )
+        .where(TaxLot.security_id.in_(security_ids), *_open_lot_filter())
+        .group_by(TaxLot.security_id)
+    )
+    return {row[0]: (row[1], float(row[2]), row[3]) for row in result.all()}
+
+
+@router.post("/event-master:bulk", response_model=EventMasterBulkResponse)
+async def get_securities_lots_for_events(
+    request: EventMasterBulkRequest,
+    db: AsyncSession = Depends(dependencies.get_db),
+):
+    """
+    Bulk Event Master Integration Endpoint
+
+    Totals for many securities at once (e.g. an index rebalance), from one
+    grouped query over tax_lots. With ``include_lots`` the open lots of all
+    requested securities are read in one more query; for very widely held
+    securities prefer the paged or streamed single-security endpoint.
+    """
+    security_ids = sorted(set(request.security_ids))
+    totals = await _event_master_totals(db, security_ids)
+    securities = {
+        security_id: EventMasterSecurityResponse(
+            security_id=security_id,
+            total_open_lots=lot_count,
+            total_remaining_qty=remaining_qty,
+            total_users_affected=user_count,
+            lots=[]
+        )
+        for security_id, (lot_count, remaining_qty, user_count) in sorted(totals.items())
+    }
+
+    if request.include_lots and securities:
+        result = await db.execute(
+            select(*_EVENT_LOT_COLUMNS)
+            .where(TaxLot.security_id.in_(list(securities)), *_open_lot_filter())
+            .order_by(TaxLot.security_id, TaxLot.open_date.asc(), TaxLot.id.asc())
+        )
+        for row in result:
+            securities[row.security_id].lots.append(_event_lot(row))
+
+    return EventMasterBulkResponse(
+        securities=list(securities.values()),
+        not_found=[security_id for security_id in security_ids if security_id not in securities],
+    )
+
 
 @router.get("/event-master/{security_id}", response_model=EventMasterSecurityResponse)
 async def get_security_lots_for_event(
     security_id: int,
+    include_lots: bool = Query(True, description="Include lot detail; totals only if false."),
+    stream: bool = Query(False, description="Stream as NDJSON: the totals, then one lot per line."),
+    limit: int | None = _LIMIT,
+    cursor: str | None = _CURSOR,
     db: AsyncSession = Depends(dependencies.get_db),
 ):
     """
@@ -59,50 +245,37 @@ async def get_security_lots_for_event(
     - total_open_lots: Number of open/partial lots
     - total_remaining_qty: Total remaining quantity across all lots
     - total_users_affected: Number of unique users with open positions
-    - lots: List of individual lot details
+    - lots: List of individual lot details (empty with ``include_lots=false``)
+    - next_cursor: Pass as ``cursor`` for the next page of lots (with ``limit``)
+
+    The totals come from one aggregate query and always cover every open
+    lot of the security, not only the page.
     """
-    
-    # Query all open and partial lots for this security
-    stmt = select(TaxLot).where(
-        TaxLot.security_id == security_id,
-        TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL]),
-        TaxLot.remaining_qty > 0
-    ).order_by(TaxLot.open_date.asc())
-    
-    result = await db.execute(stmt)
-    lots = result.scalars().all()
-    
-    if not lots:
+    totals = (await _event_master_totals(db, [security_id])).get(security_id)
+    if totals is None:
         raise HTTPException(
             status_code=404, 
             detail=f"No open or partial lots found for security_id: {security_id}"
         )
-    
-    # Process the data
-    lots_data = []
-    total_remaining_qty = 0
-    unique_users = set()
-    
-    for lot in lots:
-        lots_data.append(EventMasterResponse(
-            user_id=lot.user_id,
-            security_id=lot.security_id,
-            open_qty=float(lot.open_qty),
-            remaining_qty=float(lot.remaining_qty),
-            open_price=float(lot.open_price),
-            open_date=lot.open_date.isoformat(),
-            status=lot.status.value
-        ))
-        
-        total_remaining_qty += float(lot.remaining_qty)
-        unique_users.add(lot.user_id)
-    
-    return EventMasterSecurityResponse(
+    summary = EventMasterSecurityResponse(
         security_id=security_id,
-        total_open_lots=len(lots_data),
-        total_remaining_qty=total_remaining_qty,
-        total_users_affected=len(unique_users),
-        lots=lots_data
+        total_open_lots=totals[0],
+        total_remaining_qty=totals[1],
+        total_users_affected=totals[2],
+        lots=[]
     )
+    if not include_lots:
+        return summary
 
+    # Query the open and partial lots for this security
+    stmt = select(*_EVENT_LOT_COLUMNS).where(TaxLot.security_id == security_id, *_open_lot_filter())
+    if stream:
+        return StreamingResponse(
+            _stream_ndjson(_paginate(stmt, cursor, None), _event_lot, head=summary),
+            media_type="application/x-ndjson",
+        )
 
+    result = await db.execute(_paginate(stmt, cursor, limit))
+    lots, summary.next_cursor = _split_page(result.all(), limit)
+    summary.lots = [_event_lot(lot) for lot in lots]
+    return summary
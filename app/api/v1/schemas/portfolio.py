@@ -1,6 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 from decimal import Decimal
 from datetime import datetime
+from typing import Optional
+
+from app.core.config import settings
 
 class PortfolioPosition(BaseModel):
     security_id: str
@@ -24,4 +27,33 @@ class PortfolioSummary(BaseModel):
 
 class PortfolioSnapshot(BaseModel):
     summary: PortfolioSummary
-    positions: list[PortfolioPosition]
\ No newline at end of file
+    positions: list[PortfolioPosition]
+
+class PortfolioSnapshotRequest(BaseModel):
+    """Users to snapshot: either user_ids or an inclusive user_id_from/user_id_to range."""
+    user_ids: Optional[list[int]] = None
+    user_id_from: Optional[int] = None
+    user_id_to: Optional[int] = None
+
+    @model_validator(mode='after')
+    def validate_selection(self):
+        has_range = self.user_id_from is not None or self.user_id_to is not None
+        if (self.user_ids is None) == (not has_range):
+            raise ValueError("Provide either user_ids or user_id_from and user_id_to")
+        if has_range:
+            if self.user_id_from is None or self.user_id_to is None or self.user_id_from > self.user_id_to:
+                raise ValueError("user_id_from and user_id_to must form a range")
+            count = self.user_id_to - self.user_id_from + 1
+        else:
+            count = len(self.user_ids)
+        if count > settings.SNAPSHOT_BATCH_MAX_USERS:
+            raise ValueError(f"At most {settings.SNAPSHOT_BATCH_MAX_USERS} users per request")
+        return self
+
+class PortfolioSnapshotBatch(BaseModel):
+    snapshots: list[PortfolioSnapshot]  # Users without open positions are omitted
+class PortfolioDelta(BaseModel):
+    """Changes since the previous event on a portfolio stream."""
+    summary: Optional[PortfolioSummary] = None  # Only set if the summary changed
+    positions: list[PortfolioPosition] = []  # New or changed positions
+    removed: list[str] = []  # security_ids no longer held
@@ -1,11 +1,11 @@
 """
 Price update schema
 """
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from decimal import Decimal
 
 
 class PriceUpdate(BaseModel):
     """Schema for price update requests"""
     security_id: int
-    price: Decimal
+    price: Decimal = Field(..., gt=0)
@@ -1,9 +1,10 @@
-from pydantic import BaseModel, field_validator, model_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from datetime import datetime
 from decimal import Decimal
 from typing import Optional
 
 class Trade(BaseModel):
+    trade_id: Optional[str] = Field(None, max_length=64)  # Upstream id; replays of the same id are ignored
     user_id: int
     security_id: int
     side: str # "BUY" or "SELL"
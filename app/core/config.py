@@ -1,3 +1,4 @@
+from typing import Literal
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -15,6 +16,83 @@ class Settings(BaseSettings):
     KAFKA_BOOTSTRAP_SERVERS: str = "kafka:29092"
     KAFKA_TRADES_TOPIC: str = "transactions.enriched"
     KAFKA_CONSUMER_GROUP: str = "position-tracker-group"
+    # Trades are sharded by (user_id, security_id) across this many worker lanes
+    TRADE_CONSUMER_LANES: int = 4
+    TRADE_CONSUMER_LANE_QUEUE_DEPTH: int = 1000
+    # Micro-batches are committed to the DB, then to Kafka, as a unit
+    TRADE_CONSUMER_BATCH_MAX_RECORDS: int = 500
+    TRADE_CONSUMER_BATCH_MAX_WAIT_MS: int = 100
+    TRADE_CONSUMER_RETRY_BACKOFF_MS: int = 500
+    # How long stop() waits for in-flight batches before cancelling them
+    TRADE_CONSUMER_STOP_TIMEOUT_MS: int = 30_000
+    # Price ticks, keyed by security_id; conflated per security within each window
+    KAFKA_PRICES_TOPIC: str = "prices.ticks"
+    KAFKA_PRICE_CONSUMER_GROUP: str = "position-tracker-prices"
+    PRICE_UPDATER_CONFLATION_WINDOW_MS: int = 500
+    PRICE_UPDATER_MAX_RECORDS: int = 5000
+    # Wait before retrying a failed window write or restarting a dead update loop
+    PRICE_UPDATER_RETRY_BACKOFF_MS: int = 500
+
+    # Sell path: "orm" mutates TaxLot objects (one UPDATE per lot on flush),
+    # "core" computes all lot deltas first and applies them in one statement
+    SELL_EXECUTION_MODE: Literal["orm", "core"] = "orm"
+    # Sells against at least this many open lots use the NumPy FIFO kernel (0 = off)
+    FIFO_VECTORIZE_MIN_LOTS: int = 0
+    # Prefix-sum index so sells only load the lots they consume (one query per sell)
+    LOT_INDEX_ENABLED: bool = True
+    LOT_INDEX_MAX_POSITIONS: int = 100_000
+    # Keep portfolio_summary up to date in each trade's transaction
+    PORTFOLIO_SUMMARY_ENABLED: bool = True
+    # Maintain security_exposure (open lots, quantity and holders per security) with each trade
+    SECURITY_EXPOSURE_ENABLED: bool = True
+    # Answer Event Master totals from security_exposure (needs SECURITY_EXPOSURE_ENABLED and a backfill)
+    EVENT_MASTER_USE_EXPOSURE: bool = False
+    # Snapshot aggregation: "sql" groups open lots per security in the database,
+    # "python" loads every open lot and sums them in Decimal, "summary" reads
+    # portfolio_summary (needs PORTFOLIO_SUMMARY_ENABLED and a backfill)
+    SNAPSHOT_AGGREGATION: Literal["sql", "python", "summary"] = "sql"
+    # Per-user snapshot cache, invalidated by trades and price updates in any process
+    # (PostgreSQL NOTIFY); the TTL bounds staleness where NOTIFY is unavailable (0 = no TTL)
+    SNAPSHOT_CACHE_ENABLED: bool = True
+    SNAPSHOT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    SNAPSHOT_CACHE_TTL_SECONDS: float = 30.0
+    # Portfolio streams push at most one delta per interval per client
+    PORTFOLIO_STREAM_MIN_INTERVAL_MS: int = 1000
+    PORTFOLIO_STREAM_KEEPALIVE_SECONDS: float = 15.0
+    # Largest user list (or user_id range) accepted by the batch snapshot endpoint
+    SNAPSHOT_BATCH_MAX_USERS: int = 10_000
+    # Rows fetched per round trip and written per chunk by streamed lot listings
+    TAXLOT_STREAM_BATCH_SIZE: int = 1000
+    # Largest page (limit) accepted by the paginated lot listings
+    TAXLOT_PAGE_MAX_LIMIT: int = 10_000
+    # Most securities accepted by one bulk Event Master request
+    EVENT_MASTER_BULK_MAX_SECURITIES: int = 1000
+    # Latest-price cache; other processes' price changes arrive by PostgreSQL
+    # NOTIFY on PRICE_CACHE_CHANNEL, and the TTL bounds staleness otherwise (0 = no TTL)
+    PRICE_CACHE_ENABLED: bool = True
+    PRICE_CACHE_MAX_SIZE: int = 100_000
+    PRICE_CACHE_TTL_SECONDS: float = 5.0
+    PRICE_CACHE_CHANNEL: str = "price_updates"
+    # PostgreSQL NOTIFY channel for positions changed by trades, followed by every process
+    TRADE_EVENTS_CHANNEL: str = "trade_updates"
+    # Track security -> holders as trades open and close positions
+    HOLDINGS_INDEX_ENABLED: bool = True
+    # Attempts per trade (or batch) when a lot was changed concurrently
+    TRADE_MAX_RETRIES: int = 3
+    # Trade ids remembered in memory so replays skip the processed_trades probe
+    TRADE_DEDUP_CACHE_SIZE: int = 100_000
+    # processed_trades entries older than this are pruned by app.workers.processed_trades_pruner;
+    # keep it longer than any trade can be redelivered (e.g. the Kafka topic's retention)
+    PROCESSED_TRADES_RETENTION_DAYS: int = 30
+    PROCESSED_TRADES_PRUNE_BATCH_SIZE: int = 10_000
+
+    # In-memory lot book (write-behind persistence of tax lots).
+    # Only enable when a single process owns the writes for each position.
+    # Lots unflushed at a crash are lost; recover them with the lot_rebuilder worker.
+    LOT_BOOK_ENABLED: bool = False
+    LOT_BOOK_FLUSH_INTERVAL_MS: int = 200
+    LOT_BOOK_MAX_STALENESS_MS: int = 1000
+    LOT_BOOK_FLUSH_BATCH_SIZE: int = 500
 
     class Config:
         env_file = ".env"
@@ -4,4 +4,8 @@ class PositionTrackerException(Exception):
 
 class PortfolioNotFound(PositionTrackerException):
     """Raised when portfolio data for a user is not found."""
-    pass
\ No newline at end of file
+    pass
+
+class StaleLotError(PositionTrackerException):
+    """Raised when a tax lot was changed by another writer since it was read."""
+    pass
@@ -3,7 +3,9 @@ from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
-# Deprecated persistent portfolio table. Kept only for migrations/backward compat.
+# Per-position aggregate of tax_lots, maintained in the same transaction as each
+# trade when PORTFOLIO_SUMMARY_ENABLED. Check or rebuild it with
+# ``python -m app.workers.summary_checker``.
 class Portfolio(Base):
     __tablename__ = "portfolio_summary"
     
@@ -17,6 +19,8 @@ class Portfolio(Base):
     # Portfolio metrics with precision
     quantity = Column(Numeric(19, 4), nullable=False, default=0)
     avg_cost_basis = Column(Numeric(19, 4), nullable=False, default=0)
+    # Sum of remaining_qty * open_price over open lots, kept unrounded for P&L
+    total_cost = Column(Numeric(28, 8), nullable=False, default=0)
     current_price = Column(Numeric(19, 4), nullable=False, default=0)
     unrealized_pnl = Column(Numeric(19, 4), nullable=False, default=0)
     realized_pnl_ytd = Column(Numeric(19, 4), nullable=False, default=0)
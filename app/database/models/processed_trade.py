@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql import func
+
+Base = declarative_base()
+
+class ProcessedTrade(Base):
+    __tablename__ = "processed_trades"
+
+    # Upstream trade identifier; the primary key doubles as the dedup index
+    trade_id = Column(String(64), primary_key=True)
+
+    # When the trade was applied, for pruning old entries
+    processed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, DateTime, Numeric, func
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+
+# Per-security aggregate of open tax lots, changed in the same transaction as
+# each trade when SECURITY_EXPOSURE_ENABLED. Check or rebuild it with
+# ``python -m app.workers.summary_checker``.
+class SecurityExposure(Base):
+    __tablename__ = "security_exposure"
+
+    security_id = Column(Integer, primary_key=True)
+
+    # Open and partial lots with remaining quantity, across all users
+    open_lots = Column(Integer, nullable=False, default=0)
+    remaining_qty = Column(Numeric(19, 4), nullable=False, default=0)
+    # Users with at least one such lot
+    holders = Column(Integer, nullable=False, default=0)
+
+    last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
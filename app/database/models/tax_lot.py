@@ -64,4 +64,8 @@ class TaxLot(Base):
         Index('idx_security_status_date', 'security_id', 'status', 'open_date'),
         Index('idx_user_date', 'user_id', 'open_date'),
         Index('idx_close_date', 'close_date'),
-    )
\ No newline at end of file
+    )
+
+    # Every ORM UPDATE checks and bumps version, so concurrent sells cannot
+    # both consume the same lot; the loser gets StaleDataError and retries
+    __mapper_args__ = {"version_id_col": version}
\ No newline at end of file
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Numeric, CheckConstraint, Index
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql import func
+
+Base = declarative_base()
+
+# Append-only journal of every accepted trade. Tax lots are derived from it
+# and can be rebuilt with ``python -m app.workers.lot_rebuilder``.
+class TradeRecord(Base):
+    __tablename__ = "trades"
+
+    # Primary key; also the order trades were applied in
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+
+    # Upstream trade identifier, if the producer sent one
+    trade_id = Column(String(64), nullable=True)
+
+    user_id = Column(Integer, nullable=False)
+    security_id = Column(Integer, nullable=False)
+    side = Column(String(4), nullable=False)
+
+    quantity = Column(Numeric(19, 4), nullable=False)
+    # Executed price; for sells without a price this is the market price used
+    price = Column(Numeric(19, 4), nullable=False)
+    charges = Column(Numeric(19, 4), nullable=False, default=0)
+
+    timestamp = Column(DateTime(timezone=True), nullable=False)
+    recorded_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        CheckConstraint("side IN ('BUY', 'SELL')", name='check_trade_side'),
+        CheckConstraint('quantity > 0', name='check_trade_quantity_positive'),
+
+        # Replay order per position
+        Index('idx_trades_user_security_id', 'user_id', 'security_id', 'id'),
+    )
@@ -1,7 +1,11 @@
 from fastapi import FastAPI
 from app.api.v1.routes import portfolios, simulations, taxlots
-from app.database.connection import engine
-from app.database.models import portfolio, tax_lot, price
+from app.database.connection import engine, AsyncSessionLocal
+from app.database.models import portfolio, tax_lot, price, processed_trade, trade, security_exposure
+from app.core.config import settings
+from app.services.lot_book import lot_book
+from app.services.holdings_index import holdings_index
+from app.services.change_listener import change_listener
 
 app = FastAPI(title="Position Tracker API - Local Prototype")
 
@@ -13,6 +17,26 @@ async def on_startup():
         await conn.run_sync(portfolio.Base.metadata.create_all)
         await conn.run_sync(tax_lot.Base.metadata.create_all)
         await conn.run_sync(price.Base.metadata.create_all)
+        await conn.run_sync(processed_trade.Base.metadata.create_all)
+        await conn.run_sync(trade.Base.metadata.create_all)
+        await conn.run_sync(security_exposure.Base.metadata.create_all)
+
+    if settings.HOLDINGS_INDEX_ENABLED:
+        async with AsyncSessionLocal() as db:
+            await holdings_index.load(db)
+
+    if settings.LOT_BOOK_ENABLED:
+        await lot_book.start()
+
+    # Follow prices and trades committed by other processes (PostgreSQL only)
+    await change_listener.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Flush any lots still pending in the write-behind lot book
+    if settings.LOT_BOOK_ENABLED:
+        await lot_book.stop()
+    await change_listener.stop()
 
 # Your existing portfolio router
 app.include_router(portfolios.router, prefix="/api/v1/portfolios", tags=["Portfolios"])
@@ -1,11 +1,36 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func
+from sqlalchemy import and_, or_, delete, func, update, insert, values, column, bindparam, Integer
+from sqlalchemy.dialects import postgresql, sqlite
 from app.database.models.portfolio import Portfolio
 from app.database.models.tax_lot import TaxLot, LotStatus
 from app.database.models.price import SecurityPrice
+from app.database.models.processed_trade import ProcessedTrade
+from app.database.models.trade import TradeRecord
+from app.core.config import settings
+from app.core.exceptions import StaleLotError
+from app.services.event_bus import event_bus, PRICE_UPDATED
+from datetime import datetime
 from decimal import Decimal
 
+# Columns a sell can change on an existing lot
+LOT_UPDATE_COLUMNS = (
+    "remaining_qty", "close_qty", "status", "close_date",
+    "close_price", "realized_pnl", "stcg", "ltcg",
+)
+
+# NOTIFY payloads are limited to 8000 bytes
+_NOTIFY_IDS_PER_PAYLOAD = 500
+_NOTIFY_POSITIONS_PER_PAYLOAD = 250
+# One bind parameter per trade id; asyncpg allows 32767 per statement
+_TRADE_IDS_PER_CLAIM = 10_000
+# Ids per IN list of a lookup, one bind parameter each
+_IDS_PER_LOOKUP = 10_000
+# Lots per UPDATE ... FROM (VALUES ...), ten bind parameters each
+_LOTS_PER_UPDATE = 3_000
+# Two bind parameters per price; asyncpg allows 32767 per statement
+_PRICES_PER_UPSERT = 10_000
+
 class CRUDOperations:
     async def get_portfolio_summary(self, db: AsyncSession, user_id: int, security_id: int):
         result = await db.execute(
@@ -36,10 +61,243 @@ class CRUDOperations:
                 TaxLot.security_id == security_id,
                 TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL])
             )
-            .order_by(TaxLot.open_date.asc())
+            .order_by(TaxLot.open_date.asc(), TaxLot.id.asc())
         )
         return result.scalars().all()
 
+    async def get_open_tax_lots_through(
+        self, db: AsyncSession, user_id: int, security_id: int, lot_ids: list[int], rows: bool = False
+    ):
+        """
+        Open lots of the position in FIFO order, up to the last of ``lot_ids``
+        (given in FIFO order): those lots plus any other open lot that sorts
+        before the last of them. ``rows`` returns plain row mappings instead of
+        ORM objects.
+        """
+        table = TaxLot.__table__
+        last_id = lot_ids[-1]
+        last_open_date = select(table.c.open_date).where(table.c.id == last_id).scalar_subquery()
+        result = await db.execute(
+            select(table if rows else TaxLot)
+            .where(
+                table.c.user_id == user_id,
+                table.c.security_id == security_id,
+                table.c.status.in_([LotStatus.OPEN, LotStatus.PARTIAL]),
+                or_(
+                    table.c.id.in_(lot_ids),
+                    table.c.open_date < last_open_date,
+                    and_(table.c.open_date == last_open_date, table.c.id < last_id),
+                ),
+            )
+            .order_by(table.c.open_date.asc(), table.c.id.asc())
+        )
+        return result.mappings().all() if rows else result.scalars().all()
+
+    async def get_open_tax_lot_rows_fifo(self, db: AsyncSession, user_id: int, security_id: int):
+        """Same as get_open_tax_lots_fifo, but returns plain row mappings instead of ORM objects."""
+        table = TaxLot.__table__
+        result = await db.execute(
+            select(table)
+            .where(
+                table.c.user_id == user_id,
+                table.c.security_id == security_id,
+                table.c.status.in_([LotStatus.OPEN, LotStatus.PARTIAL])
+            )
+            .order_by(table.c.open_date.asc(), table.c.id.asc())
+        )
+        return result.mappings().all()
+
+    async def insert_lots(self, db: AsyncSession, rows: list[dict]):
+        """Insert new lots with a single executemany."""
+        if rows:
+            await db.execute(insert(TaxLot.__table__), rows)
+
+    async def apply_lot_updates(self, db: AsyncSession, rows: list[dict]) -> int:
+        """
+        Apply per-lot sell deltas in one round-trip.
+
+        Each row needs ``id`` and the ``version`` it was read at, plus the
+        LOT_UPDATE_COLUMNS. A lot is only updated if its version is unchanged,
+        and its version is bumped. PostgreSQL gets UPDATE ... FROM (VALUES ...)
+        per chunk of lots; other dialects an executemany of one UPDATE, or one
+        UPDATE per lot where the driver cannot count executemany rows.
+
+        Raises StaleLotError if any lot was changed by another writer.
+        Returns the number of lots updated.
+        """
+        if not rows:
+            return 0
+        table = TaxLot.__table__
+        dialect = db.bind.dialect
+
+        if dialect.name == "postgresql":
+            updated = 0
+            for start in range(0, len(rows), _LOTS_PER_UPDATE):
+                chunk = rows[start:start + _LOTS_PER_UPDATE]
+                deltas = values(
+                    column("id", Integer),
+                    column("version", Integer),
+                    *(column(name, table.c[name].type) for name in LOT_UPDATE_COLUMNS),
+                    name="lot_deltas",
+                ).data([(row["id"], row["version"], *(row[name] for name in LOT_UPDATE_COLUMNS)) for row in chunk])
+                stmt = (
+                    update(table)
+                    .where(table.c.id == deltas.c.id, table.c.version == deltas.c.version)
+                    .values({**{name: deltas.c[name] for name in LOT_UPDATE_COLUMNS}, "version": table.c.version + 1})
+                )
+                updated += (await db.execute(stmt)).rowcount
+        else:
+            stmt = (
+                update(table)
+                .where(table.c.id == bindparam("b_id"), table.c.version == bindparam("b_version"))
+                .values({**{name: bindparam(f"b_{name}") for name in LOT_UPDATE_COLUMNS}, "version": table.c.version + 1})
+            )
+            params = [
+                {"b_id": row["id"], "b_version": row["version"], **{f"b_{name}": row[name] for name in LOT_UPDATE_COLUMNS}}
+                for row in rows
+            ]
+            if len(params) == 1 or dialect.supports_sane_multi_rowcount:
+                updated = (await db.execute(stmt, params)).rowcount
+            else:
+                # The executemany rowcount cannot be trusted; check each lot's version on its own
+                updated = 0
+                for param in params:
+                    updated += (await db.execute(stmt, param)).rowcount
+
+        if updated != len(rows):
+            raise StaleLotError(
+                f"{len(rows) - updated} of {len(rows)} tax lots were modified concurrently."
+            )
+        return updated
+
+    async def copy_lots(self, db: AsyncSession, rows: list[dict], table=TaxLot.__table__):
+        """
+        Bulk-load lot rows into ``table``: COPY on PostgreSQL, a single
+        executemany elsewhere. Rows must all have the same keys.
+        """
+        if not rows:
+            return
+        if db.bind.dialect.name == "postgresql":
+            columns = list(rows[0])
+            connection = await (await db.connection()).get_raw_connection()
+            await connection.driver_connection.copy_records_to_table(
+                table.name,
+                records=[tuple(row[name] for name in columns) for row in rows],
+                columns=columns,
+            )
+        else:
+            await db.execute(insert(table), rows)
+
+    async def append_trades(self, db: AsyncSession, rows: list[dict]):
+        """Append accepted trades to the trade journal."""
+        if rows:
+            await db.execute(insert(TradeRecord.__table__), rows)
+
+    async def claim_trade_ids(self, db: AsyncSession, trade_ids: list[str]) -> set[str]:
+        """
+        Record trade ids as processed in the current transaction.
+
+        Uses INSERT ... ON CONFLICT DO NOTHING, so the unique index both checks
+        and claims in one statement. Returns the ids that were not seen before;
+        ids already in processed_trades are duplicates and must be skipped.
+        """
+        dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        claimed: set[str] = set()
+        for start in range(0, len(trade_ids), _TRADE_IDS_PER_CLAIM):
+            result = await db.execute(
+                dialect_insert(ProcessedTrade)
+                .values([{"trade_id": trade_id} for trade_id in trade_ids[start:start + _TRADE_IDS_PER_CLAIM]])
+                .on_conflict_do_nothing(index_elements=[ProcessedTrade.trade_id])
+                .returning(ProcessedTrade.trade_id)
+            )
+            claimed.update(result.scalars().all())
+        return claimed
+
+    async def prune_processed_trades(self, db: AsyncSession, before: datetime, batch_size: int) -> int:
+        """
+        Delete up to ``batch_size`` processed_trades entries recorded before
+        ``before``. Returns the number deleted; call until it is below batch_size.
+        """
+        expired = (
+            select(ProcessedTrade.trade_id)
+            .where(ProcessedTrade.processed_at < before)
+            .limit(batch_size)
+        )
+        result = await db.execute(delete(ProcessedTrade).where(ProcessedTrade.trade_id.in_(expired)))
+        return result.rowcount
+
+    async def get_open_position_aggregates(self, db: AsyncSession, user_id: int):
+        """
+        One row per held security: (security_id, quantity, cost, price), where
+        cost is the sum of remaining_qty * open_price and price is the latest
+        price or None. Aggregated in a single GROUP BY with a LEFT JOIN.
+        """
+        result = await db.execute(
+            select(
+                TaxLot.security_id,
+                func.sum(TaxLot.remaining_qty).label("quantity"),
+                func.sum(TaxLot.remaining_qty * TaxLot.open_price).label("cost"),
+                SecurityPrice.price,
+            )
+            .outerjoin(SecurityPrice, SecurityPrice.security_id == TaxLot.security_id)
+            .where(
+                TaxLot.user_id == user_id,
+                TaxLot.remaining_qty > 0,
+                TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL])
+            )
+            .group_by(TaxLot.security_id, SecurityPrice.price)
+            .order_by(TaxLot.security_id)
+        )
+        return result.all()
+
+    async def get_realized_totals(self, db: AsyncSession, user_id: int, start_date, end_date):
+        """(realized_pnl, stcg, ltcg) summed over lots closed, fully or partly, in the period."""
+        result = await db.execute(
+            select(
+                func.coalesce(func.sum(TaxLot.realized_pnl), 0),
+                func.coalesce(func.sum(TaxLot.stcg), 0),
+                func.coalesce(func.sum(TaxLot.ltcg), 0),
+            )
+            .where(
+                TaxLot.user_id == user_id,
+                TaxLot.close_date.isnot(None),
+                TaxLot.close_date.between(start_date, end_date)
+            )
+        )
+        return result.one()
+
+    async def has_open_lots(self, db: AsyncSession, user_id: int, security_id: int) -> bool:
+        result = await db.execute(
+            select(TaxLot.id)
+            .where(
+                TaxLot.user_id == user_id,
+                TaxLot.security_id == security_id,
+                TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL])
+            )
+            .limit(1)
+        )
+        return result.first() is not None
+
+    async def get_lot_versions(self, db: AsyncSession, lot_ids) -> dict[int, int]:
+        """Current version per tax lot id, one query per chunk of ids. Deleted lots are absent."""
+        versions = {}
+        lot_ids = list(lot_ids)
+        for start in range(0, len(lot_ids), _IDS_PER_LOOKUP):
+            result = await db.execute(
+                select(TaxLot.id, TaxLot.version).where(TaxLot.id.in_(lot_ids[start:start + _IDS_PER_LOOKUP]))
+            )
+            versions.update(result.all())
+        return versions
+
+    async def get_open_positions(self, db: AsyncSession):
+        """Distinct (security_id, user_id) pairs with open or partial lots."""
+        result = await db.execute(
+            select(TaxLot.security_id, TaxLot.user_id)
+            .where(TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL]))
+            .distinct()
+        )
+        return result.all()
+
     async def get_capital_gains_report(self, db: AsyncSession, user_id: int, year: int):
         """
         Generate capital gains report grouped by STCG/LTCG.
@@ -65,18 +323,83 @@ class CRUDOperations:
 
     
     async def upsert_price(self, db: AsyncSession, security_id: int, price: Decimal):
-        existing = await db.execute(select(SecurityPrice).where(SecurityPrice.security_id == security_id))
-        row = existing.scalars().first()
-        if row:
-            row.price = price
-        else:
-            db.add(SecurityPrice(security_id=security_id, price=price))
-        await db.flush()
+        await self.upsert_prices(db, {security_id: price})
+
+    async def upsert_prices(self, db: AsyncSession, prices: dict[int, Decimal]) -> int:
+        """
+        Write many latest prices with INSERT ... ON CONFLICT (security_id)
+        DO UPDATE, one statement per _PRICES_PER_UPSERT prices.
+
+        Rows whose price is unchanged are left alone (updated_at is when the
+        price last changed). Only changed securities are announced to price
+        caches and PRICE_UPDATED subscribers. Returns how many changed.
+        """
+        dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        items = list(prices.items())
+        changed: dict[int, Decimal] = {}
+        for start in range(0, len(items), _PRICES_PER_UPSERT):
+            stmt = dialect_insert(SecurityPrice).values([
+                {"security_id": security_id, "price": price}
+                for security_id, price in items[start:start + _PRICES_PER_UPSERT]
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[SecurityPrice.security_id],
+                set_={"price": stmt.excluded.price, "updated_at": func.now()},
+                where=SecurityPrice.price != stmt.excluded.price,
+            ).returning(SecurityPrice.security_id, SecurityPrice.price)
+            changed.update((await db.execute(stmt)).all())
+
+        await self.notify_price_changes(db, list(changed))
+        for security_id, price in changed.items():
+            event_bus.publish_after_commit(db, PRICE_UPDATED, security_id=security_id, price=price)
+        return len(changed)
+
+    async def notify_price_changes(self, db: AsyncSession, security_ids: list[int]):
+        """
+        On PostgreSQL, NOTIFY other processes' price caches of the changed
+        securities. Delivered when the transaction commits, never on rollback.
+        """
+        if db.bind.dialect.name != "postgresql":
+            return
+        for start in range(0, len(security_ids), _NOTIFY_IDS_PER_PAYLOAD):
+            payload = ",".join(str(security_id) for security_id in security_ids[start:start + _NOTIFY_IDS_PER_PAYLOAD])
+            await db.execute(select(func.pg_notify(settings.PRICE_CACHE_CHANNEL, payload)))
+
+    async def notify_trade_changes(self, db: AsyncSession, changes):
+        """
+        On PostgreSQL, NOTIFY other processes of positions changed by trades.
+        ``changes`` are (user_id, security_id, holding) with holding None if
+        not known. Delivered when the transaction commits, never on rollback.
+        """
+        if db.bind.dialect.name != "postgresql":
+            return
+        changes = list(changes)
+        for start in range(0, len(changes), _NOTIFY_POSITIONS_PER_PAYLOAD):
+            payload = ",".join(
+                f"{user_id}:{security_id}:{'' if holding is None else int(holding)}"
+                for user_id, security_id, holding in changes[start:start + _NOTIFY_POSITIONS_PER_PAYLOAD]
+            )
+            await db.execute(select(func.pg_notify(settings.TRADE_EVENTS_CHANNEL, payload)))
 
     async def get_latest_price(self, db: AsyncSession, security_id: int) -> Decimal | None:
         result = await db.execute(select(SecurityPrice).where(SecurityPrice.security_id == security_id))
         row = result.scalars().first()
         return row.price if row else None
 
+    async def get_latest_prices(self, db: AsyncSession, security_ids) -> dict[int, Decimal]:
+        """
+        Latest prices for many securities, one query per chunk of ids.
+        Securities without a price are absent.
+        """
+        prices = {}
+        security_ids = list(security_ids)
+        for start in range(0, len(security_ids), _IDS_PER_LOOKUP):
+            result = await db.execute(
+                select(SecurityPrice.security_id, SecurityPrice.price)
+                .where(SecurityPrice.security_id.in_(security_ids[start:start + _IDS_PER_LOOKUP]))
+            )
+            prices.update(result.all())
+        return prices
+
 crud_ops = CRUDOperations()
 
@@ -1,13 +1,38 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import Select, and_, case, delete, func, or_, text, true, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from app.database.models.portfolio import Portfolio
+from app.database.models.security_exposure import SecurityExposure
 from app.database.models.tax_lot import TaxLot, LotStatus
 
+# asyncpg allows at most 32767 bind parameters per statement
+_MAX_IN_PARAMS = 10_000
+
+# portfolio_summary columns derived from tax_lots
+SUMMARY_COLUMNS = ("quantity", "total_cost", "avg_cost_basis", "realized_pnl_ytd", "stcg_ytd", "ltcg_ytd")
+# security_exposure columns derived from tax_lots
+EXPOSURE_COLUMNS = ("open_lots", "remaining_qty", "holders")
+
+_IS_OPEN = and_(TaxLot.remaining_qty > 0, TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL]))
+
+
+def _closed_in(year: int):
+    # Same year boundaries as the snapshot's realized gains
+    return TaxLot.close_date.between(datetime(year, 1, 1), datetime(year, 12, 31))
+
+
+def _dialect_insert(db: AsyncSession):
+    return postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+
 class CRUDPortfolio:
     async def get_portfolio_by_user(self, db: AsyncSession, user_id: int):
         result = await db.execute(select(Portfolio).where(Portfolio.user_id == user_id))
         return result.scalars().all()
-    
+
     async def get_open_tax_lots_by_security(
         self, db: AsyncSession, user_id: int, security_id: int
     ):
@@ -23,5 +48,241 @@ class CRUDPortfolio:
         )
         return result.scalars().all()
 
+    def position_summaries_from_lots(self, year: int):
+        """
+        SELECT of the portfolio_summary values per (user_id, security_id),
+        aggregated from tax_lots with the same rules as the snapshot.
+        """
+        is_open = _IS_OPEN
+        closed_in_year = _closed_in(year)
+
+        def total(value, condition):
+            return func.coalesce(func.sum(case((condition, value), else_=0)), 0)
+
+        quantity = total(TaxLot.remaining_qty, is_open)
+        cost = total(TaxLot.remaining_qty * TaxLot.open_price, is_open)
+        # Lots closed in earlier years contribute nothing; positions with only
+        # such lots get no row (all values zero)
+        return (
+            select(
+                TaxLot.user_id,
+                TaxLot.security_id,
+                quantity.label("quantity"),
+                cost.label("total_cost"),
+                case((quantity > 0, cost / quantity), else_=0).label("avg_cost_basis"),
+                total(TaxLot.realized_pnl, closed_in_year).label("realized_pnl_ytd"),
+                total(TaxLot.stcg, closed_in_year).label("stcg_ytd"),
+                total(TaxLot.ltcg, closed_in_year).label("ltcg_ytd"),
+            )
+            .where(or_(is_open, closed_in_year))
+            .group_by(TaxLot.user_id, TaxLot.security_id)
+        )
+
+    async def lock_positions(self, db: AsyncSession, positions):
+        """
+        Serialize writers of the same positions until the transaction ends,
+        with a PostgreSQL advisory lock per (user_id, security_id) taken in
+        sorted order. Aggregates computed afterwards see every lot committed by
+        earlier holders. SQLite already serializes write transactions.
+        """
+        if db.bind.dialect.name != "postgresql":
+            return
+        positions = sorted(set(positions))
+        if not positions:
+            return
+        await db.execute(
+            text(
+                "SELECT count(pg_advisory_xact_lock(p.user_id, p.security_id)) FROM ("
+                "SELECT * FROM unnest(CAST(:user_ids AS integer[]), CAST(:security_ids AS integer[]))"
+                " AS p(user_id, security_id) ORDER BY user_id, security_id) AS p"
+            ),
+            {
+                "user_ids": [user_id for user_id, _ in positions],
+                "security_ids": [security_id for _, security_id in positions],
+            },
+        )
+
+    async def get_position_summaries(
+        self,
+        db: AsyncSession,
+        year: int,
+        user_ids: Optional[list[int]] = None,
+        user_id_range: Optional[tuple[int, int]] = None,
+    ):
+        """
+        position_summaries_from_lots rows for a list of users or an inclusive
+        user_id range, ordered by user and security. Long lists are split to
+        stay under the driver's bind parameter limit.
+        """
+        stmt = self.position_summaries_from_lots(year).order_by(TaxLot.user_id, TaxLot.security_id)
+        if user_id_range is not None:
+            result = await db.execute(stmt.where(TaxLot.user_id.between(*user_id_range)))
+            return result.all()
+
+        rows = []
+        user_ids = sorted(set(user_ids or ()))
+        for start in range(0, len(user_ids), _MAX_IN_PARAMS):
+            result = await db.execute(stmt.where(TaxLot.user_id.in_(user_ids[start:start + _MAX_IN_PARAMS])))
+            rows.extend(result.all())
+        return rows
+
+    async def refresh_position_summaries(self, db: AsyncSession, positions=None):
+        """
+        Recompute portfolio_summary rows from tax_lots with
+        INSERT ... SELECT ... ON CONFLICT DO UPDATE, one per chunk of positions.
+
+        ``positions`` is an iterable of (user_id, security_id) or a SELECT of
+        those two columns; None refreshes every position. Pending ORM changes
+        must be flushed first.
+        """
+        summaries = self.position_summaries_from_lots(datetime.now().year)
+        key = tuple_(TaxLot.user_id, TaxLot.security_id)
+        if positions is None:
+            await db.execute(self._upsert_summaries(db, summaries))
+            await self._zero_summaries(db, true())
+        elif isinstance(positions, Select):
+            await db.execute(self._upsert_summaries(db, summaries.where(key.in_(positions))))
+            await self._zero_summaries(db, tuple_(Portfolio.user_id, Portfolio.security_id).in_(positions))
+        else:
+            # Two bind parameters per position
+            positions = sorted(set(positions))
+            chunk = _MAX_IN_PARAMS // 2
+            for start in range(0, len(positions), chunk):
+                batch = positions[start:start + chunk]
+                result = await db.execute(
+                    self._upsert_summaries(db, summaries.where(key.in_(batch)))
+                    .returning(Portfolio.user_id, Portfolio.security_id)
+                )
+                missing = set(batch) - set(map(tuple, result.all()))
+                if missing:
+                    await self._zero_summaries(
+                        db, tuple_(Portfolio.user_id, Portfolio.security_id).in_(sorted(missing))
+                    )
+
+    @staticmethod
+    async def _zero_summaries(db: AsyncSession, condition):
+        """Zero the selected portfolio_summary rows of positions left with no aggregated lots."""
+        has_lots = (
+            select(TaxLot.id)
+            .where(
+                TaxLot.user_id == Portfolio.user_id,
+                TaxLot.security_id == Portfolio.security_id,
+                or_(_IS_OPEN, _closed_in(datetime.now().year)),
+            )
+            .exists()
+        )
+        await db.execute(
+            update(Portfolio)
+            .where(condition, ~has_lots)
+            .values({**{name: 0 for name in SUMMARY_COLUMNS}, "last_updated": func.now()})
+        )
+
+    @staticmethod
+    def _upsert_summaries(db: AsyncSession, summaries):
+        # SQLite needs a WHERE to parse INSERT ... SELECT ... ON CONFLICT
+        stmt = _dialect_insert(db)(Portfolio).from_select(
+            ["user_id", "security_id", *SUMMARY_COLUMNS], summaries.where(true())
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[Portfolio.user_id, Portfolio.security_id],
+            set_={**{name: stmt.excluded[name] for name in SUMMARY_COLUMNS}, "last_updated": func.now()},
+        )
+
+    def security_exposures_from_lots(self):
+        """SELECT of the security_exposure values per security_id, aggregated from open tax_lots."""
+        return (
+            select(
+                TaxLot.security_id,
+                func.count(TaxLot.id).label("open_lots"),
+                func.sum(TaxLot.remaining_qty).label("remaining_qty"),
+                func.count(TaxLot.user_id.distinct()).label("holders"),
+            )
+            .where(_IS_OPEN)
+            .group_by(TaxLot.security_id)
+        )
+
+    async def get_security_exposures(self, db: AsyncSession, security_ids) -> dict:
+        """security_exposure rows by security_id, for securities that currently have open lots."""
+        result = await db.execute(
+            select(SecurityExposure).where(
+                SecurityExposure.security_id.in_(list(security_ids)),
+                SecurityExposure.open_lots > 0,
+            )
+        )
+        return {row.security_id: row for row in result.scalars().all()}
+
+    async def get_position_exposures(self, db: AsyncSession, positions) -> dict:
+        """
+        (open lot count, remaining quantity) per (user_id, security_id), for
+        the positions that have open lots. Pending ORM changes must be flushed first.
+        """
+        exposures = {}
+        positions = sorted(set(positions))
+        # Two bind parameters per position
+        chunk = _MAX_IN_PARAMS // 2
+        for start in range(0, len(positions), chunk):
+            result = await db.execute(
+                select(TaxLot.user_id, TaxLot.security_id, func.count(TaxLot.id), func.sum(TaxLot.remaining_qty))
+                .where(tuple_(TaxLot.user_id, TaxLot.security_id).in_(positions[start:start + chunk]), _IS_OPEN)
+                .group_by(TaxLot.user_id, TaxLot.security_id)
+            )
+            exposures.update({(row[0], row[1]): (row[2], Decimal(row[3])) for row in result.all()})
+        return exposures
+
+    async def apply_exposure_changes(self, db: AsyncSession, before: dict, after: dict):
+        """
+        Add the difference between two get_position_exposures results to
+        security_exposure, with one upsert that increments each security's row.
+        """
+        deltas: dict[int, list] = {}
+        for user_id, security_id in before.keys() | after.keys():
+            lots_before, qty_before = before.get((user_id, security_id), (0, Decimal(0)))
+            lots_after, qty_after = after.get((user_id, security_id), (0, Decimal(0)))
+            if lots_before == lots_after and qty_before == qty_after:
+                continue
+            delta = deltas.setdefault(security_id, [0, Decimal(0), 0])
+            delta[0] += lots_after - lots_before
+            delta[1] += qty_after - qty_before
+            delta[2] += (lots_after > 0) - (lots_before > 0)
+        if not deltas:
+            return
+
+        # Sorted so concurrent transactions lock the rows in the same order
+        stmt = _dialect_insert(db)(SecurityExposure).values([
+            {"security_id": security_id, "open_lots": lots, "remaining_qty": qty, "holders": holders}
+            for security_id, (lots, qty, holders) in sorted(deltas.items())
+        ])
+        table = SecurityExposure.__table__
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SecurityExposure.security_id],
+            set_={
+                **{name: table.c[name] + stmt.excluded[name] for name in EXPOSURE_COLUMNS},
+                "last_updated": func.now(),
+            },
+        )
+        await db.execute(stmt)
+
+    async def refresh_security_exposures(self, db: AsyncSession, security_ids=None):
+        """
+        Recompute security_exposure rows from tax_lots. ``security_ids`` is an
+        iterable or a SELECT of ids; None rebuilds the whole table. Pending
+        ORM changes must be flushed first.
+        """
+        exposures = self.security_exposures_from_lots()
+        clear = delete(SecurityExposure)
+        if isinstance(security_ids, Select):
+            exposures = exposures.where(TaxLot.security_id.in_(security_ids))
+            clear = clear.where(SecurityExposure.security_id.in_(security_ids))
+        elif security_ids is not None:
+            security_ids = list(security_ids)
+            if not security_ids:
+                return
+            exposures = exposures.where(TaxLot.security_id.in_(security_ids))
+            clear = clear.where(SecurityExposure.security_id.in_(security_ids))
+        await db.execute(clear)
+        await db.execute(
+            _dialect_insert(db)(SecurityExposure).from_select(["security_id", *EXPOSURE_COLUMNS], exposures)
+        )
+
 # Create a singleton instance
-crud_portfolio = CRUDPortfolio()
\ No newline at end of file
+crud_portfolio = CRUDPortfolio()
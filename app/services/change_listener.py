@@ -0,0 +1,127 @@
+"""
+Cross-process change notifications for the Position Tracker API.
+
+Writers send a PostgreSQL NOTIFY in the writing transaction for every
+security whose price changed (PRICE_CACHE_CHANNEL) and every position a
+trade changed (TRADE_EVENTS_CHANNEL). ``change_listener`` LISTENs on both and
+republishes the changes on the event bus as PRICE_UPDATED and TRADE_APPLIED,
+so caches, the holdings index and portfolio streams also follow writes made
+by other processes. SQLite has no NOTIFY; there other processes' writes are
+only seen once cache TTLs expire.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from app.core.config import settings
+from app.database.connection import engine
+from app.services.event_bus import event_bus, TRADE_APPLIED, PRICE_UPDATED
+from app.services.portfolio_stream import portfolio_streams
+from app.services.price_cache import price_cache
+from app.services.snapshot_cache import snapshot_cache
+
+
+logger = logging.getLogger(__name__)
+
+_HOLDING = {"1": True, "0": False, "": None}
+
+
+def parse_price_notification(payload: str) -> list[int]:
+    """Security ids from a price NOTIFY payload (comma separated)."""
+    return [int(security_id) for security_id in payload.split(",") if security_id]
+
+
+def parse_trade_notification(payload: str) -> list[tuple[int, int, Optional[bool]]]:
+    """
+    (user_id, security_id, holding) from a trade NOTIFY payload: comma
+    separated ``user_id:security_id:holding`` with holding 1, 0 or empty.
+    """
+    changes = []
+    for change in payload.split(","):
+        if change:
+            user_id, security_id, holding = change.split(":")
+            changes.append((int(user_id), int(security_id), _HOLDING[holding]))
+    return changes
+
+
+def _changes_missed() -> None:
+    # Anything may have changed while not listening
+    price_cache.clear()
+    snapshot_cache.clear()
+    portfolio_streams.notify_all()
+
+
+class ChangeListener:
+    """
+    LISTENs for price and trade changes committed by any process and
+    publishes them on the event bus. Only runs on PostgreSQL.
+    """
+
+    def __init__(self, reconnect_seconds: float = 5.0) -> None:
+        self._channels = {
+            settings.PRICE_CACHE_CHANNEL: self._on_price_notify,
+            settings.TRADE_EVENTS_CHANNEL: self._on_trade_notify,
+        }
+        self._reconnect = reconnect_seconds
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None and engine.dialect.name == "postgresql":
+            self._task = asyncio.create_task(self._run())
+            logger.info("Listening for changes on %s.", ", ".join(self._channels))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with engine.connect() as conn:
+                    connection = (await conn.get_raw_connection()).driver_connection
+                    for channel, callback in self._channels.items():
+                        await connection.add_listener(channel, callback)
+                    try:
+                        _changes_missed()
+                        while not connection.is_closed():
+                            await asyncio.sleep(self._reconnect)
+                    finally:
+                        if not connection.is_closed():
+                            for channel, callback in self._channels.items():
+                                await connection.remove_listener(channel, callback)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Change listener failed; reconnecting in %.0fs.", self._reconnect)
+            _changes_missed()
+            await asyncio.sleep(self._reconnect)
+
+    @staticmethod
+    def _on_price_notify(connection, pid, channel, payload) -> None:
+        try:
+            security_ids = parse_price_notification(payload)
+        except ValueError:
+            _changes_missed()
+            return
+        for security_id in security_ids:
+            event_bus.publish(PRICE_UPDATED, security_id=security_id, price=None)
+
+    @staticmethod
+    def _on_trade_notify(connection, pid, channel, payload) -> None:
+        try:
+            changes = parse_trade_notification(payload)
+        except (ValueError, KeyError):
+            _changes_missed()
+            return
+        for user_id, security_id, holding in changes:
+            event_bus.publish(TRADE_APPLIED, user_id=user_id, security_id=security_id, holding=holding)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+
+
+change_listener = ChangeListener()
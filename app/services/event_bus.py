@@ -0,0 +1,69 @@
+"""
+In-process event bus for the Position Tracker API.
+
+Writers queue events on their database session with ``publish_after_commit``.
+They are published once the transaction commits and dropped if it rolls
+back, so subscribers never see changes that did not happen. Subscribers are
+plain callables run synchronously in the committing task: they must be
+cheap and must not do I/O.
+"""
+import logging
+from collections import defaultdict
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger(__name__)
+
+# A trade changed a position's lots. Payload: user_id, security_id and
+# holding (whether open lots remain; None if not known)
+TRADE_APPLIED = "trade_applied"
+# A security's latest price changed. Payload: security_id, price
+PRICE_UPDATED = "price_updated"
+
+# Session.info key for events waiting on the transaction to commit
+_PENDING_EVENTS = "pending_events"
+
+
+class EventBus:
+    """Topic-based publish/subscribe within one process."""
+
+    def __init__(self) -> None:
+        self._subscribers: dict[str, list[Callable]] = defaultdict(list)
+
+    def subscribe(self, topic: str, callback: Callable) -> None:
+        self._subscribers[topic].append(callback)
+
+    def unsubscribe(self, topic: str, callback: Callable) -> None:
+        try:
+            self._subscribers[topic].remove(callback)
+        except ValueError:
+            pass
+
+    def publish(self, topic: str, **payload) -> None:
+        for callback in list(self._subscribers[topic]):
+            try:
+                callback(**payload)
+            except Exception:
+                # One failing subscriber must not affect the writer or the others
+                logger.exception("Subscriber %r failed for %s event.", callback, topic)
+
+    def publish_after_commit(self, db, topic: str, **payload) -> None:
+        """Publish ``topic`` when ``db``'s current transaction commits."""
+        db.info.setdefault(_PENDING_EVENTS, []).append((topic, payload))
+
+
+event_bus = EventBus()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session) -> None:
+    for topic, payload in session.info.pop(_PENDING_EVENTS, []):
+        event_bus.publish(topic, **payload)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop(_PENDING_EVENTS, None)
@@ -0,0 +1,59 @@
+"""
+Security -> holders reverse index for the Position Tracker API.
+
+Maps each security to the users with open or partial lots in it, so a
+price update can find the positions whose unrealized P&L changed without
+scanning tax_lots. The index is loaded once from tax_lots and then kept
+current from TRADE_APPLIED events, i.e. only after trades commit.
+
+It is process-local: trades committed by other processes are not seen.
+Until the index is loaded ``holders`` returns None and callers treat every
+user as a possible holder.
+"""
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.repositories.crud_operations import crud_ops
+from app.services.event_bus import event_bus, TRADE_APPLIED
+
+
+class HoldingsIndex:
+    def __init__(self) -> None:
+        self._holders: dict[int, set[int]] = {}
+        self._loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def load(self, db: AsyncSession) -> None:
+        holders: dict[int, set[int]] = {}
+        for security_id, user_id in await crud_ops.get_open_positions(db):
+            holders.setdefault(security_id, set()).add(user_id)
+        self._holders = holders
+        self._loaded = True
+
+    def holders(self, security_id: int) -> Optional[frozenset[int]]:
+        """Users holding ``security_id``, or None if the index is not loaded."""
+        if not self._loaded:
+            return None
+        return frozenset(self._holders.get(security_id, ()))
+
+    def set_holding(self, user_id: int, security_id: int, holding: Optional[bool]) -> None:
+        """Record a position opening or closing; None means unknown and is ignored."""
+        if holding is None:
+            return
+        if holding:
+            self._holders.setdefault(security_id, set()).add(user_id)
+            return
+        users = self._holders.get(security_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._holders[security_id]
+
+
+holdings_index = HoldingsIndex()
+
+event_bus.subscribe(TRADE_APPLIED, holdings_index.set_holding)
@@ -0,0 +1,389 @@
+"""
+In-memory FIFO lot book for the Position Tracker API.
+
+Open lots are kept per (user_id, security_id) in FIFO order so sells can be
+matched without re-reading tax_lots. Changed lots are written back to the
+database in batches by a background flusher (write-behind).
+
+A transaction checks positions out of the book and changes their lots in
+place. The changes reach the flusher only once the transaction commits
+(commit_changes); on rollback the lots are restored (discard_changes).
+
+Durability: the trade journal and the processed_trades claim commit with the
+trade, but its lot changes reach tax_lots only on a later flush (up to
+LOT_BOOK_MAX_STALENESS_MS). If the process dies in between, those changes are
+lost and redelivery will not reapply the already claimed trades. Run
+app.workers.lot_rebuilder after such a crash to rebuild tax_lots from the
+journal.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.exceptions import StaleLotError
+from app.database.connection import AsyncSessionLocal
+from app.database.models.tax_lot import TaxLot, LotStatus
+from app.repositories.crud_operations import crud_ops
+from app.repositories.crud_portfolio import crud_portfolio
+from app.services.event_bus import event_bus, TRADE_APPLIED
+from app.utils.datetime_utils import ensure_timezone_naive
+
+
+logger = logging.getLogger(__name__)
+
+# Session.info key for positions checked out and lots changed by the open transaction
+_BOOK_CHANGES = "lot_book_changes"
+# BookLot attributes FIFO matching changes, restored when a transaction rolls back
+_MATCHED_FIELDS = ("remaining_qty", "close_qty", "close_date", "close_price", "realized_pnl", "stcg", "ltcg", "status")
+
+
+class BookLot:
+    """Compact in-memory tax lot. Attribute names mirror ``TaxLot``."""
+
+    __slots__ = (
+        "id", "user_id", "security_id", "open_date", "open_qty", "open_price",
+        "charges", "remaining_qty", "close_qty", "close_date", "close_price",
+        "realized_pnl", "stcg", "ltcg", "status", "version",
+    )
+
+    def __init__(
+        self,
+        user_id: int,
+        security_id: int,
+        open_date: datetime,
+        open_qty: Decimal,
+        open_price: Decimal,
+        charges: Decimal = Decimal(0),
+        id: Optional[int] = None,
+        remaining_qty: Optional[Decimal] = None,
+        close_qty: Decimal = Decimal(0),
+        close_date: Optional[datetime] = None,
+        close_price: Optional[Decimal] = None,
+        realized_pnl: Decimal = Decimal(0),
+        stcg: Decimal = Decimal(0),
+        ltcg: Decimal = Decimal(0),
+        status: LotStatus = LotStatus.OPEN,
+        version: int = 1,
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.security_id = security_id
+        self.open_date = open_date
+        self.open_qty = open_qty
+        self.open_price = open_price
+        self.charges = charges
+        self.remaining_qty = open_qty if remaining_qty is None else remaining_qty
+        self.close_qty = close_qty
+        self.close_date = close_date
+        self.close_price = close_price
+        self.realized_pnl = realized_pnl
+        self.stcg = stcg
+        self.ltcg = ltcg
+        self.status = status
+        self.version = version
+
+    @classmethod
+    def from_tax_lot(cls, lot: TaxLot) -> "BookLot":
+        return cls(**{name: getattr(lot, name) for name in cls.__slots__})
+
+    @classmethod
+    def from_row(cls, row) -> "BookLot":
+        return cls(**{name: row[name] for name in cls.__slots__})
+
+    def to_row(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def insert_fifo(open_lots: deque, lot) -> None:
+    """Insert a new lot keeping the open_date order used by FIFO matching."""
+    open_date = ensure_timezone_naive(lot.open_date)
+    if not open_lots or ensure_timezone_naive(open_lots[-1].open_date) <= open_date:
+        open_lots.append(lot)
+        return
+    # Back-dated buy: place it before the first lot opened after it
+    for index, existing in enumerate(open_lots):
+        if ensure_timezone_naive(existing.open_date) > open_date:
+            open_lots.insert(index, lot)
+            return
+
+
+def drop_closed(open_lots: deque) -> None:
+    """Matching consumes from the front, so closed lots always form a prefix."""
+    while open_lots and open_lots[0].status == LotStatus.CLOSED:
+        open_lots.popleft()
+
+
+class LotBook:
+    """
+    Process-local book of open lots with write-behind persistence.
+
+    The book is authoritative for the positions it has loaded, so it must only
+    be enabled where a single process owns the writes for each position.
+    Dirty lots are flushed when the batch size is reached or the oldest
+    unflushed change exceeds the max staleness, checked every flush interval.
+    Positions left without open lots are forgotten once flushed and idle.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        flush_interval_ms: int = settings.LOT_BOOK_FLUSH_INTERVAL_MS,
+        max_staleness_ms: int = settings.LOT_BOOK_MAX_STALENESS_MS,
+        flush_batch_size: int = settings.LOT_BOOK_FLUSH_BATCH_SIZE,
+    ) -> None:
+        self._session_factory = session_factory
+        self._flush_interval = flush_interval_ms / 1000
+        self._max_staleness = max_staleness_ms / 1000
+        self._flush_batch_size = flush_batch_size
+        self._positions: dict[tuple[int, int], deque[BookLot]] = {}
+        # Held by the transaction that has the position checked out
+        self._locks: dict[tuple[int, int], asyncio.Lock] = {}
+        # Transactions holding or waiting for each position's lock
+        self._users: dict[tuple[int, int], int] = {}
+        # Found changed in tax_lots while checked out; dropped once released
+        self._stale: set[tuple[int, int]] = set()
+        # Keyed by object identity; new lots have no primary key until flushed
+        self._dirty: dict[int, BookLot] = {}
+        self._oldest_dirty: float | None = None
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def get_position(self, db: AsyncSession, user_id: int, security_id: int) -> deque[BookLot]:
+        """
+        Check a position out to the transaction of ``db`` and return its open
+        lots. Other transactions wait for the position until this one calls
+        commit_changes or discard_changes.
+        """
+        key = (user_id, security_id)
+        changes = db.info.setdefault(_BOOK_CHANGES, {"positions": {}, "dirty": {}})
+        if key in changes["positions"]:
+            return self._positions[key]
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._leave(key)
+            raise
+        try:
+            lots = self._positions.get(key)
+            if lots is None:
+                rows = await crud_ops.get_open_tax_lots_fifo(db, user_id, security_id)
+                lots = self._positions[key] = deque(BookLot.from_tax_lot(r) for r in rows)
+        except BaseException:
+            self._release(key)
+            raise
+        changes["positions"][key] = (list(lots), [tuple(getattr(lot, name) for name in _MATCHED_FIELDS) for lot in lots])
+        return lots
+
+    def add_lot(self, db: AsyncSession, open_lots: deque[BookLot], lot: BookLot) -> None:
+        insert_fifo(open_lots, lot)
+        self.touch(db, [lot])
+
+    def touch(self, db: AsyncSession, lots: Iterable[BookLot]) -> None:
+        """Mark lots changed by the open transaction dirty once it commits."""
+        dirty = db.info[_BOOK_CHANGES]["dirty"]
+        for lot in lots:
+            dirty[id(lot)] = lot
+
+    def commit_changes(self, db: AsyncSession) -> None:
+        """Hand the committed transaction's lots to the flusher and release its positions."""
+        changes = db.info.pop(_BOOK_CHANGES, None)
+        if changes is None:
+            return
+        self.mark_dirty(changes["dirty"].values())
+        for key in changes["positions"]:
+            self._release(key)
+        self._evict_idle(changes["positions"])
+
+    def discard_changes(self, db: AsyncSession) -> None:
+        """Restore the positions a rolled back transaction changed and release them."""
+        changes = db.info.pop(_BOOK_CHANGES, None)
+        if changes is None:
+            return
+        for key, (lots, values) in changes["positions"].items():
+            for lot, saved in zip(lots, values):
+                for name, value in zip(_MATCHED_FIELDS, saved):
+                    setattr(lot, name, value)
+            self._positions[key] = deque(lots)
+            self._release(key)
+        self._evict_idle(changes["positions"])
+
+    def mark_dirty(self, lots: Iterable[BookLot]) -> None:
+        for lot in lots:
+            self._dirty[id(lot)] = lot
+        if self._dirty and self._oldest_dirty is None:
+            self._oldest_dirty = time.monotonic()
+
+    def _release(self, key: tuple[int, int]) -> None:
+        self._locks[key].release()
+        self._leave(key)
+
+    def _leave(self, key: tuple[int, int]) -> None:
+        users = self._users[key] - 1
+        if users:
+            self._users[key] = users
+            return
+        del self._users[key]
+        if key in self._stale:
+            self._drop(key)
+
+    def _drop(self, key: tuple[int, int]) -> None:
+        """Forget a position and its unflushed lots; it is reloaded from tax_lots when next used."""
+        self._stale.discard(key)
+        self._positions.pop(key, None)
+        self._locks.pop(key, None)
+        for lot_id, lot in list(self._dirty.items()):
+            if (lot.user_id, lot.security_id) == key:
+                del self._dirty[lot_id]
+        if not self._dirty:
+            self._oldest_dirty = None
+
+    def _evict_idle(self, keys: Iterable[tuple[int, int]]) -> None:
+        """Forget positions with no open lots, no unflushed lots and no transaction using them."""
+        idle = [key for key in keys if key in self._positions and not self._positions[key] and key not in self._users]
+        if not idle:
+            return
+        dirty = {(lot.user_id, lot.security_id) for lot in self._dirty.values()}
+        for key in idle:
+            if key not in dirty:
+                del self._positions[key]
+                self._locks.pop(key, None)
+
+    def _checked_out(self, lot: BookLot) -> bool:
+        lock = self._locks.get((lot.user_id, lot.security_id))
+        return lock is not None and lock.locked()
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def _should_flush(self) -> bool:
+        if not self._dirty:
+            return False
+        if len(self._dirty) >= self._flush_batch_size:
+            return True
+        return time.monotonic() - self._oldest_dirty >= self._max_staleness
+
+    async def flush(self) -> int:
+        """Write all dirty lots to tax_lots in one transaction. Returns the lot count."""
+        async with self._flush_lock:
+            # Lots of checked out positions may hold uncommitted changes; they wait for the next flush
+            pending = [lot for lot in self._dirty.values() if not self._checked_out(lot)]
+            if not pending:
+                return 0
+            for lot in pending:
+                del self._dirty[id(lot)]
+            if not self._dirty:
+                self._oldest_dirty = None
+
+            # Snapshot values before awaiting; lots changed during the flush
+            # are marked dirty again and picked up by the next one
+            new_lots = [lot for lot in pending if lot.id is None]
+            inserts = [TaxLot(**{k: v for k, v in lot.to_row().items() if k not in ("id", "version")}) for lot in new_lots]
+            updated_lots = [lot for lot in pending if lot.id is not None]
+            updates = [lot.to_row() for lot in updated_lots]
+
+            new_ids: list[int] = []
+            try:
+                async with self._session_factory() as db:
+                    positions = {(lot.user_id, lot.security_id) for lot in pending}
+                    # Before reading exposures, like ProcessingService._lock_aggregates
+                    await crud_portfolio.lock_positions(db, positions)
+                    if settings.SECURITY_EXPOSURE_ENABLED:
+                        exposures = await crud_portfolio.get_position_exposures(db, positions)
+                    if inserts:
+                        db.add_all(inserts)
+                        await db.flush()
+                        new_ids = [row.id for row in inserts]
+                    await crud_ops.apply_lot_updates(db, updates)
+                    if settings.PORTFOLIO_SUMMARY_ENABLED:
+                        await crud_portfolio.refresh_position_summaries(db, positions)
+                    if settings.SECURITY_EXPOSURE_ENABLED:
+                        await crud_portfolio.apply_exposure_changes(
+                            db, exposures, await crud_portfolio.get_position_exposures(db, positions)
+                        )
+                    # Readers of tax_lots only see these trades once they are flushed
+                    for user_id, security_id in positions:
+                        event_bus.publish_after_commit(
+                            db, TRADE_APPLIED, user_id=user_id, security_id=security_id, holding=None
+                        )
+                    await crud_ops.notify_trade_changes(db, [(*position, None) for position in positions])
+                    await db.commit()
+            except StaleLotError:
+                stale = await self._find_stale(updated_lots)
+                if stale is None:
+                    self.mark_dirty(pending)
+                    raise
+                logger.error(
+                    "Lots of %d position(s) were changed outside the lot book; reloading them from "
+                    "tax_lots and dropping their unflushed changes (run lot_rebuilder to restore them).",
+                    len(stale),
+                )
+                self.mark_dirty(lot for lot in pending if (lot.user_id, lot.security_id) not in stale)
+                for key in stale:
+                    if key in self._users:
+                        self._stale.add(key)
+                    else:
+                        self._drop(key)
+                raise
+            except Exception:
+                logger.exception("Lot book flush of %d lots failed; will retry.", len(pending))
+                self.mark_dirty(pending)
+                raise
+
+            for lot, lot_id in zip(new_lots, new_ids):
+                lot.id = lot_id
+            for lot in updated_lots:
+                lot.version += 1
+            self._evict_idle(positions)
+            return len(pending)
+
+    async def _find_stale(self, lots: list[BookLot]) -> Optional[set[tuple[int, int]]]:
+        """Positions of the lots whose version in tax_lots no longer matches the book, None if unknown."""
+        try:
+            async with self._session_factory() as db:
+                versions = await crud_ops.get_lot_versions(db, [lot.id for lot in lots])
+        except Exception:
+            logger.exception("Looking up stale lots failed; the flush will be retried.")
+            return None
+        return {(lot.user_id, lot.security_id) for lot in lots if versions.get(lot.id) != lot.version}
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Lot book flusher started.")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            if self._should_flush():
+                try:
+                    await self.flush()
+                except Exception:
+                    # Already logged; lots stay dirty for the next tick
+                    pass
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+        await self.flush()
+        logger.info("Lot book flusher stopped.")
+
+
+lot_book = LotBook()
@@ -0,0 +1,106 @@
+"""
+Prefix-sum index over open lots for the Position Tracker API.
+
+For each position the index keeps open lot ids in FIFO order next to the
+running total of their remaining quantity. A sell finds the last lot it
+touches by binary search, so only the lots it consumes need to be loaded.
+
+The index is process-local, so it misses lots committed by other writers.
+Callers validate the lots they load against it, check that no other open
+lot sorts before them, and drop it whenever the database disagrees.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from app.core.config import settings
+from app.utils.datetime_utils import ensure_timezone_naive
+
+
+class PositionIndex:
+    """Open lots of one position with cumulative remaining quantity."""
+
+    __slots__ = ("lot_ids", "cumulative", "start", "consumed", "last_open_date")
+
+    def __init__(self, rows: Iterable[tuple[int, Decimal, datetime]] = ()):
+        self.lot_ids: list[int] = []
+        # cumulative[i] is the total remaining qty of lots[0..i] when the index was built
+        # or the lot was appended; quantity sold since then is tracked in ``consumed``
+        self.cumulative: list[Decimal] = []
+        self.start = 0
+        self.consumed = Decimal(0)
+        self.last_open_date: Optional[datetime] = None
+        for lot_id, remaining_qty, open_date in rows:
+            self.append(lot_id, remaining_qty, open_date)
+
+    @property
+    def open_quantity(self) -> Decimal:
+        return self.cumulative[-1] - self.consumed if self.cumulative else Decimal(0)
+
+    def can_append(self, open_date: datetime) -> bool:
+        """A lot can only be appended if it keeps FIFO (open_date) order."""
+        return self.last_open_date is None or ensure_timezone_naive(open_date) >= self.last_open_date
+
+    def append(self, lot_id: int, quantity: Decimal, open_date: datetime) -> None:
+        total = self.cumulative[-1] if self.cumulative else Decimal(0)
+        self.lot_ids.append(lot_id)
+        self.cumulative.append(total + quantity)
+        self.last_open_date = ensure_timezone_naive(open_date)
+
+    def lots_for(self, quantity: Decimal) -> list[tuple[int, Decimal]]:
+        """Ids and expected remaining quantity of the lots a sell of ``quantity`` touches."""
+        end = bisect_left(self.cumulative, self.consumed + quantity, lo=self.start)
+        end = min(end + 1, len(self.cumulative))
+
+        lots = []
+        previous = self.consumed
+        for i in range(self.start, end):
+            lots.append((self.lot_ids[i], self.cumulative[i] - previous))
+            previous = self.cumulative[i]
+        return lots
+
+    def consume(self, quantity: Decimal) -> None:
+        if not self.cumulative:
+            return
+        self.consumed = min(self.consumed + quantity, self.cumulative[-1])
+        while self.start < len(self.cumulative) and self.cumulative[self.start] <= self.consumed:
+            self.start += 1
+
+        if self.start == len(self.cumulative):
+            # Position fully closed; keep only the FIFO high-water mark
+            self.lot_ids, self.cumulative = [], []
+            self.start, self.consumed = 0, Decimal(0)
+        elif self.start > 1024 and self.start * 2 > len(self.cumulative):
+            del self.lot_ids[:self.start]
+            del self.cumulative[:self.start]
+            self.start = 0
+
+
+class LotIndex:
+    """LRU-bounded collection of PositionIndex keyed by (user_id, security_id)."""
+
+    def __init__(self, max_positions: int = settings.LOT_INDEX_MAX_POSITIONS):
+        self._max_positions = max_positions
+        self._positions: OrderedDict[tuple[int, int], PositionIndex] = OrderedDict()
+
+    def get(self, key: tuple[int, int]) -> Optional[PositionIndex]:
+        index = self._positions.get(key)
+        if index is not None:
+            self._positions.move_to_end(key)
+        return index
+
+    def build(self, key: tuple[int, int], rows: Iterable[tuple[int, Decimal, datetime]]) -> PositionIndex:
+        index = PositionIndex(rows)
+        self._positions[key] = index
+        self._positions.move_to_end(key)
+        while len(self._positions) > self._max_positions:
+            self._positions.popitem(last=False)
+        return index
+
+    def invalidate(self, key: tuple[int, int]) -> None:
+        self._positions.pop(key, None)
+
+
+lot_index = LotIndex()
@@ -1,9 +1,14 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
+from typing import Optional
 from app.api.v1.schemas.portfolio import PortfolioSnapshot, PortfolioSummary, PortfolioPosition
+from app.core.config import settings
 from app.core.exceptions import PortfolioNotFound
 from decimal import Decimal
 from app.repositories.crud_operations import crud_ops
+from app.repositories.crud_portfolio import crud_portfolio
+from app.services.price_service import price_service
+from app.services.snapshot_cache import snapshot_cache
 from app.database.models.tax_lot import TaxLot, LotStatus
 from sqlalchemy.future import select
 
@@ -12,31 +17,97 @@ class PortfolioService:
         """
         Generates a full portfolio snapshot for a given user.
         This method computes PnL and aggregates data based on the formulas provided.
+        Snapshots are served from the snapshot cache while nothing they depend on changed.
         """
-        # Compute on-the-fly from tax lots and latest price
-        result = await db.execute(
-            select(TaxLot.security_id, TaxLot.remaining_qty, TaxLot.open_price)
-            .where(TaxLot.user_id == user_id, TaxLot.remaining_qty > 0, TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL]))
-        )
-        rows = result.all()
-        if not rows:
+        if not settings.SNAPSHOT_CACHE_ENABLED:
+            snapshot, _ = await self._build_snapshot(db, user_id)
+            return snapshot
+
+        cached = snapshot_cache.get(user_id)
+        if cached is not None:
+            return cached
+        token = snapshot_cache.token()
+        snapshot, security_ids = await self._build_snapshot(db, user_id)
+        snapshot_cache.put(user_id, snapshot, security_ids, token)
+        return snapshot
+
+    async def _build_snapshot(self, db: AsyncSession, user_id: int) -> tuple[PortfolioSnapshot, list[int]]:
+        """Compute a snapshot. Also returns every held security, priced or not."""
+        year = datetime.now().year
+        summaries = None
+        if settings.SNAPSHOT_AGGREGATION == "summary":
+            summaries = await crud_portfolio.get_portfolio_by_user(db, user_id)
+            holdings = await self._holdings_from_summaries(db, summaries)
+        elif settings.SNAPSHOT_AGGREGATION == "sql":
+            holdings = await crud_ops.get_open_position_aggregates(db, user_id)
+        else:
+            holdings = await self._aggregate_open_lots(db, user_id)
+        if not holdings:
             raise PortfolioNotFound("No portfolio data found for this user.")
 
-        # Aggregate by security_id
-        by_sec: dict[int, dict[str, Decimal]] = {}
-        for sec_id, rem_qty, open_price in rows:
-            agg = by_sec.setdefault(sec_id, {"qty": Decimal(0), "cost": Decimal(0)})
-            agg["qty"] += rem_qty
-            agg["cost"] += rem_qty * open_price
+        # Gains YTD from closed lots
+        if summaries is not None:
+            # A row last refreshed in an earlier year had nothing closed this year
+            current = [row for row in summaries if row.last_updated is None or row.last_updated.year == year]
+            realized_pnl = sum((row.realized_pnl_ytd for row in current), Decimal(0))
+            st = sum((row.stcg_ytd for row in current), Decimal(0))
+            lt = sum((row.ltcg_ytd for row in current), Decimal(0))
+        else:
+            realized_pnl, st, lt = await crud_ops.get_realized_totals(
+                db, user_id, datetime(year, 1, 1), datetime(year, 12, 31)
+            )
+
+        snapshot = self._assemble_snapshot(user_id, holdings, realized_pnl, st, lt)
+        return snapshot, [holding[0] for holding in holdings]
+
+    async def get_portfolio_snapshots(
+        self,
+        db: AsyncSession,
+        user_ids: Optional[list[int]] = None,
+        user_id_range: Optional[tuple[int, int]] = None,
+    ) -> list[PortfolioSnapshot]:
+        """
+        Snapshots for many users, from one GROUP BY over tax_lots and one
+        security_prices lookup instead of a snapshot query per user.
+        Users without open positions are left out.
+        """
+        rows = await crud_portfolio.get_position_summaries(
+            db, datetime.now().year, user_ids=user_ids, user_id_range=user_id_range
+        )
+        prices = await price_service.get_prices(db, {row.security_id for row in rows if row.quantity > 0})
 
+        by_user: dict[int, list] = {}
+        for row in rows:
+            by_user.setdefault(row.user_id, []).append(row)
+
+        snapshots = []
+        for user_id, user_rows in by_user.items():
+            holdings = [
+                (row.security_id, row.quantity, row.total_cost, prices.get(row.security_id))
+                for row in user_rows
+                if row.quantity > 0
+            ]
+            if not holdings:
+                continue
+            snapshots.append(self._assemble_snapshot(
+                user_id,
+                holdings,
+                sum((row.realized_pnl_ytd for row in user_rows), Decimal(0)),
+                sum((row.stcg_ytd for row in user_rows), Decimal(0)),
+                sum((row.ltcg_ytd for row in user_rows), Decimal(0)),
+            ))
+        return snapshots
+
+    @staticmethod
+    def _assemble_snapshot(user_id: int, holdings, realized_pnl: Decimal, st: Decimal, lt: Decimal) -> PortfolioSnapshot:
+        """Build a snapshot from (security_id, quantity, cost, price) holdings and YTD gains."""
         positions: list[PortfolioPosition] = []
         total_market_value = Decimal(0)
         total_unrealized_pnl = Decimal(0)
 
-        for sec_id, agg in by_sec.items():
-            qty = agg["qty"]
-            avg_cost = (agg["cost"] / qty) if qty > 0 else Decimal(0)
-            price = await crud_ops.get_latest_price(db, sec_id) or Decimal(0)
+        for sec_id, qty, cost, price in holdings:
+            avg_cost = (cost / qty) if qty > 0 else Decimal(0)
+            price = price or Decimal(0)
             
             # If no price data, skip this position to avoid showing $0 market value
             if price == 0:
@@ -55,24 +126,6 @@ class PortfolioService:
             total_market_value += market_value
             total_unrealized_pnl += unreal
 
-        # Gains YTD from closed lots
-        from datetime import date
-        year = datetime.now().year
-        start_date = datetime(year, 1, 1)
-        end_date = datetime(year, 12, 31)
-        res = await db.execute(
-            select(TaxLot.realized_pnl, TaxLot.stcg, TaxLot.ltcg)
-            .where(
-                TaxLot.user_id == user_id,
-                TaxLot.close_date.isnot(None),
-                TaxLot.close_date.between(start_date, end_date)
-            )
-        )
-        rows2 = res.all()
-        realized_pnl = sum((r[0] or Decimal(0)) for r in rows2) if rows2 else Decimal(0)
-        st = sum((r[1] or Decimal(0)) for r in rows2) if rows2 else Decimal(0)
-        lt = sum((r[2] or Decimal(0)) for r in rows2) if rows2 else Decimal(0)
-
         summary = PortfolioSummary(
             user_id=user_id,
             total_market_value=total_market_value,
@@ -85,5 +138,28 @@ class PortfolioService:
 
         return PortfolioSnapshot(summary=summary, positions=positions)
 
+    async def _holdings_from_summaries(self, db: AsyncSession, summaries) -> list[tuple]:
+        """Holdings from portfolio_summary rows: one row per position, no lot scan."""
+        held = [row for row in summaries if row.quantity > 0]
+        prices = await price_service.get_prices(db, [row.security_id for row in held])
+        return [(row.security_id, row.quantity, row.total_cost, prices.get(row.security_id)) for row in held]
+
+    async def _aggregate_open_lots(self, db: AsyncSession, user_id: int) -> list[tuple]:
+        """Python fallback for crud_ops.get_open_position_aggregates: sums every open lot row."""
+        result = await db.execute(
+            select(TaxLot.security_id, TaxLot.remaining_qty, TaxLot.open_price)
+            .where(TaxLot.user_id == user_id, TaxLot.remaining_qty > 0, TaxLot.status.in_([LotStatus.OPEN, LotStatus.PARTIAL]))
+        )
+
+        # Aggregate by security_id
+        by_sec: dict[int, dict[str, Decimal]] = {}
+        for sec_id, rem_qty, open_price in result.all():
+            agg = by_sec.setdefault(sec_id, {"qty": Decimal(0), "cost": Decimal(0)})
+            agg["qty"] += rem_qty
+            agg["cost"] += rem_qty * open_price
+
+        prices = await price_service.get_prices(db, by_sec.keys())
+        return [(sec_id, agg["qty"], agg["cost"], prices.get(sec_id)) for sec_id, agg in by_sec.items()]
+
 # Create a singleton instance
 portfolio_service = PortfolioService()
\ No newline at end of file
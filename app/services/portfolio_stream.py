@@ -0,0 +1,151 @@
+"""
+Live portfolio streams for the Position Tracker API.
+
+Each client of the stream endpoint gets a full snapshot first and then
+deltas whenever a trade for the user commits or a price the user holds
+changes, in this or (through ``change_listener``) any other process.
+Bursts of changes are coalesced so a client receives at most one event per
+interval.
+"""
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Optional
+
+from app.api.v1.schemas.portfolio import PortfolioDelta, PortfolioSnapshot
+from app.core.exceptions import PortfolioNotFound
+from app.database.connection import AsyncSessionLocal
+from app.services.event_bus import event_bus, TRADE_APPLIED, PRICE_UPDATED
+from app.services.holdings_index import holdings_index
+from app.services.portfolio_service import portfolio_service
+
+
+class _Subscriber:
+    __slots__ = ("user_id", "changed")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.changed = asyncio.Event()
+
+
+class PortfolioStreams:
+    """Registry of open streams, woken by trade and price events."""
+
+    def __init__(self) -> None:
+        self._subscribers: dict[int, set[_Subscriber]] = {}
+
+    def subscribe(self, user_id: int) -> _Subscriber:
+        subscriber = _Subscriber(user_id)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.user_id]
+
+    @property
+    def client_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def notify_user(self, user_id: int) -> None:
+        for subscriber in self._subscribers.get(user_id, ()):
+            subscriber.changed.set()
+
+    def notify_all(self) -> None:
+        for user_id in list(self._subscribers):
+            self.notify_user(user_id)
+
+    def notify_security(self, security_id: int) -> None:
+        holders = holdings_index.holders(security_id)
+        # Without the holdings index every streamed user might hold the security
+        users = list(self._subscribers) if holders is None else holders
+        for user_id in users:
+            self.notify_user(user_id)
+
+    async def stream(
+        self,
+        user_id: int,
+        min_interval: float,
+        keepalive: float,
+    ) -> AsyncIterator[tuple[str, Optional[str]]]:
+        """
+        Yield (event, data) pairs: a "snapshot" event first, then "delta"
+        events. ``data`` is None for keep-alives.
+        """
+        subscriber = self.subscribe(user_id)
+        try:
+            previous = await self._snapshot(user_id)
+            yield "snapshot", _dump_snapshot(previous)
+            last_sent = time.monotonic()
+
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.changed.wait(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield "keepalive", None
+                    continue
+
+                # Coalesce: changes arriving until the interval is up go into one delta
+                await asyncio.sleep(max(0.0, last_sent + min_interval - time.monotonic()))
+                subscriber.changed.clear()
+
+                current = await self._snapshot(user_id)
+                delta = diff_snapshots(previous, current)
+                previous = current
+                if delta is not None:
+                    yield "delta", delta.model_dump_json()
+                    last_sent = time.monotonic()
+        finally:
+            self.unsubscribe(subscriber)
+
+    @staticmethod
+    async def _snapshot(user_id: int) -> Optional[PortfolioSnapshot]:
+        # A short-lived session per refresh; the stream itself can stay open for hours
+        async with AsyncSessionLocal() as db:
+            try:
+                return await portfolio_service.get_portfolio_snapshot(db, user_id)
+            except PortfolioNotFound:
+                return None
+
+
+# Snapshot event for a user without a portfolio: no summary and no positions
+_EMPTY_SNAPSHOT = json.dumps({"summary": None, "positions": []}, separators=(",", ":"))
+
+
+def _dump_snapshot(snapshot: Optional[PortfolioSnapshot]) -> str:
+    if snapshot is None:
+        return _EMPTY_SNAPSHOT
+    return snapshot.model_dump_json()
+
+
+def diff_snapshots(
+    previous: Optional[PortfolioSnapshot],
+    current: Optional[PortfolioSnapshot],
+) -> Optional[PortfolioDelta]:
+    """Changes from ``previous`` to ``current``, or None if nothing changed."""
+    old = {p.security_id: p for p in previous.positions} if previous else {}
+    new = {p.security_id: p for p in current.positions} if current else {}
+
+    changed = [position for security_id, position in new.items() if old.get(security_id) != position]
+    removed = [security_id for security_id in old if security_id not in new]
+
+    summary = current.summary if current else None
+    previous_summary = previous.summary if previous else None
+    # last_updated changes on every recompute and is not a change by itself
+    if summary is not None and previous_summary is not None and summary.model_dump(
+        exclude={"last_updated"}
+    ) == previous_summary.model_dump(exclude={"last_updated"}):
+        summary = None
+
+    if not changed and not removed and summary is None:
+        return None
+    return PortfolioDelta(summary=summary, positions=changed, removed=removed)
+
+
+portfolio_streams = PortfolioStreams()
+
+event_bus.subscribe(TRADE_APPLIED, lambda user_id, **_: portfolio_streams.notify_user(user_id))
+event_bus.subscribe(PRICE_UPDATED, lambda security_id, **_: portfolio_streams.notify_security(security_id))
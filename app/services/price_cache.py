@@ -0,0 +1,89 @@
+"""
+Latest-price cache for the Position Tracker API.
+
+Prices are read far more often than written, so reads go through a bounded
+cache whose entries expire after a TTL. A price change drops its entry
+through PRICE_UPDATED, published in the writing process and, from the
+PostgreSQL NOTIFY sent in the writing transaction, in every other process
+by ``change_listener``. SQLite has no NOTIFY; there other processes rely on
+the TTL alone.
+"""
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from app.core.config import settings
+from app.services.event_bus import event_bus, PRICE_UPDATED
+
+
+logger = logging.getLogger(__name__)
+
+
+class PriceCache:
+    """LRU of security_id -> (price, cached at), bounded in entries and age."""
+
+    def __init__(
+        self,
+        max_size: int = settings.PRICE_CACHE_MAX_SIZE,
+        ttl_seconds: float = settings.PRICE_CACHE_TTL_SECONDS,
+    ) -> None:
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self._prices: OrderedDict[int, tuple[Decimal, float]] = OrderedDict()
+        # Invalidation sequence; lets put_many() reject prices read before a change
+        self._sequence = itertools.count(1)
+        self._last_sequence = 0
+        self._changed: dict[int, int] = {}
+        self._cleared = 0
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def token(self) -> int:
+        """Take before reading prices from the database and pass to put_many()."""
+        return self._last_sequence
+
+    def get(self, security_id: int) -> Optional[Decimal]:
+        entry = self._prices.get(security_id)
+        if entry is None:
+            return None
+        price, cached_at = entry
+        if self._ttl and time.monotonic() - cached_at > self._ttl:
+            del self._prices[security_id]
+            return None
+        self._prices.move_to_end(security_id)
+        return price
+
+    def put_many(self, prices: dict[int, Decimal], token: int) -> None:
+        now = time.monotonic()
+        for security_id, price in prices.items():
+            if max(self._cleared, self._changed.get(security_id, 0)) > token:
+                continue
+            self._prices[security_id] = (price, now)
+            self._prices.move_to_end(security_id)
+        while len(self._prices) > self._max_size:
+            self._prices.popitem(last=False)
+
+    def invalidate(self, security_ids: Iterable[int]) -> None:
+        self._last_sequence = next(self._sequence)
+        for security_id in security_ids:
+            self._changed[security_id] = self._last_sequence
+            self._prices.pop(security_id, None)
+        if len(self._changed) > self._max_size:
+            # Forget individual changes; prices read before any of them are rejected instead
+            self._cleared = self._last_sequence
+            self._changed.clear()
+
+    def clear(self) -> None:
+        # Also rejects reads in flight, which may predate a missed change
+        self._last_sequence = self._cleared = next(self._sequence)
+        self._changed.clear()
+        self._prices.clear()
+
+
+price_cache = PriceCache()
+
+event_bus.subscribe(PRICE_UPDATED, lambda security_id, **_: price_cache.invalidate([security_id]))
@@ -2,11 +2,13 @@
 Price management service for the Position Tracker API.
 """
 from decimal import Decimal
-from typing import Optional
+from typing import Iterable, Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.database.connection import AsyncSessionLocal
 from app.repositories.crud_operations import crud_ops
+from app.services.price_cache import price_cache
 
 
 class PriceService:
@@ -24,7 +26,51 @@ class PriceService:
             Current price or None if not found
         """
         async with AsyncSessionLocal() as db:
-            return await crud_ops.get_latest_price(db, security_id)
+            return await PriceService.get_price(db, security_id)
+
+    @staticmethod
+    async def get_price(db: AsyncSession, security_id: int) -> Optional[Decimal]:
+        """
+        Get the latest price for a security through the price cache.
+
+        Args:
+            db: Database session, used on a cache miss
+            security_id: The security ID
+
+        Returns:
+            Latest price or None if not found
+        """
+        return (await PriceService.get_prices(db, [security_id])).get(security_id)
+
+    @staticmethod
+    async def get_prices(db: AsyncSession, security_ids: Iterable[int]) -> dict[int, Decimal]:
+        """
+        Get the latest prices for many securities through the price cache.
+        Misses are read in one query.
+
+        Args:
+            db: Database session, used on cache misses
+            security_ids: The security IDs
+
+        Returns:
+            Prices by security ID; securities without a price are absent
+        """
+        if not settings.PRICE_CACHE_ENABLED:
+            return await crud_ops.get_latest_prices(db, security_ids)
+
+        prices, missing = {}, []
+        for security_id in set(security_ids):
+            price = price_cache.get(security_id)
+            if price is None:
+                missing.append(security_id)
+            else:
+                prices[security_id] = price
+        if missing:
+            token = price_cache.token()
+            fetched = await crud_ops.get_latest_prices(db, missing)
+            price_cache.put_many(fetched, token)
+            prices.update(fetched)
+        return prices
     
     @staticmethod
     async def update_price(
@@ -63,3 +109,6 @@ class PriceService:
             True if valid, False otherwise
         """
         return price > 0 and price < Decimal("1000000")  # Reasonable upper limit
+
+
+price_service = PriceService()
@@ -1,26 +1,302 @@
+import logging
+from collections import deque
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import timedelta
 from decimal import Decimal
 from app.repositories.crud_operations import crud_ops
+from app.repositories.crud_portfolio import crud_portfolio
 from app.database.models.tax_lot import TaxLot, LotStatus
 from app.api.v1.schemas.trade import Trade
+from app.core.config import settings
+from app.core.exceptions import StaleLotError
+from app.services.event_bus import event_bus, TRADE_APPLIED
+from app.services.lot_book import BookLot, lot_book, insert_fifo, drop_closed
+from app.services.lot_index import PositionIndex, lot_index
+from app.services.price_service import price_service
+from app.services.trade_dedup import seen_trades
+from app.utils.datetime_utils import ensure_timezone_naive
+
+try:
+    from app.utils import fifo_kernel
+except ImportError:  # numpy is optional; fall back to the Decimal loop
+    fifo_kernel = None
+
+logger = logging.getLogger(__name__)
+
+# Session.info key for lot index changes that may only be applied once the transaction commits
+_INDEX_UPDATES = "lot_index_updates"
+# Session.info key for trade ids claimed in processed_trades by the open transaction
+_CLAIMED_TRADES = "claimed_trade_ids"
 
 class ProcessingService:
 
-    async def process_trade(self, db: AsyncSession, trade: Trade):
+    async def process_trade(self, db: AsyncSession, trade: Trade) -> bool:
+        """Returns False if a trade with the same trade_id was already processed."""
+        return await self._with_retry(db, self._process_trade_once, trade)
+
+    async def _process_trade_once(self, db: AsyncSession, trade: Trade) -> bool:
+        if trade.trade_id is not None and not await self._claim_trades(db, [trade]):
+            return False
+        positions = [(trade.user_id, trade.security_id)]
+        await self._lock_aggregates(db, positions)
+        exposures = await self._exposures_before(db, positions)
+
+        executed_price = None
         if trade.side.upper() == "BUY":
             await self._process_buy(db, trade)
+            executed_price = trade.price
         elif trade.side.upper() == "SELL":
-            await self._process_sell(db, trade)
-        
-        await self._update_portfolio_summary(db, trade.user_id, trade.security_id)
+            executed_price = await self._process_sell(db, trade)
+
+        if executed_price is not None:
+            await crud_ops.append_trades(db, [self._journal_row(trade, executed_price)])
+            holding = await self._holds_position(db, trade)
+            event_bus.publish_after_commit(
+                db, TRADE_APPLIED, user_id=trade.user_id, security_id=trade.security_id, holding=holding,
+            )
+            await crud_ops.notify_trade_changes(db, [(trade.user_id, trade.security_id, holding)])
+        await self._update_portfolio_summaries(db, positions)
+        await self._update_exposures(db, positions, exposures)
+        await self._commit(db)
+        return True
+
+    async def _commit(self, db: AsyncSession):
         await db.commit()
+        seen_trades.add_all(db.info.pop(_CLAIMED_TRADES, ()))
+        self._apply_index_updates(db)
+        lot_book.commit_changes(db)
+
+    async def _claim_trades(self, db: AsyncSession, trades: list[Trade]) -> list[Trade]:
+        """
+        Drop trades whose trade_id was already processed and claim the rest in
+        processed_trades, as part of the current transaction. Trades without a
+        trade_id are always kept.
+        """
+        trade_ids: set[str] = set()
+        fresh: list[Trade] = []
+        for trade in trades:
+            if trade.trade_id is None:
+                fresh.append(trade)
+            elif trade.trade_id not in trade_ids and trade.trade_id not in seen_trades:
+                trade_ids.add(trade.trade_id)
+                fresh.append(trade)
+        if not trade_ids:
+            return fresh
+
+        claimed = await crud_ops.claim_trade_ids(db, list(trade_ids))
+        # Ids we failed to claim are already committed by an earlier delivery
+        seen_trades.add_all(trade_ids - claimed)
+        db.info.setdefault(_CLAIMED_TRADES, set()).update(claimed)
+
+        kept = [trade for trade in fresh if trade.trade_id is None or trade.trade_id in claimed]
+        if len(kept) < len(trades):
+            logger.info("Skipping %d already processed trade(s).", len(trades) - len(kept))
+        return kept
+
+    async def _with_retry(self, db: AsyncSession, operation, *args):
+        """
+        Run ``operation`` and retry it from scratch when a lot it touched was
+        changed by another writer (optimistic locking on TaxLot.version).
+        """
+        for attempt in range(1, settings.TRADE_MAX_RETRIES + 1):
+            try:
+                return await operation(db, *args)
+            except (StaleDataError, StaleLotError) as e:
+                self._discard_pending(db)
+                await db.rollback()
+                if attempt == settings.TRADE_MAX_RETRIES:
+                    raise
+                logger.warning("Concurrent lot update (%s); retrying, attempt %d", e, attempt + 1)
+            except BaseException:
+                self._discard_pending(db)
+                raise
+
+    @staticmethod
+    def _defer_index_update(db: AsyncSession, key: tuple[int, int], index: PositionIndex | None, update=None):
+        """
+        Queue a change to ``index`` until the transaction commits. ``update`` returns
+        False if it cannot be applied; a missing update just drops the index.
+        """
+        db.info.setdefault(_INDEX_UPDATES, []).append((key, index, update))
+
+    @staticmethod
+    def _apply_index_updates(db: AsyncSession):
+        for key, index, update in db.info.pop(_INDEX_UPDATES, []):
+            # Skip if the index was rebuilt meanwhile; it may already include this trade
+            if index is None or lot_index.get(key) is not index or not update(index):
+                lot_index.invalidate(key)
+
+    @staticmethod
+    def _discard_pending(db: AsyncSession):
+        # Claims roll back with the transaction, so they must be made again on retry
+        db.info.pop(_CLAIMED_TRADES, None)
+        for key, _, _ in db.info.pop(_INDEX_UPDATES, []):
+            lot_index.invalidate(key)
+        lot_book.discard_changes(db)
+
+    async def process_trades(self, db: AsyncSession, trades: list[Trade]) -> int:
+        """
+        Process a batch of trades in a single transaction.
+
+        Trades are grouped by (user_id, security_id) and applied in timestamp
+        order within each group. Open lots are loaded once per group, prices
+        for the whole batch in one query, and the whole batch is committed together.
+
+        Returns the number of trades processed, excluding already processed trade_ids.
+        """
+        return await self._with_retry(db, self._process_trades_once, trades)
+
+    async def _process_trades_once(self, db: AsyncSession, trades: list[Trade]) -> int:
+        trades = await self._claim_trades(db, trades)
+        groups: dict[tuple[int, int], list[Trade]] = {}
+        for trade in trades:
+            groups.setdefault((trade.user_id, trade.security_id), []).append(trade)
+        await self._lock_aggregates(db, groups.keys())
+        exposures = await self._exposures_before(db, groups.keys())
+        if settings.LOT_BOOK_ENABLED:
+            # Check positions out in a fixed order so concurrent batches cannot deadlock
+            for user_id, security_id in sorted(groups):
+                await lot_book.get_position(db, user_id, security_id)
+
+        prices = await price_service.get_prices(
+            db, {trade.security_id for trade in trades if trade.side.upper() == "SELL"}
+        )
+        # Journal rows in the order trades are applied, which a rebuild replays
+        journal: list[dict] = []
+        changes: list[tuple[int, int, bool]] = []
+        for (user_id, security_id), group in groups.items():
+            # Stable sort keeps arrival order for trades sharing a timestamp
+            group.sort(key=lambda t: ensure_timezone_naive(t.timestamp))
+            open_lots = await self._load_open_lots(db, user_id, security_id)
+            # Core mode collects every new or touched lot and writes them once per group
+            changed: dict[int, BookLot] = {}
+
+            for trade in group:
+                side = trade.side.upper()
+                if side == "BUY":
+                    if settings.LOT_BOOK_ENABLED:
+                        lot_book.add_lot(db, open_lots, self._build_book_lot(trade))
+                    elif settings.SELL_EXECUTION_MODE == "core":
+                        new_lot = self._build_book_lot(trade)
+                        insert_fifo(open_lots, new_lot)
+                        changed[id(new_lot)] = new_lot
+                    else:
+                        new_lot = self._build_lot(trade)
+                        db.add(new_lot)
+                        insert_fifo(open_lots, new_lot)
+                    journal.append(self._journal_row(trade, trade.price))
+                elif side == "SELL":
+                    sell_price = self._resolve_sell_price(trade, prices.get(security_id))
+                    touched = self._match_sell(open_lots, trade, sell_price)
+                    if settings.LOT_BOOK_ENABLED:
+                        lot_book.touch(db, touched)
+                    elif settings.SELL_EXECUTION_MODE == "core":
+                        changed.update((id(lot), lot) for lot in touched)
+                    drop_closed(open_lots)
+                    journal.append(self._journal_row(trade, sell_price))
+
+            if changed:
+                await self._write_lots(db, changed.values())
+            if settings.LOT_INDEX_ENABLED:
+                self._defer_index_update(db, (user_id, security_id), None)
+            # open_lots is the whole position here, with closed lots dropped
+            event_bus.publish_after_commit(
+                db, TRADE_APPLIED, user_id=user_id, security_id=security_id, holding=bool(open_lots)
+            )
+            changes.append((user_id, security_id, bool(open_lots)))
+
+        await crud_ops.append_trades(db, journal)
+        await crud_ops.notify_trade_changes(db, changes)
+        await self._update_portfolio_summaries(db, groups.keys())
+        await self._update_exposures(db, groups.keys(), exposures)
+        await self._commit(db)
+        return len(trades)
+
+    async def _holds_position(self, db: AsyncSession, trade: Trade) -> bool | None:
+        """Whether the trade's position still has open lots after the trade."""
+        if trade.side.upper() == "BUY":
+            return True
+        if not settings.HOLDINGS_INDEX_ENABLED:
+            return None
+        if settings.LOT_BOOK_ENABLED:
+            return bool(await lot_book.get_position(db, trade.user_id, trade.security_id))
+        await db.flush()
+        return await crud_ops.has_open_lots(db, trade.user_id, trade.security_id)
+
+    async def _load_open_lots(self, db: AsyncSession, user_id: int, security_id: int) -> deque:
+        if settings.LOT_BOOK_ENABLED:
+            return await lot_book.get_position(db, user_id, security_id)
+        if settings.SELL_EXECUTION_MODE == "core":
+            rows = await crud_ops.get_open_tax_lot_rows_fifo(db, user_id, security_id)
+            return deque(BookLot.from_row(row) for row in rows)
+        return deque(await crud_ops.get_open_tax_lots_fifo(db, user_id, security_id))
+
+    async def _write_lots(self, db: AsyncSession, lots):
+        """Persist core-mode lots: one insert for new lots, one update for the rest."""
+        new_rows, updates = [], []
+        for lot in lots:
+            row = lot.to_row()
+            if lot.id is None:
+                del row["id"]
+                new_rows.append(row)
+            else:
+                updates.append(row)
+        await crud_ops.insert_lots(db, new_rows)
+        await crud_ops.apply_lot_updates(db, updates)
 
     async def _process_buy(self, db: AsyncSession, trade: Trade):
+        if settings.LOT_BOOK_ENABLED:
+            open_lots = await lot_book.get_position(db, trade.user_id, trade.security_id)
+            lot_book.add_lot(db, open_lots, self._build_book_lot(trade))
+            return
+
+        new_lot = self._build_lot(trade)
+        db.add(new_lot)
+
+        key = (trade.user_id, trade.security_id)
+        index = lot_index.get(key) if settings.LOT_INDEX_ENABLED else None
+        if index is not None:
+            # Flush now so the new lot has an id to append to the index
+            await db.flush()
+            lot_id, quantity, open_date = new_lot.id, new_lot.open_qty, new_lot.open_date
+
+            def append(ix: PositionIndex) -> bool:
+                if not ix.can_append(open_date):
+                    return False
+                ix.append(lot_id, quantity, open_date)
+                return True
+
+            self._defer_index_update(db, key, index, append)
+
+    @staticmethod
+    def _journal_row(trade: Trade, executed_price: Decimal) -> dict:
+        return {
+            "trade_id": trade.trade_id,
+            "user_id": trade.user_id,
+            "security_id": trade.security_id,
+            "side": trade.side.upper(),
+            "quantity": trade.quantity,
+            "price": executed_price,
+            "charges": trade.charges or Decimal(0),
+            "timestamp": ensure_timezone_naive(trade.timestamp),
+        }
+
+    def _build_book_lot(self, trade: Trade) -> BookLot:
+        return BookLot(
+            user_id=trade.user_id,
+            security_id=trade.security_id,
+            open_date=ensure_timezone_naive(trade.timestamp),
+            open_qty=trade.quantity,
+            open_price=trade.price,
+            charges=trade.charges or Decimal(0),
+        )
+
+    def _build_lot(self, trade: Trade) -> TaxLot:
         # Ensure timestamp is timezone-naive for consistency
-        timestamp = trade.timestamp.replace(tzinfo=None) if trade.timestamp.tzinfo else trade.timestamp
-        
-        new_lot = TaxLot(
+        timestamp = ensure_timezone_naive(trade.timestamp)
+
+        return TaxLot(
             user_id=trade.user_id,
             security_id=trade.security_id,
             open_date=timestamp,
@@ -28,13 +304,72 @@ class ProcessingService:
             remaining_qty=trade.quantity,
             open_price=trade.price,
             charges=trade.charges or 0,
-            status=LotStatus.OPEN
+            status=LotStatus.OPEN,
+            # Set explicitly (not via column defaults) so a lot opened earlier
+            # in the same batch can be matched before it is flushed
+            close_qty=Decimal(0),
+            realized_pnl=Decimal(0),
+            stcg=Decimal(0),
+            ltcg=Decimal(0),
         )
-        db.add(new_lot)
 
-    async def _process_sell(self, db: AsyncSession, trade: Trade):
+    async def _process_sell(self, db: AsyncSession, trade: Trade) -> Decimal:
+        """Match a sell against open lots. Returns the price it was executed at."""
         # Get current market price from price feed
-        current_price = await crud_ops.get_latest_price(db, trade.security_id)
+        current_price = await price_service.get_price(db, trade.security_id)
+        sell_price = self._resolve_sell_price(trade, current_price)
+
+        if settings.LOT_BOOK_ENABLED:
+            open_lots = await lot_book.get_position(db, trade.user_id, trade.security_id)
+            lot_book.touch(db, self._match_sell(open_lots, trade, sell_price))
+            drop_closed(open_lots)
+            return sell_price
+
+        open_lots = await self._load_lots_for_sell(db, trade)
+        touched = self._match_sell(open_lots, trade, sell_price)
+        if settings.SELL_EXECUTION_MODE == "core":
+            await crud_ops.apply_lot_updates(db, [lot.to_row() for lot in touched])
+        return sell_price
+
+    async def _load_lots_for_sell(self, db: AsyncSession, trade: Trade):
+        """
+        Load the open lots a sell needs. With the lot index only the lots the
+        sell will consume are loaded, in one query that also returns any
+        unindexed open lot sorting before them. The full set is read (and
+        indexed) when the position is not indexed yet or does not match it.
+        """
+        key = (trade.user_id, trade.security_id)
+        if not settings.LOT_INDEX_ENABLED:
+            return await self._load_open_lots(db, *key)
+
+        core = settings.SELL_EXECUTION_MODE == "core"
+        quantity = trade.quantity
+        index = lot_index.get(key)
+        # Selling more than the index knows about needs every lot anyway
+        if index is not None and quantity <= index.open_quantity:
+            expected = index.lots_for(quantity)
+            lots = await crud_ops.get_open_tax_lots_through(db, *key, [lot_id for lot_id, _ in expected], rows=core)
+            if core:
+                lots = [BookLot.from_row(row) for row in lots]
+            # Lots committed by other writers are missing from the index
+            if self._matches_index(lots, expected):
+                self._defer_index_update(db, key, index, lambda ix: ix.consume(quantity) or True)
+                return lots
+
+        lots = await self._load_open_lots(db, *key)
+        index = lot_index.build(key, [(lot.id, lot.remaining_qty, lot.open_date) for lot in lots])
+        self._defer_index_update(db, key, index, lambda ix: ix.consume(quantity) or True)
+        return lots
+
+    @staticmethod
+    def _matches_index(lots, expected: list[tuple[int, Decimal]]) -> bool:
+        return len(lots) == len(expected) and all(
+            lot.id == lot_id and lot.remaining_qty == quantity and lot.status != LotStatus.CLOSED
+            for lot, (lot_id, quantity) in zip(lots, expected)
+        )
+
+    @staticmethod
+    def _resolve_sell_price(trade: Trade, current_price: Decimal | None) -> Decimal:
         if not current_price:
             raise ValueError(
                 f"No price data found for security {trade.security_id}. "
@@ -42,10 +377,21 @@ class ProcessingService:
             )
         
         # Use price from trade if provided, otherwise use current market price
-        sell_price = trade.price if trade.price is not None else current_price
-        
-        open_lots = await crud_ops.get_open_tax_lots_fifo(db, trade.user_id, trade.security_id)
+        return trade.price if trade.price is not None else current_price
+
+    def _match_sell(self, open_lots, trade: Trade, sell_price: Decimal) -> list:
+        """
+        Consume open lots in FIFO order and book realized P&L and taxes on them.
+        Works on ``TaxLot`` rows and ``BookLot`` records alike. Returns the lots touched.
+        """
+        min_lots = settings.FIFO_VECTORIZE_MIN_LOTS
+        if fifo_kernel is not None and min_lots and len(open_lots) >= min_lots:
+            touched = self._match_sell_vectorized(open_lots, trade, sell_price)
+            if touched is not None:
+                return touched
+
         quantity_to_sell = trade.quantity
+        touched = []
 
         for lot in open_lots:
             if quantity_to_sell <= 0:
@@ -61,7 +407,7 @@ class ProcessingService:
                 lot.status = LotStatus.PARTIAL
             
             # Ensure timestamp is timezone-naive for consistency
-            timestamp = trade.timestamp.replace(tzinfo=None) if trade.timestamp.tzinfo else trade.timestamp
+            timestamp = ensure_timezone_naive(trade.timestamp)
             lot.close_date = timestamp
             lot.close_price = sell_price
             
@@ -77,8 +423,8 @@ class ProcessingService:
             lot.realized_pnl = (lot.realized_pnl or 0) + taxable_gain
 
             # Ensure both datetimes are timezone-naive for comparison
-            trade_timestamp = trade.timestamp.replace(tzinfo=None) if trade.timestamp.tzinfo else trade.timestamp
-            lot_open_date = lot.open_date.replace(tzinfo=None) if lot.open_date.tzinfo else lot.open_date
+            trade_timestamp = ensure_timezone_naive(trade.timestamp)
+            lot_open_date = ensure_timezone_naive(lot.open_date)
             holding_period = trade_timestamp - lot_open_date
             if holding_period < timedelta(days=365):
                 # Short-term tax @ 25%
@@ -90,15 +436,103 @@ class ProcessingService:
                 lot.ltcg = (lot.ltcg or 0) + tax
 
             quantity_to_sell -= sell_from_this_lot
+            touched.append(lot)
             
         if quantity_to_sell > 0:
             # This would mean selling more than owned. Should raise an error.
             # For simplicity, we assume valid trades.
             pass
 
-    async def _update_portfolio_summary(self, db: AsyncSession, user_id: int, security_id: int):
-        # No longer persist portfolio. Keep function for backward compatibility no-op.
-        return
+        return touched
+
+    def _match_sell_vectorized(self, open_lots, trade: Trade, sell_price: Decimal) -> list | None:
+        """
+        Same results as the Decimal loop in _match_sell, computed with the NumPy
+        FIFO kernel. Returns None if a value has more than 4 decimal places.
+        """
+        lots = list(open_lots)
+        to_array = fifo_kernel.to_scaled_array
+        sell = to_array([trade.quantity, sell_price, trade.charges])
+        remaining = to_array([lot.remaining_qty for lot in lots])
+        if sell is None or remaining is None:
+            return None
+        sell_qty, sell_price_scaled, sell_charges = sell.tolist()
+        # Only the lots the sell reaches need their other columns converted
+        lots = lots[:fifo_kernel.fifo_cutoff(remaining, sell_qty)]
+        columns = [
+            to_array([lot.open_qty for lot in lots]),
+            to_array([lot.open_price for lot in lots]),
+            to_array([lot.charges for lot in lots]),
+        ]
+        if any(column is None for column in columns):
+            return None
+
+        match = fifo_kernel.match_fifo(
+            remaining,
+            *columns,
+            open_date=[ensure_timezone_naive(lot.open_date) for lot in lots],
+            sell_qty=sell_qty,
+            sell_price=sell_price_scaled,
+            sell_charges=sell_charges,
+            sell_date=ensure_timezone_naive(trade.timestamp),
+        )
+        if match is None:
+            return None
+
+        timestamp = ensure_timezone_naive(trade.timestamp)
+        results = zip(
+            lots,
+            match.consumed.tolist(),
+            match.realized_pnl.tolist(),
+            match.stcg.tolist(),
+            match.ltcg.tolist(),
+        )
+        for lot, consumed, pnl, stcg, ltcg in results:
+            sold = Decimal(consumed).scaleb(-4)
+            lot.remaining_qty -= sold
+            lot.close_qty += sold
+            lot.status = LotStatus.CLOSED if lot.remaining_qty == 0 else LotStatus.PARTIAL
+            lot.close_date = timestamp
+            lot.close_price = sell_price
+            lot.realized_pnl = (lot.realized_pnl or 0) + Decimal(pnl).scaleb(-4)
+            lot.stcg = (lot.stcg or 0) + Decimal(stcg).scaleb(-4)
+            lot.ltcg = (lot.ltcg or 0) + Decimal(ltcg).scaleb(-4)
+        return lots
+
+    async def _lock_aggregates(self, db: AsyncSession, positions):
+        """
+        Hold the positions until commit before reading their aggregates.
+        Concurrent trades on a position would otherwise each aggregate without
+        the other's lots, losing one's change to portfolio_summary or counting
+        a new holder twice in security_exposure.
+        """
+        if settings.LOT_BOOK_ENABLED:
+            return
+        if settings.PORTFOLIO_SUMMARY_ENABLED or settings.SECURITY_EXPOSURE_ENABLED:
+            await crud_portfolio.lock_positions(db, positions)
+
+    async def _update_portfolio_summaries(self, db: AsyncSession, positions):
+        """Re-aggregate portfolio_summary for the positions a trade or batch touched."""
+        # With the lot book, tax_lots lags behind; its flush refreshes summaries instead
+        if not settings.PORTFOLIO_SUMMARY_ENABLED or settings.LOT_BOOK_ENABLED:
+            return
+        await db.flush()
+        await crud_portfolio.refresh_position_summaries(db, positions)
+
+    async def _exposures_before(self, db: AsyncSession, positions) -> dict | None:
+        """Open lots of the positions before a trade or batch changes them, for _update_exposures."""
+        # With the lot book, tax_lots lags behind; its flush updates exposures instead
+        if not settings.SECURITY_EXPOSURE_ENABLED or settings.LOT_BOOK_ENABLED:
+            return None
+        return await crud_portfolio.get_position_exposures(db, positions)
+
+    async def _update_exposures(self, db: AsyncSession, positions, before: dict | None):
+        """Apply the positions' change since _exposures_before to security_exposure."""
+        if before is None:
+            return
+        await db.flush()
+        after = await crud_portfolio.get_position_exposures(db, positions)
+        await crud_portfolio.apply_exposure_changes(db, before, after)
 
     async def update_price(self, db: AsyncSession, user_id: int, security_id: int, new_price: Decimal):
         await crud_ops.upsert_price(db, security_id, new_price)
@@ -0,0 +1,150 @@
+"""
+Portfolio snapshot cache for the Position Tracker API.
+
+Snapshots are cached per user and dropped when a trade for that user
+commits or the price of any security the user holds changes. Changes are
+learned from the event bus, which ``change_listener`` also feeds with writes
+committed by other processes on PostgreSQL. Without NOTIFY (SQLite) only
+writes made in this process invalidate entries and the TTL bounds staleness.
+"""
+import itertools
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from app.api.v1.schemas.portfolio import PortfolioSnapshot
+from app.core.config import settings
+from app.services.event_bus import event_bus, TRADE_APPLIED, PRICE_UPDATED
+
+# Rough in-memory footprint of a snapshot, used for the memory budget
+_ENTRY_BYTES = 1024
+_POSITION_BYTES = 512
+# Users and securities remembered as changed before the maps are pruned
+_MAX_CHANGES = 100_000
+
+
+class _Entry:
+    __slots__ = ("snapshot", "security_ids", "size", "created")
+
+    def __init__(self, snapshot: PortfolioSnapshot, security_ids: frozenset[int], size: int):
+        self.snapshot = snapshot
+        self.security_ids = security_ids
+        self.size = size
+        self.created = time.monotonic()
+
+
+class SnapshotCache:
+    """
+    LRU cache of snapshots bounded by an estimated memory budget.
+
+    A security -> users index over the cached entries finds the snapshots a
+    price change affects. Each entry records every security the user holds,
+    including ones shown without a price, since a first price adds them.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = settings.SNAPSHOT_CACHE_MAX_BYTES,
+        ttl_seconds: float = settings.SNAPSHOT_CACHE_TTL_SECONDS,
+    ) -> None:
+        self._max_bytes = max_bytes
+        self._ttl = ttl_seconds
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._holders: dict[int, set[int]] = {}
+        self._bytes = 0
+        # Invalidation sequence; lets put() reject snapshots computed before a change
+        self._sequence = itertools.count(1)
+        self._last_sequence = 0
+        self._user_changed: dict[int, int] = {}
+        self._security_changed: dict[int, int] = {}
+        # Snapshots computed before this sequence are rejected regardless of the maps
+        self._floor = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def token(self) -> int:
+        """Take before computing a snapshot and pass to put()."""
+        return self._last_sequence
+
+    def get(self, user_id: int) -> Optional[PortfolioSnapshot]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if self._ttl and time.monotonic() - entry.created > self._ttl:
+            self._remove(user_id)
+            return None
+        self._entries.move_to_end(user_id)
+        return entry.snapshot
+
+    def put(self, user_id: int, snapshot: PortfolioSnapshot, security_ids: Iterable[int], token: int) -> bool:
+        """Cache ``snapshot`` unless something it depends on changed since ``token``."""
+        security_ids = frozenset(security_ids)
+        if self._floor > token or self._user_changed.get(user_id, 0) > token or any(
+            self._security_changed.get(security_id, 0) > token for security_id in security_ids
+        ):
+            return False
+
+        size = _ENTRY_BYTES + _POSITION_BYTES * len(snapshot.positions)
+        if size > self._max_bytes:
+            return False
+        self._remove(user_id)
+        self._entries[user_id] = _Entry(snapshot, security_ids, size)
+        self._bytes += size
+        for security_id in security_ids:
+            self._holders.setdefault(security_id, set()).add(user_id)
+
+        while self._bytes > self._max_bytes:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    def invalidate_user(self, user_id: int) -> None:
+        self._last_sequence = next(self._sequence)
+        self._user_changed[user_id] = self._last_sequence
+        self._remove(user_id)
+        self._prune_changes()
+
+    def invalidate_security(self, security_id: int) -> None:
+        self._last_sequence = next(self._sequence)
+        self._security_changed[security_id] = self._last_sequence
+        for user_id in list(self._holders.get(security_id, ())):
+            self._remove(user_id)
+        self._prune_changes()
+
+    def _prune_changes(self) -> None:
+        # Forget individual changes; snapshots computed before any of them are rejected instead
+        if len(self._user_changed) + len(self._security_changed) > _MAX_CHANGES:
+            self._floor = self._last_sequence
+            self._user_changed.clear()
+            self._security_changed.clear()
+
+    def clear(self) -> None:
+        # Also rejects snapshots in flight, which may predate a missed change
+        self._last_sequence = self._floor = next(self._sequence)
+        self._user_changed.clear()
+        self._security_changed.clear()
+        self._entries.clear()
+        self._holders.clear()
+        self._bytes = 0
+
+    def _remove(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for security_id in entry.security_ids:
+            holders = self._holders.get(security_id)
+            if holders is not None:
+                holders.discard(user_id)
+                if not holders:
+                    del self._holders[security_id]
+
+
+snapshot_cache = SnapshotCache()
+
+event_bus.subscribe(TRADE_APPLIED, lambda user_id, **_: snapshot_cache.invalidate_user(user_id))
+event_bus.subscribe(PRICE_UPDATED, lambda security_id, **_: snapshot_cache.invalidate_security(security_id))
@@ -0,0 +1,35 @@
+"""
+Recently processed trade ids for the Position Tracker API.
+
+processed_trades is the source of truth for idempotency. This LRU only
+remembers ids this process has committed so replays (Kafka redelivery,
+HTTP retries) are dropped without a database round-trip.
+"""
+from collections import OrderedDict
+from typing import Iterable
+
+from app.core.config import settings
+
+
+class SeenTrades:
+    """LRU-bounded set of committed trade ids."""
+
+    def __init__(self, max_size: int = settings.TRADE_DEDUP_CACHE_SIZE):
+        self._max_size = max_size
+        self._ids: OrderedDict[str, None] = OrderedDict()
+
+    def __contains__(self, trade_id: str) -> bool:
+        if trade_id in self._ids:
+            self._ids.move_to_end(trade_id)
+            return True
+        return False
+
+    def add_all(self, trade_ids: Iterable[str]) -> None:
+        for trade_id in trade_ids:
+            self._ids[trade_id] = None
+            self._ids.move_to_end(trade_id)
+        while len(self._ids) > self._max_size:
+            self._ids.popitem(last=False)
+
+
+seen_trades = SeenTrades()
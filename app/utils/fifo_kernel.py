@@ -0,0 +1,188 @@
+"""
+Vectorized FIFO matching kernel for the Position Tracker API.
+
+Works on parallel arrays of open lots (oldest first) with quantities, prices
+and charges held as int64 scaled by 10^4, the precision of the Numeric(19, 4)
+columns. Each lot's taxable gain is computed exactly as one fraction over a
+common denominator and rounded once, half away from zero, to 4 dp, as
+PostgreSQL does when storing the Decimal results of ProcessingService._match_sell.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+
+SCALE = 10_000
+# Headroom below 2**63 for the intermediate int64 products
+_INT64_LIMIT = 2 ** 62
+
+
+class FifoMatch(NamedTuple):
+    """Per-lot results for the lots a sell touches, all scaled by 10^4."""
+    consumed: np.ndarray
+    realized_pnl: np.ndarray
+    stcg: np.ndarray
+    ltcg: np.ndarray
+
+
+def to_scaled(value: Optional[Decimal]) -> int:
+    """
+    Convert a decimal value to an integer scaled by 10^4.
+
+    Args:
+        value: The decimal value (None is treated as zero)
+
+    Returns:
+        The value times 10^4, rounded half up
+    """
+    if value is None:
+        return 0
+    return int((Decimal(value) * SCALE).to_integral_value(ROUND_HALF_UP))
+
+
+def to_scaled_array(values: Sequence[Optional[Decimal]]) -> Optional[np.ndarray]:
+    """
+    Convert decimal values with at most 4 decimal places to a scaled int64 array.
+
+    Args:
+        values: The decimal values (None is treated as zero)
+
+    Returns:
+        An int64 array of the values times 10^4, or None if a value has more
+        than 4 decimal places or is too large for int64
+    """
+    scaled = []
+    for value in values:
+        if value is None:
+            scaled.append(0)
+            continue
+        shifted = Decimal(value).scaleb(4)
+        if shifted != shifted.to_integral_value() or abs(shifted) >= _INT64_LIMIT:
+            return None
+        scaled.append(int(shifted))
+    return np.array(scaled, dtype=np.int64)
+
+
+def from_scaled(value: int) -> Decimal:
+    """
+    Convert an integer scaled by 10^4 back to a decimal value.
+
+    Args:
+        value: The scaled integer
+
+    Returns:
+        The exact decimal value with 4 decimal places
+    """
+    return Decimal(int(value)).scaleb(-4)
+
+
+def _round_div(numerator: np.ndarray, divisor) -> np.ndarray:
+    """Integer division rounding half away from zero; divisors must be positive."""
+    # floor((|n| + d/2) / d), kept integral for odd divisors
+    quotient = (2 * abs(numerator) + divisor) // (2 * divisor)
+    return np.where(numerator < 0, -quotient, quotient)
+
+
+def fifo_cutoff(remaining_qty: np.ndarray, sell_qty: int) -> int:
+    """
+    Find how many lots, oldest first, a sell touches.
+
+    Args:
+        remaining_qty: Remaining quantity per lot, scaled by 10^4
+        sell_qty: Quantity sold, scaled by 10^4
+
+    Returns:
+        The number of lots from the front that the sell consumes from
+    """
+    if remaining_qty.size == 0 or sell_qty <= 0:
+        return 0
+    cumulative = np.cumsum(remaining_qty)
+    return min(int(np.searchsorted(cumulative, sell_qty, side="left")) + 1, remaining_qty.size)
+
+
+def match_fifo(
+    remaining_qty: np.ndarray,
+    open_qty: np.ndarray,
+    open_price: np.ndarray,
+    charges: np.ndarray,
+    open_date: Sequence[datetime],
+    sell_qty: int,
+    sell_price: int,
+    sell_charges: int,
+    sell_date: datetime,
+) -> Optional[FifoMatch]:
+    """
+    Match a sell against open lots in FIFO order.
+
+    Args:
+        remaining_qty: Remaining quantity per lot, scaled by 10^4
+        open_qty: Original quantity per lot, scaled by 10^4
+        open_price: Buy price per lot, scaled by 10^4
+        charges: Buy charges per lot, scaled by 10^4
+        open_date: Timezone-naive open date per lot
+
+        Only ``remaining_qty`` must cover every open lot; the other arrays
+        may be cut to the prefix given by ``fifo_cutoff``.
+
+        sell_qty: Quantity sold, scaled by 10^4
+        sell_price: Sell price, scaled by 10^4
+        sell_charges: Sell charges, scaled by 10^4
+        sell_date: Timezone-naive sell timestamp
+
+    Returns:
+        A FifoMatch for the touched lots (a prefix of the input), or None if
+        a touched lot has no open quantity
+    """
+    touched = fifo_cutoff(remaining_qty, sell_qty)
+    if touched == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return FifoMatch(empty, empty, empty, empty)
+
+    # Cumulative-sum cutoff: lot i gives what is left of the sell after lots 0..i-1
+    remaining = remaining_qty[:touched]
+    before = np.cumsum(remaining) - remaining
+    consumed = np.clip(sell_qty - before, 0, remaining)
+
+    lot_qty = open_qty[:touched]
+    price = open_price[:touched]
+    lot_charges = charges[:touched]
+
+    if (lot_qty <= 0).any():
+        return None
+
+    # Charges are allocated pro rata to quantity. Over the common denominator
+    # lot_qty * sell_qty * 10^4, the taxable gain scaled by 10^4 is
+    #   consumed * ((sell_price - price) * lot_qty * sell_qty
+    #               - (lot_charges * sell_qty + sell_charges * lot_qty) * 10^4)
+    max_qty = int(lot_qty.max())
+    numerator_bound = int(consumed.max()) * (
+        int(np.abs(sell_price - price).max()) * max_qty * sell_qty
+        + (int(lot_charges.max()) * sell_qty + sell_charges * max_qty) * SCALE
+    )
+    denominator_bound = max_qty * sell_qty * SCALE
+    # x1000 covers the tax rates below, halving the limit covers _round_div
+    if (numerator_bound + denominator_bound) * 1000 >= _INT64_LIMIT // 2:
+        # Python ints are exact at any size
+        sold, price, lot_qty, lot_charges = (
+            column.astype(object) for column in (consumed, price, lot_qty, lot_charges)
+        )
+    else:
+        sold = consumed
+    denominator = lot_qty * sell_qty * SCALE
+    taxable_gain = sold * (
+        (sell_price - price) * lot_qty * sell_qty
+        - (lot_charges * sell_qty + sell_charges * lot_qty) * SCALE
+    )
+
+    realized_pnl = _round_div(taxable_gain, denominator)
+    taxed = np.where(taxable_gain > 0, taxable_gain, 0)
+    # Held under 365 days <=> opened after the sell date minus 365 days
+    long_term_cutoff = sell_date - timedelta(days=365)
+    short_term = np.fromiter((d > long_term_cutoff for d in open_date[:touched]), dtype=bool, count=touched)
+    # Short-term tax @ 25%, long-term tax @ 12.5%
+    stcg = np.where(short_term, _round_div(taxed * 25, denominator * 100), 0)
+    ltcg = np.where(short_term, 0, _round_div(taxed * 125, denominator * 1000))
+
+    return FifoMatch(consumed, realized_pnl, stcg, ltcg)
@@ -1,20 +1,25 @@
 """
 Workers Package
 
-This package contains background workers for asynchronous processing.
+This package contains background workers and maintenance jobs that run
+outside the API's request path.
 
 WORKERS:
-- price_updater.py: Background worker for updating security prices from external feeds
-- trade_consumer.py: Background worker for consuming trades from message queues
+- trade_consumer.py: Kafka trade consumer; micro-batches trades into per-position lanes
+- price_updater.py: Kafka price tick consumer; conflates ticks and bulk-upserts prices
+- lot_rebuilder.py: Re-derives tax lots from the trade journal (skips positions with pre-journal lots)
+- summary_checker.py: Checks (and with --repair rebuilds) portfolio_summary and security_exposure
+- processed_trades_pruner.py: Deletes expired processed_trades dedup entries
 
-CURRENT STATUS: Placeholders only, not actively implemented
-These workers would be used in production for:
-- Real-time price updates
-- Message queue integration
-- Background processing of trades
+CURRENT STATUS: All implemented. The consumers run continuously; the other
+three are one-off or periodic jobs run with ``python -m app.workers.<name>``.
+See WORKERS_README.md for usage.
 """
 
 __all__ = [
+    "lot_rebuilder",
     "price_updater",
+    "processed_trades_pruner",
+    "summary_checker",
     "trade_consumer",
 ]
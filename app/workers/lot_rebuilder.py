@@ -0,0 +1,240 @@
+"""
+Tax Lot Rebuilder
+
+Re-derives every tax lot from the append-only trade journal, e.g. after a
+fix to the FIFO or tax logic:
+
+    python -m app.workers.lot_rebuilder --workers 8
+
+Positions (user_id, security_id) are split into partitions, one per worker
+process. Each worker replays its positions' trades in the order they were
+originally applied and bulk-loads the resulting lots into a staging table
+(COPY on PostgreSQL). Once every partition has finished, tax_lots is
+swapped in from the staging table in a single transaction and
+portfolio_summary and security_exposure are re-aggregated. Only positions
+that appear in the journal are replaced; lots of positions without journal
+rows (loaded before the journal existed) are left as they are. A journaled
+position with lots opened before its first journal row cannot be re-derived
+either; it is skipped with a logged error until its history is backfilled
+into the journal.
+
+Run it with the API and trade consumer stopped; trades accepted during a
+rebuild would be lost from tax_lots.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import Column, MetaData, Table, BigInteger, cast, delete, func, insert, select, tuple_
+from sqlalchemy.dialects import postgresql
+
+from app.core.config import settings
+from app.database.connection import AsyncSessionLocal, engine
+from app.database.models.tax_lot import TaxLot, LotStatus
+from app.database.models.trade import TradeRecord
+from app.repositories.crud_operations import crud_ops
+from app.repositories.crud_portfolio import crud_portfolio
+from app.services.lot_book import BookLot, insert_fifo, drop_closed
+from app.services.processing_service import processing_service
+
+
+logger = logging.getLogger(__name__)
+
+def _staging_column(column):
+    if column.name == "status":
+        # Reuse the lot_status type of tax_lots; never create or drop it with the staging table
+        return Column(
+            column.name,
+            postgresql.ENUM(LotStatus, name="lot_status", create_type=False),
+            nullable=column.nullable,
+        )
+    return column._copy()
+
+
+LOTS = TaxLot.__table__
+# Without the id column: tax_lots assigns ids when the lots are swapped in
+STAGED_COLUMNS = [column.name for column in LOTS.columns if column.name != "id"]
+STAGING_TABLE = Table(
+    "tax_lots_rebuild",
+    MetaData(),
+    *(_staging_column(LOTS.c[name]) for name in STAGED_COLUMNS),
+)
+
+JOURNAL = TradeRecord.__table__
+_FIRST_TRADES = (
+    select(JOURNAL.c.user_id, JOURNAL.c.security_id, func.min(JOURNAL.c.timestamp).label("first_traded"))
+    .group_by(JOURNAL.c.user_id, JOURNAL.c.security_id)
+    .subquery()
+)
+# Aliased so it never correlates with the tax_lots of an enclosing DELETE
+_EARLIER_LOTS = LOTS.alias("earlier_lots")
+_HAS_PRE_JOURNAL_LOTS = (
+    select(_EARLIER_LOTS.c.id)
+    .where(
+        _EARLIER_LOTS.c.user_id == _FIRST_TRADES.c.user_id,
+        _EARLIER_LOTS.c.security_id == _FIRST_TRADES.c.security_id,
+        _EARLIER_LOTS.c.open_date < _FIRST_TRADES.c.first_traded,
+    )
+    .exists()
+)
+# Journaled positions holding lots the journal cannot recreate
+PRE_JOURNAL_POSITIONS = select(_FIRST_TRADES.c.user_id, _FIRST_TRADES.c.security_id).where(_HAS_PRE_JOURNAL_LOTS)
+# Positions the rebuild replaces
+REBUILT_POSITIONS = select(_FIRST_TRADES.c.user_id, _FIRST_TRADES.c.security_id).where(~_HAS_PRE_JOURNAL_LOTS)
+
+# Lots are stored as Numeric(19, 4); round like the database does between trades
+_COLUMN_SCALE = Decimal("0.0001")
+_ROUNDED_COLUMNS = ("realized_pnl", "stcg", "ltcg")
+
+
+def _round_lot(lot: BookLot) -> None:
+    for name in _ROUNDED_COLUMNS:
+        setattr(lot, name, Decimal(getattr(lot, name)).quantize(_COLUMN_SCALE, ROUND_HALF_UP))
+
+
+def _lot_row(lot: BookLot) -> dict:
+    row = lot.to_row()
+    del row["id"]
+    return row
+
+
+def replay_position(trades) -> list[BookLot]:
+    """
+    Replay one position's journal rows (in applied order) and return all
+    lots it produced, open and closed.
+    """
+    lots: list[BookLot] = []
+    open_lots: deque[BookLot] = deque()
+    for trade in trades:
+        if trade.side == "BUY":
+            lot = processing_service._build_book_lot(trade)
+            insert_fifo(open_lots, lot)
+            lots.append(lot)
+        else:
+            # The journal holds the executed price, so no price history is needed
+            for lot in processing_service._match_sell(open_lots, trade, trade.price):
+                _round_lot(lot)
+            drop_closed(open_lots)
+    return lots
+
+
+async def _rebuild_partition(partition: int, partitions: int, batch_size: int) -> tuple[int, int]:
+    journal = JOURNAL
+    position_hash = cast(journal.c.user_id, BigInteger) * 31 + journal.c.security_id
+    query = (
+        select(journal)
+        .where(position_hash % partitions == partition)
+        .order_by(journal.c.user_id, journal.c.security_id, journal.c.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    trade_count = lot_count = 0
+    pending: list[dict] = []
+    async with AsyncSessionLocal() as reader, AsyncSessionLocal() as writer:
+        key, position = None, []
+
+        async def finish_position():
+            nonlocal lot_count
+            lots = replay_position(position)
+            pending.extend(_lot_row(lot) for lot in lots)
+            lot_count += len(lots)
+            if len(pending) >= batch_size:
+                await crud_ops.copy_lots(writer, pending, STAGING_TABLE)
+                pending.clear()
+
+        result = await reader.stream(query)
+        async for trade in result:
+            trade_count += 1
+            if (trade.user_id, trade.security_id) != key:
+                await finish_position()
+                key, position = (trade.user_id, trade.security_id), []
+            position.append(trade)
+        await finish_position()
+
+        await crud_ops.copy_lots(writer, pending, STAGING_TABLE)
+        await writer.commit()
+
+    await engine.dispose()
+    return trade_count, lot_count
+
+
+def rebuild_partition(partition: int, partitions: int, batch_size: int) -> tuple[int, int]:
+    """Process pool entry point. Returns (trades replayed, lots written)."""
+    return asyncio.run(_rebuild_partition(partition, partitions, batch_size))
+
+
+async def _prepare_staging() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(STAGING_TABLE.drop, checkfirst=True)
+        await conn.run_sync(STAGING_TABLE.create)
+
+
+async def _swap_in_staging() -> None:
+    async with engine.begin() as conn:
+        skipped = (await conn.execute(PRE_JOURNAL_POSITIONS)).all()
+        if skipped:
+            logger.error(
+                "Skipping %d position(s) with lots opened before their first journal row, "
+                "e.g. (user_id, security_id) %s; backfill their trades into the journal to rebuild them.",
+                len(skipped), ", ".join(str(tuple(position)) for position in skipped[:10]),
+            )
+        await conn.execute(
+            delete(LOTS).where(tuple_(LOTS.c.user_id, LOTS.c.security_id).in_(REBUILT_POSITIONS))
+        )
+        staged = STAGING_TABLE.c
+        await conn.execute(
+            insert(LOTS).from_select(
+                STAGED_COLUMNS,
+                select(*(staged[name] for name in STAGED_COLUMNS))
+                .where(tuple_(staged.user_id, staged.security_id).in_(REBUILT_POSITIONS)),
+            )
+        )
+        await conn.run_sync(STAGING_TABLE.drop)
+
+    async with AsyncSessionLocal() as db:
+        if settings.PORTFOLIO_SUMMARY_ENABLED:
+            await crud_portfolio.refresh_position_summaries(db, REBUILT_POSITIONS)
+        if settings.SECURITY_EXPOSURE_ENABLED:
+            await crud_portfolio.refresh_security_exposures(db, select(JOURNAL.c.security_id).distinct())
+        await db.commit()
+    await engine.dispose()
+
+
+def rebuild(workers: int, batch_size: int) -> tuple[int, int]:
+    """Rebuild all tax lots from the trade journal. Returns (trades, lots)."""
+    asyncio.run(_prepare_staging())
+
+    # Spawn rather than fork so no worker inherits the parent's pooled connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        results = list(pool.map(
+            rebuild_partition,
+            range(workers),
+            [workers] * workers,
+            [batch_size] * workers,
+        ))
+
+    asyncio.run(_swap_in_staging())
+    return sum(trades for trades, _ in results), sum(lots for _, lots in results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild tax lots from the trade journal.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (partitions)")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="rows per fetch and per bulk load")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.monotonic()
+    trades, lots = rebuild(max(1, args.workers), args.batch_size)
+    logger.info("Rebuilt %d tax lots from %d trades in %.1fs.", lots, trades, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
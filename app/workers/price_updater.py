@@ -1,34 +1,195 @@
 """
 Price Updater Worker
 
-This worker is responsible for continuously updating security prices
-from external price feeds in the background.
-
-PROPOSED FUNCTIONALITY:
-- Connects to external price feed APIs (e.g., Yahoo Finance, Alpha Vantage)
-- Periodically fetches latest prices for all securities
-- Updates the database with new prices
-- Triggers unrealized P&L recalculations
-- Runs as a background task/scheduler
-
-CURRENT STATUS: Not implemented
-This is a placeholder for future functionality.
+Consumes price ticks from Kafka and writes the latest price per security to
+security_prices:
+
+    python -m app.workers.price_updater
+
+Ticks are JSON ``{"security_id": 1, "price": "101.25"}``, keyed by security
+so each security's ticks stay in order. They are conflated per security
+over PRICE_UPDATER_CONFLATION_WINDOW_MS: only the last tick in a window
+survives, and each window is written with one bulk upsert
+(crud_ops.upsert_prices). Kafka offsets are committed after the window's
+transaction commits, so a crash replays at most the unwritten windows. If
+the update loop dies it is logged and restarted after the retry backoff.
 """
+import asyncio
+import json
+import logging
+import time
+from decimal import Decimal
+
+from aiokafka import AIOKafkaConsumer, TopicPartition
+
+from app.core.config import settings
+from app.api.v1.schemas.price import PriceUpdate
+from app.database.connection import AsyncSessionLocal, engine
+from app.repositories.crud_operations import crud_ops
+
+
+logger = logging.getLogger(__name__)
+
+
+class PriceUpdater:
+    def __init__(
+        self,
+        conflation_window_ms: int = settings.PRICE_UPDATER_CONFLATION_WINDOW_MS,
+        max_records: int = settings.PRICE_UPDATER_MAX_RECORDS,
+        retry_backoff_ms: int = settings.PRICE_UPDATER_RETRY_BACKOFF_MS,
+    ) -> None:
+        self._consumer: AIOKafkaConsumer | None = None
+        self._task: asyncio.Task | None = None
+        self._window = conflation_window_ms / 1000
+        self._max_records = max_records
+        self._retry_backoff = retry_backoff_ms / 1000
+        # Latest price per security and Kafka offsets to commit, since the last write
+        self._pending: dict[int, Decimal] = {}
+        self._offsets: dict[TopicPartition, int] = {}
+        self.ticks_received = 0
+        self.prices_written = 0
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+
+        self._consumer = AIOKafkaConsumer(
+            settings.KAFKA_PRICES_TOPIC,
+            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+            group_id=settings.KAFKA_PRICE_CONSUMER_GROUP,
+            # Offsets are committed only after the window's prices are written
+            enable_auto_commit=False,
+            # Prices older than the current position are superseded anyway
+            auto_offset_reset="latest",
+        )
+        await self._consumer.start()
+        logger.info("PriceUpdater started with a %.0fms conflation window.", self._window * 1000)
+        self._start_loop(self._run())
+
+    def _start_loop(self, loop) -> None:
+        self._task = asyncio.create_task(loop)
+        self._task.add_done_callback(self._on_loop_done)
+
+    def _on_loop_done(self, task: asyncio.Task) -> None:
+        # Cancelled by stop(); otherwise the loop died and nothing awaits it
+        if task.cancelled() or task is not self._task:
+            return
+        logger.error(
+            "PriceUpdater loop died; restarting in %.1fs.", self._retry_backoff, exc_info=task.exception()
+        )
+        self._start_loop(self._restart())
+
+    async def _restart(self) -> None:
+        await asyncio.sleep(self._retry_backoff)
+        await self._run()
+
+    def add_tick(self, payload: bytes) -> bool:
+        """Conflate one tick into the pending window. Returns False if it is malformed."""
+        try:
+            update = PriceUpdate(**json.loads(payload.decode("utf-8")))
+        except Exception as e:
+            logger.warning("Dropping malformed price tick: %s", e)
+            return False
+        self.ticks_received += 1
+        self._pending[update.security_id] = update.price
+        return True
+
+    async def _run(self) -> None:
+        assert self._consumer is not None
+        while True:
+            window_end = time.monotonic() + self._window
+            while (remaining := window_end - time.monotonic()) > 0:
+                batch = await self._consumer.getmany(
+                    timeout_ms=max(1, int(remaining * 1000)),
+                    max_records=self._max_records,
+                )
+                for tp, messages in batch.items():
+                    for msg in messages:
+                        self.add_tick(msg.value)
+                    self._offsets[tp] = messages[-1].offset + 1
+
+            try:
+                await self.flush()
+            except Exception:
+                # Already logged; pending prices stay for the next window, newer ticks replace them
+                await asyncio.sleep(self._retry_backoff)
+
+    async def flush(self) -> int:
+        """Write the pending window, then commit its offsets. Returns the prices changed."""
+        prices, offsets = self._pending, self._offsets
+        if not prices and not offsets:
+            return 0
+        self._pending, self._offsets = {}, {}
+
+        changed = 0
+        try:
+            if prices:
+                async with AsyncSessionLocal() as db:
+                    try:
+                        changed = await crud_ops.upsert_prices(db, prices)
+                    except Exception as e:
+                        logger.warning("Writing %d prices failed (%s); retrying in %.1fs", len(prices), e, self._retry_backoff)
+                        raise
+                    try:
+                        await db.commit()
+                    except Exception as e:
+                        logger.warning("Committing %d written prices failed (%s); retrying in %.1fs", len(prices), e, self._retry_backoff)
+                        raise
+        except BaseException:
+            # Also on cancellation. Ticks that arrived meanwhile are newer; keep them over the failed ones
+            self._pending = {**prices, **self._pending}
+            self._offsets = {**offsets, **self._offsets}
+            raise
+        self.prices_written += len(prices)
+        logger.debug("Wrote %d prices (%d changed) from %d ticks so far.", len(prices), changed, self.ticks_received)
+
+        if offsets and self._consumer is not None:
+            try:
+                await self._consumer.commit(offsets)
+            except Exception as e:
+                # The prices are written; replaying their ticks after a crash only rewrites them
+                logger.warning("Committing Kafka offsets after %d prices failed (%s); retrying with the next window", len(prices), e)
+                self._offsets = {**offsets, **self._offsets}
+        return changed
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+            try:
+                await self.flush()
+            finally:
+                if self._consumer is not None:
+                    await self._consumer.stop()
+                    self._consumer = None
+                logger.info("PriceUpdater stopped.")
+
+
+price_updater = PriceUpdater()
+
+
+async def run() -> None:
+    await price_updater.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await price_updater.stop()
+        await engine.dispose()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
 
-# Example implementation (NOT ACTIVE):
-# import asyncio
-# from app.database.connection import AsyncSessionLocal
-# from app.repositories.crud_operations import update_security_price
-# 
-# async def update_all_prices():
-#     """Background worker to update all security prices"""
-#     async with AsyncSessionLocal() as db:
-#         # Fetch prices from external API
-#         # Update database
-#         pass
-# 
-# async def start_price_updater():
-#     """Start the price updater worker"""
-#     while True:
-#         await update_all_prices()
-#         await asyncio.sleep(60)  # Update every 60 seconds
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Processed Trades Pruner
+
+Deletes processed_trades entries older than the retention period, in
+batches of one transaction each, so the dedup table does not grow without
+bound. Run it periodically (e.g. from cron):
+
+    python -m app.workers.processed_trades_pruner [--retention-days 30]
+
+A trade redelivered after its entry was pruned is applied again, so the
+retention must be longer than any trade can be redelivered.
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from app.core.config import settings
+from app.database.connection import AsyncSessionLocal, engine
+from app.repositories.crud_operations import crud_ops
+
+
+logger = logging.getLogger(__name__)
+
+
+async def prune(retention_days: int, batch_size: int) -> int:
+    """Delete expired processed_trades entries. Returns the number deleted."""
+    before = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            deleted = await crud_ops.prune_processed_trades(db, before, batch_size)
+            await db.commit()
+        total += deleted
+        if deleted < batch_size:
+            break
+    await engine.dispose()
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prune old processed_trades entries.")
+    parser.add_argument("--retention-days", type=int, default=settings.PROCESSED_TRADES_RETENTION_DAYS,
+                        help="keep entries recorded within this many days")
+    parser.add_argument("--batch-size", type=int, default=settings.PROCESSED_TRADES_PRUNE_BATCH_SIZE,
+                        help="entries deleted per transaction")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    deleted = asyncio.run(prune(args.retention_days, args.batch_size))
+    logger.info("Pruned %d processed trade id(s) older than %d days.", deleted, args.retention_days)
+
+
+if __name__ == "__main__":
+    main()
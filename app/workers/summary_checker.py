@@ -0,0 +1,132 @@
+"""
+Portfolio Summary Checker
+
+Compares portfolio_summary and security_exposure with the aggregates
+recomputed from tax_lots and reports rows that disagree. With --repair the
+tables are rebuilt from tax_lots (also the way to backfill them):
+
+    python -m app.workers.summary_checker [--repair]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.database.connection import AsyncSessionLocal, engine
+from app.repositories.crud_portfolio import crud_portfolio, SUMMARY_COLUMNS, EXPOSURE_COLUMNS
+from app.database.models.portfolio import Portfolio
+from app.database.models.security_exposure import SecurityExposure
+
+
+logger = logging.getLogger(__name__)
+
+# Stored and recomputed values may differ in rounding only
+_TOLERANCE = Decimal("0.0001")
+_YTD_COLUMNS = ("realized_pnl_ytd", "stcg_ytd", "ltcg_ytd")
+
+
+async def diff_position_summaries(db: AsyncSession) -> list[dict]:
+    """
+    Diff portfolio_summary against tax_lots.
+
+    Returns one entry per mismatched position with the stored and expected
+    values (stored is None if the row is missing).
+    """
+    year = datetime.now().year
+    expected = {
+        (row.user_id, row.security_id): row._mapping
+        for row in (await db.execute(crud_portfolio.position_summaries_from_lots(year))).all()
+    }
+    stored = {
+        (row.user_id, row.security_id): row
+        for row in (await db.execute(select(Portfolio))).scalars().all()
+    }
+
+    zero = {name: Decimal(0) for name in SUMMARY_COLUMNS}
+    diffs = []
+    for key in expected.keys() | stored.keys():
+        want = expected.get(key, zero)
+        row = stored.get(key)
+        if row is None:
+            diffs.append({"position": key, "stored": None, "expected": dict(want)})
+            continue
+
+        # A row last refreshed in an earlier year had nothing closed this year
+        stale_year = row.last_updated is not None and row.last_updated.year != year
+        have = {
+            name: Decimal(0) if stale_year and name in _YTD_COLUMNS else Decimal(getattr(row, name))
+            for name in SUMMARY_COLUMNS
+        }
+        if any(abs(have[name] - Decimal(want[name])) > _TOLERANCE for name in SUMMARY_COLUMNS):
+            diffs.append({"position": key, "stored": have, "expected": dict(want)})
+    return diffs
+
+
+async def diff_security_exposures(db: AsyncSession) -> list[dict]:
+    """
+    Diff security_exposure against tax_lots, like diff_position_summaries.
+    Rows for securities without open lots must be all zero.
+    """
+    expected = {
+        row.security_id: row._mapping
+        for row in (await db.execute(crud_portfolio.security_exposures_from_lots())).all()
+    }
+    stored = {
+        row.security_id: row
+        for row in (await db.execute(select(SecurityExposure))).scalars().all()
+    }
+
+    zero = {name: Decimal(0) for name in EXPOSURE_COLUMNS}
+    diffs = []
+    for security_id in expected.keys() | stored.keys():
+        want = expected.get(security_id, zero)
+        row = stored.get(security_id)
+        if row is None:
+            diffs.append({"security_id": security_id, "stored": None, "expected": dict(want)})
+            continue
+        have = {name: Decimal(getattr(row, name)) for name in EXPOSURE_COLUMNS}
+        if any(abs(have[name] - Decimal(want[name])) > _TOLERANCE for name in EXPOSURE_COLUMNS):
+            diffs.append({"security_id": security_id, "stored": have, "expected": dict(want)})
+    return diffs
+
+
+async def check(repair: bool) -> int:
+    async with AsyncSessionLocal() as db:
+        diffs = await diff_position_summaries(db)
+        for diff in diffs:
+            logger.warning("portfolio_summary mismatch for %s: stored=%s expected=%s",
+                           diff["position"], diff["stored"], diff["expected"])
+        exposure_diffs = await diff_security_exposures(db)
+        for diff in exposure_diffs:
+            logger.warning("security_exposure mismatch for security %s: stored=%s expected=%s",
+                           diff["security_id"], diff["stored"], diff["expected"])
+        if repair:
+            if diffs:
+                await crud_portfolio.refresh_position_summaries(db)
+                logger.info("Rebuilt portfolio_summary from tax_lots.")
+            if exposure_diffs:
+                await crud_portfolio.refresh_security_exposures(db)
+                logger.info("Rebuilt security_exposure from tax_lots.")
+            await db.commit()
+    await engine.dispose()
+    return len(diffs) + len(exposure_diffs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check portfolio_summary and security_exposure against tax_lots.")
+    parser.add_argument("--repair", action="store_true", help="rebuild the mismatched tables from tax_lots")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mismatches = asyncio.run(check(args.repair))
+    logger.info("%d row(s) differ from tax_lots.", mismatches)
+    sys.exit(1 if mismatches and not args.repair else 0)
+
+
+if __name__ == "__main__":
+    main()
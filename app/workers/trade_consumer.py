@@ -3,22 +3,62 @@ import json
 import logging
 from typing import Any
 
-from aiokafka import AIOKafkaConsumer
+from aiokafka import AIOKafkaConsumer, TopicPartition
+from sqlalchemy.exc import InterfaceError, OperationalError
 
 from app.core.config import settings
 from app.api.v1.schemas.trade import Trade
 from app.database.connection import AsyncSessionLocal
+from app.services.change_listener import change_listener
 from app.services.processing_service import processing_service
+from app.utils.datetime_utils import ensure_timezone_naive
+
+try:
+    from prometheus_client import Gauge
+except ImportError:  # prometheus-client is optional
+    Gauge = None
 
 
 logger = logging.getLogger(__name__)
 
+LANE_QUEUE_DEPTH = (
+    Gauge(
+        "trade_consumer_lane_queue_depth",
+        "Trade batches waiting in each TradeConsumer lane.",
+        ["lane"],
+    )
+    if Gauge is not None
+    else None
+)
+
+# Connection-level failures are retried; anything else marks the trade as bad
+TRANSIENT_DB_ERRORS = (OperationalError, InterfaceError)
+
 
 class TradeConsumer:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        lanes: int = settings.TRADE_CONSUMER_LANES,
+        lane_queue_depth: int = settings.TRADE_CONSUMER_LANE_QUEUE_DEPTH,
+        batch_max_records: int = settings.TRADE_CONSUMER_BATCH_MAX_RECORDS,
+        batch_max_wait_ms: int = settings.TRADE_CONSUMER_BATCH_MAX_WAIT_MS,
+        retry_backoff_ms: int = settings.TRADE_CONSUMER_RETRY_BACKOFF_MS,
+        stop_timeout_ms: int = settings.TRADE_CONSUMER_STOP_TIMEOUT_MS,
+    ) -> None:
         self._consumer: AIOKafkaConsumer | None = None
         self._task: asyncio.Task | None = None
         self._stopping = asyncio.Event()
+        self._lane_count = max(1, lanes)
+        self._lane_queue_depth = lane_queue_depth
+        self._batch_max_records = batch_max_records
+        self._batch_max_wait_ms = batch_max_wait_ms
+        self._retry_backoff = retry_backoff_ms / 1000
+        self._stop_timeout = stop_timeout_ms / 1000
+        self._lanes: list[asyncio.Queue] = []
+        self._lane_tasks: list[asyncio.Task] = []
+        # Dispatched batches awaiting their Kafka offset commit, in fetch order
+        self._pending_commits: asyncio.Queue | None = None
+        self._commit_task: asyncio.Task | None = None
 
     async def start(self) -> None:
         if self._task is not None:
@@ -28,32 +68,131 @@ class TradeConsumer:
             settings.KAFKA_TRADES_TOPIC,
             bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
             group_id=settings.KAFKA_CONSUMER_GROUP,
-            enable_auto_commit=True,
+            # Offsets are committed only after the batch's DB transactions commit
+            enable_auto_commit=False,
             auto_offset_reset="earliest",
         )
         await self._consumer.start()
-        logger.info("TradeConsumer started.")
+        if settings.PRICE_CACHE_ENABLED:
+            # Sells read prices through the cache; keep it in step with other writers
+            await change_listener.start()
+        self._start_lanes()
+        self._pending_commits = asyncio.Queue(maxsize=self._lane_queue_depth)
+        self._commit_task = asyncio.create_task(self._run_commits())
+        logger.info("TradeConsumer started with %d lanes.", self._lane_count)
         self._task = asyncio.create_task(self._run())
 
+    def _start_lanes(self) -> None:
+        self._lanes = [asyncio.Queue(maxsize=self._lane_queue_depth) for _ in range(self._lane_count)]
+        self._lane_tasks = [
+            asyncio.create_task(self._run_lane(index, queue))
+            for index, queue in enumerate(self._lanes)
+        ]
+        if LANE_QUEUE_DEPTH is not None:
+            for index, queue in enumerate(self._lanes):
+                LANE_QUEUE_DEPTH.labels(lane=str(index)).set_function(queue.qsize)
+
+    def lane_for(self, trade: Trade) -> int:
+        # Every trade for a position lands in the same lane, preserving its FIFO order
+        return hash((trade.user_id, trade.security_id)) % self._lane_count
+
+    def lane_depths(self) -> list[int]:
+        return [queue.qsize() for queue in self._lanes]
+
     async def _run(self) -> None:
         assert self._consumer is not None
         try:
-            async for msg in self._consumer:
-                try:
-                    payload: Any = json.loads(msg.value.decode("utf-8"))
-                    trade = Trade(**payload)
-                except Exception as e:
-                    logger.exception("Failed to decode/validate trade payload: %s", e)
+            while True:
+                batch = await self._consumer.getmany(
+                    timeout_ms=self._batch_max_wait_ms,
+                    max_records=self._batch_max_records,
+                )
+                if not batch:
                     continue
 
-                try:
-                    async with AsyncSessionLocal() as session:
-                        await processing_service.process_trade(session, trade)
-                    logger.debug("Processed trade message at offset %s", msg.offset)
-                except Exception as e:
-                    logger.exception("Failed to process trade: %s", e)
+                lane_batches: list[list[Trade]] = [[] for _ in range(self._lane_count)]
+                offsets: dict[TopicPartition, int] = {}
+                for tp, messages in batch.items():
+                    for msg in messages:
+                        try:
+                            payload: Any = json.loads(msg.value.decode("utf-8"))
+                            trade = Trade(**payload)
+                        except Exception as e:
+                            logger.exception("Failed to decode/validate trade payload: %s", e)
+                            continue
+                        lane_batches[self.lane_for(trade)].append(trade)
+                    offsets[tp] = messages[-1].offset + 1
+
+                loop = asyncio.get_running_loop()
+                done: list[asyncio.Future] = []
+                for lane, trades in enumerate(lane_batches):
+                    if trades:
+                        future = loop.create_future()
+                        # Blocks when the lane is full, applying backpressure to the reader
+                        await self._lanes[lane].put((trades, future))
+                        done.append(future)
+                if self._commit_task.done():
+                    raise RuntimeError("offset commit task exited")
+                await self._pending_commits.put((done, offsets))
+        except Exception as e:
+            logger.exception("TradeConsumer failed: %s", e)
         finally:
-            await self._shutdown_consumer()
+            await self._shutdown()
+
+    async def _run_lane(self, index: int, queue: asyncio.Queue) -> None:
+        while True:
+            trades, future = await queue.get()
+            try:
+                await self._process_batch(trades)
+                logger.debug("Lane %d processed a batch of %d trades", index, len(trades))
+                future.set_result(None)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            finally:
+                queue.task_done()
+
+    async def _process_batch(self, trades: list[Trade]) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                await processing_service.process_trades(session, trades)
+            return
+        except Exception as e:
+            logger.warning("Batch of %d trades failed (%s); retrying one at a time.", len(trades), e)
+
+        # The batch transaction rolled back; isolate the failing trade(s) in the
+        # order the batch applies them (stable, so arrival order breaks ties)
+        for trade in sorted(trades, key=lambda t: ensure_timezone_naive(t.timestamp)):
+            await self._process_with_retry(trade)
+
+    async def _process_with_retry(self, trade: Trade) -> None:
+        while True:
+            try:
+                async with AsyncSessionLocal() as session:
+                    await processing_service.process_trade(session, trade)
+                return
+            except TRANSIENT_DB_ERRORS as e:
+                logger.warning("Database unavailable (%s); retrying trade in %.1fs", e, self._retry_backoff)
+                await asyncio.sleep(self._retry_backoff)
+            except Exception as e:
+                logger.exception("Failed to process trade: %s", e)
+                return
+
+    async def _run_commits(self) -> None:
+        while True:
+            done, offsets = await self._pending_commits.get()
+            try:
+                results = await asyncio.gather(*done, return_exceptions=True)
+                if any(isinstance(result, BaseException) for result in results):
+                    logger.warning("Not committing offsets %s; a lane did not finish the batch.", offsets)
+                    continue
+                await self._consumer.commit(offsets)
+            except Exception as e:
+                # Offsets are cumulative: the next batch's commit covers these,
+                # and until then the trades are replayed and deduplicated
+                logger.warning("Committing offsets %s failed: %s", offsets, e)
+            finally:
+                self._pending_commits.task_done()
 
     async def _shutdown_consumer(self) -> None:
         if self._consumer is not None:
@@ -63,12 +202,56 @@ class TradeConsumer:
                 self._consumer = None
                 logger.info("TradeConsumer stopped.")
 
+    async def _stop_lanes(self) -> None:
+        # Let the lanes finish trades already handed to them before cancelling
+        try:
+            for queue in self._lanes:
+                await queue.join()
+        finally:
+            for task in self._lane_tasks:
+                task.cancel()
+            await asyncio.gather(*self._lane_tasks, return_exceptions=True)
+            # Batches no lane picked up are never committed
+            for queue in self._lanes:
+                while not queue.empty():
+                    _, future = queue.get_nowait()
+                    future.cancel()
+            self._lanes = []
+            self._lane_tasks = []
+
+    async def _stop_commits(self) -> None:
+        if self._commit_task is None:
+            return
+        # Commit offsets for every batch the lanes finished
+        try:
+            if not self._commit_task.done():
+                await self._pending_commits.join()
+        finally:
+            self._commit_task.cancel()
+            await asyncio.gather(self._commit_task, return_exceptions=True)
+            self._commit_task = None
+            self._pending_commits = None
+
+    async def _shutdown(self) -> None:
+        try:
+            await self._stop_lanes()
+        finally:
+            try:
+                await self._stop_commits()
+            finally:
+                await self._shutdown_consumer()
+                await change_listener.stop()
+
     async def stop(self) -> None:
         if self._task is None:
             return
         self._task.cancel()
         try:
-            await self._task
+            # Shutdown drains the lanes; past the timeout their batches are
+            # cancelled and their uncommitted trades replayed on restart
+            await asyncio.wait_for(self._task, self._stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("TradeConsumer did not drain within %.1fs; cancelled in-flight batches.", self._stop_timeout)
         except asyncio.CancelledError:
             pass
         finally:
@@ -76,5 +259,3 @@ class TradeConsumer:
 
 
 trade_consumer = TradeConsumer()
-
-
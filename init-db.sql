@@ -51,13 +51,47 @@ CREATE TABLE security_prices (
     CONSTRAINT check_price_positive CHECK (price > 0)
 );
 
--- Create portfolio_summary table (deprecated but kept for compatibility)
+-- Create trades journal (append-only; tax lots are rebuilt from it)
+CREATE TABLE trades (
+    id BIGSERIAL PRIMARY KEY,
+    trade_id VARCHAR(64),
+    user_id INTEGER NOT NULL,
+    security_id INTEGER NOT NULL,
+    side VARCHAR(4) NOT NULL,
+    quantity NUMERIC(19,4) NOT NULL,
+    price NUMERIC(19,4) NOT NULL,
+    charges NUMERIC(19,4) NOT NULL DEFAULT 0,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    recorded_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+
+    -- Constraints
+    CONSTRAINT check_trade_side CHECK (side IN ('BUY', 'SELL')),
+    CONSTRAINT check_trade_quantity_positive CHECK (quantity > 0)
+);
+
+-- Create processed_trades table (trade_id dedup for idempotent ingestion)
+CREATE TABLE processed_trades (
+    trade_id VARCHAR(64) PRIMARY KEY,
+    processed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- Create security_exposure table (per-security aggregate of open tax_lots)
+CREATE TABLE security_exposure (
+    security_id INTEGER PRIMARY KEY,
+    open_lots INTEGER NOT NULL DEFAULT 0,
+    remaining_qty DECIMAL(19,4) NOT NULL DEFAULT 0,
+    holders INTEGER NOT NULL DEFAULT 0,
+    last_updated TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Create portfolio_summary table (per-position aggregate of tax_lots)
 CREATE TABLE portfolio_summary (
     id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL,
     security_id INTEGER NOT NULL,
     quantity NUMERIC(19,4) NOT NULL DEFAULT 0,
     avg_cost_basis NUMERIC(19,4) NOT NULL DEFAULT 0,
+    total_cost NUMERIC(28,8) NOT NULL DEFAULT 0,
     current_price NUMERIC(19,4) NOT NULL DEFAULT 0,
     unrealized_pnl NUMERIC(19,4) NOT NULL DEFAULT 0,
     realized_pnl_ytd NUMERIC(19,4) NOT NULL DEFAULT 0,
@@ -86,6 +120,10 @@ CREATE INDEX idx_close_date ON tax_lots(close_date);
 -- Create indexes for security_prices
 CREATE INDEX idx_updated_at ON security_prices(updated_at);
 
+-- Create indexes for trades and processed_trades
+CREATE INDEX idx_trades_user_security_id ON trades(user_id, security_id, id);
+CREATE INDEX ix_processed_trades_processed_at ON processed_trades(processed_at);
+
 -- Create indexes for portfolio_summary
 CREATE INDEX idx_portfolio_user_id ON portfolio_summary(user_id);
 CREATE INDEX idx_portfolio_security_id ON portfolio_summary(security_id);
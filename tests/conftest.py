@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+# Settings are read on import; point them at a throwaway SQLite database first
+_DB_PATH = os.path.join(tempfile.mkdtemp(prefix="position-tracker-tests-"), "test.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_DB_PATH}")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+
+import asyncio
+
+import pytest
+import pytest_asyncio
+from fastapi.testclient import TestClient
+
+from app.database.connection import AsyncSessionLocal, engine
+from app.database.models import portfolio, tax_lot, price, processed_trade, trade, security_exposure
+from app.main import app
+from app.services.price_cache import price_cache
+from app.services.snapshot_cache import snapshot_cache
+
+MODELS = (portfolio, tax_lot, price, processed_trade, trade, security_exposure)
+
+
+async def _reset_database() -> None:
+    async with engine.begin() as conn:
+        for model in MODELS:
+            await conn.run_sync(model.Base.metadata.drop_all)
+            await conn.run_sync(model.Base.metadata.create_all)
+    # Connections are bound to the event loop that opened them
+    await engine.dispose()
+    price_cache.clear()
+    snapshot_cache.clear()
+
+
+@pytest_asyncio.fixture
+async def test_db():
+    """A session on an empty database. Objects stay readable after commit."""
+    await _reset_database()
+    async with AsyncSessionLocal(expire_on_commit=False) as db:
+        yield db
+    await engine.dispose()
+
+
+@pytest.fixture
+def client():
+    """An API client on an empty database, with startup and shutdown run."""
+    asyncio.run(_reset_database())
+    with TestClient(app) as test_client:
+        yield test_client
@@ -1,8 +1,9 @@
+import json
 import pytest
 from decimal import Decimal
 from datetime import datetime, timedelta
 from fastapi.testclient import TestClient
-from app.models.tax_lot import TaxLot, LotStatus
+from app.database.models.tax_lot import TaxLot, LotStatus
 
 class TestAPIEndpoints:
     """Integration tests for API endpoints."""
@@ -59,6 +60,40 @@ class TestAPIEndpoints:
         assert response.status_code == 202
         assert "Trade accepted for processing" in response.json()["message"]
 
+    def test_batch_trade_endpoint(self, client):
+        """Test batch trade simulation endpoint."""
+        trades = [
+            {
+                "user_id": 123,
+                "security_id": 1,
+                "side": "BUY",
+                "quantity": 100.0,
+                "price": 150.0,
+                "timestamp": "2024-01-01T10:00:00Z",
+                "charges": 5.0
+            },
+            {
+                "user_id": 123,
+                "security_id": 1,
+                "side": "SELL",
+                "quantity": 40.0,
+                "price": 170.0,
+                "timestamp": "2024-02-01T10:00:00Z",
+                "charges": 3.0
+            }
+        ]
+        client.post("/api/v1/simulate/prices", json={"security_id": 1, "price": 170.0})
+
+        response = client.post("/api/v1/simulate/trades:batch", json=trades)
+        assert response.status_code == 202
+        assert "2 trades accepted for processing" in response.json()["message"]
+
+        response = client.get("/api/v1/taxlots/?user_id=123")
+        lots = response.json()
+        assert len(lots) == 1
+        assert Decimal(lots[0]["remaining_qty"]) == Decimal("60.0")
+        assert lots[0]["status"] == "PARTIAL"
+
     def test_price_update_endpoint(self, client):
         """Test price update endpoint."""
         price_data = {
@@ -71,6 +106,33 @@ class TestAPIEndpoints:
         assert response.status_code == 200
         assert "Price for 1 updated to 175.0" in response.json()["message"]
 
+    def test_price_update_rejects_non_positive_price(self, client):
+        """Test the single-price endpoint answers 422 for a zero or negative price."""
+        for price in (0, -1.5):
+            response = client.post("/api/v1/simulate/prices", json={"security_id": 1, "price": price})
+            assert response.status_code == 422
+
+        response = client.post("/api/v1/simulate/prices", json={"security_id": 1, "price": 175.0})
+        assert response.status_code == 200
+
+    def test_price_batch_endpoint(self, client):
+        """Test bulk price upsert inserts, updates and skips unchanged prices."""
+        response = client.post("/api/v1/simulate/prices:batch", json=[
+            {"security_id": 1, "price": 175.0},
+            {"security_id": 2, "price": 50.0}
+        ])
+        assert response.status_code == 200
+        assert "2 prices received, 2 changed" in response.json()["message"]
+
+        response = client.post("/api/v1/simulate/prices:batch", json=[
+            {"security_id": 1, "price": 175.0},
+            {"security_id": 2, "price": 55.0}
+        ])
+        assert "2 prices received, 1 changed" in response.json()["message"]
+
+        response = client.post("/api/v1/simulate/prices:batch", json=[{"security_id": 1, "price": 0}])
+        assert response.status_code == 422
+
     def test_eod_taxes_endpoint(self, client):
         """Test end-of-day taxes endpoint."""
         eod_data = {
@@ -149,6 +211,90 @@ class TestAPIEndpoints:
         assert lot["remaining_qty"] == 100.0
         assert lot["status"] == "OPEN"
 
+    def test_tax_lots_stream_ndjson(self, client):
+        """Test streamed tax lots match the JSON listing, one lot per line."""
+        for day in range(1, 4):
+            client.post("/api/v1/simulate/trades", json={
+                "user_id": 123,
+                "security_id": 1,
+                "side": "BUY",
+                "quantity": 10.0,
+                "price": 150.0,
+                "timestamp": f"2024-01-0{day}T10:00:00Z",
+                "charges": 1.0
+            })
+
+        listed = client.get("/api/v1/taxlots/?user_id=123").json()
+        response = client.get("/api/v1/taxlots/?user_id=123&stream=true")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert [json.loads(line) for line in response.text.splitlines()] == listed
+
+    def test_tax_lots_keyset_pagination(self, client):
+        """Test paging through tax lots with limit and cursor."""
+        for day in range(1, 6):
+            client.post("/api/v1/simulate/trades", json={
+                "user_id": 123,
+                "security_id": 1,
+                "side": "BUY",
+                "quantity": 10.0,
+                "price": 150.0,
+                "timestamp": f"2024-01-0{day}T10:00:00Z",
+                "charges": 1.0
+            })
+
+        listed = client.get("/api/v1/taxlots/?user_id=123").json()
+        paged, cursor = [], None
+        while True:
+            params = {"user_id": 123, "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/api/v1/taxlots/", params=params)
+            assert len(response.json()) <= 2
+            paged.extend(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        assert paged == listed
+
+        # Event master pages keep totals for the whole security
+        page = client.get("/api/v1/taxlots/event-master/1?limit=2").json()
+        assert len(page["lots"]) == 2
+        assert page["total_open_lots"] == 5
+        assert page["next_cursor"] is not None
+
+        # Totals only, from the aggregate query
+        summary = client.get("/api/v1/taxlots/event-master/1?include_lots=false").json()
+        assert summary["lots"] == []
+        assert summary["total_open_lots"] == 5
+        assert summary["total_remaining_qty"] == 50.0
+        assert summary["total_users_affected"] == 1
+
+    def test_event_master_bulk(self, client):
+        """Test bulk Event Master totals and lots for several securities."""
+        for security_id, quantity in ((1, 100.0), (2, 50.0)):
+            client.post("/api/v1/simulate/trades", json={
+                "user_id": 123,
+                "security_id": security_id,
+                "side": "BUY",
+                "quantity": quantity,
+                "price": 150.0,
+                "timestamp": "2024-01-01T10:00:00Z",
+                "charges": 1.0
+            })
+
+        response = client.post("/api/v1/taxlots/event-master:bulk", json={
+            "security_ids": [1, 2, 999],
+            "include_lots": True
+        })
+        assert response.status_code == 200
+
+        data = response.json()
+        assert [s["security_id"] for s in data["securities"]] == [1, 2]
+        assert [s["total_remaining_qty"] for s in data["securities"]] == [100.0, 50.0]
+        assert [len(s["lots"]) for s in data["securities"]] == [1, 1]
+        assert data["not_found"] == [999]
+
     def test_tax_lots_with_security_filter(self, client):
         """Test tax lots endpoint with security filter."""
         # Create trades for different securities
@@ -250,6 +396,35 @@ class TestAPIEndpoints:
         response = client.post("/api/v1/simulate/trades", json=incomplete_trade)
         assert response.status_code == 422  # Validation error
 
+    def test_portfolio_snapshots_batch_endpoint(self, client):
+        """Test batch snapshots match the single-user snapshot."""
+        for user_id in (123, 124):
+            client.post("/api/v1/simulate/trades", json={
+                "user_id": user_id,
+                "security_id": 1,
+                "side": "BUY",
+                "quantity": 100.0,
+                "price": 150.0,
+                "timestamp": "2024-01-01T10:00:00Z",
+                "charges": 5.0
+            })
+        client.post("/api/v1/simulate/prices", json={"security_id": 1, "price": 175.0})
+
+        by_list = client.post("/api/v1/portfolios/snapshots", json={"user_ids": [123, 124, 999]})
+        by_range = client.post("/api/v1/portfolios/snapshots", json={"user_id_from": 100, "user_id_to": 200})
+        assert by_list.status_code == 200
+        assert by_range.status_code == 200
+
+        snapshots = by_list.json()["snapshots"]
+        assert [s["positions"] for s in snapshots] == [s["positions"] for s in by_range.json()["snapshots"]]
+        assert [s["summary"]["user_id"] for s in snapshots] == [123, 124]
+        single = client.get("/api/v1/portfolios/123/snapshot").json()
+        assert snapshots[0]["positions"] == single["positions"]
+
+        # Either user_ids or a range, not both
+        response = client.post("/api/v1/portfolios/snapshots", json={"user_ids": [1], "user_id_from": 1, "user_id_to": 2})
+        assert response.status_code == 422
+
     def test_portfolio_snapshot_nonexistent_user(self, client):
         """Test portfolio snapshot for non-existent user."""
         response = client.get("/api/v1/portfolios/999/snapshot")
@@ -0,0 +1,38 @@
+from decimal import Decimal
+from app.services.change_listener import (
+    ChangeListener,
+    parse_price_notification,
+    parse_trade_notification,
+)
+from app.services.portfolio_stream import portfolio_streams
+from app.services.price_cache import price_cache
+
+class TestChangeListener:
+    """Test cases for cross-process change notifications."""
+
+    def test_parse_price_notification(self):
+        """Test price NOTIFY payloads carry comma separated security ids."""
+        assert parse_price_notification("1,22,333") == [1, 22, 333]
+
+    def test_parse_trade_notification(self):
+        """Test trade NOTIFY payloads carry positions and whether they are still held."""
+        assert parse_trade_notification("123:1:1,123:2:0,7:3:") == [
+            (123, 1, True),
+            (123, 2, False),
+            (7, 3, None),
+        ]
+
+    def test_price_notification_invalidates_cache(self):
+        """Test a price change from another process drops the cached price."""
+        price_cache.put_many({41: Decimal("10")}, price_cache.token())
+        ChangeListener._on_price_notify(None, 0, "price_updates", "41")
+        assert price_cache.get(41) is None
+
+    def test_trade_notification_wakes_streams(self):
+        """Test a trade committed by another process wakes the user's streams."""
+        subscriber = portfolio_streams.subscribe(123)
+        try:
+            ChangeListener._on_trade_notify(None, 0, "trade_updates", "123:1:1")
+            assert subscriber.changed.is_set()
+        finally:
+            portfolio_streams.unsubscribe(subscriber)
@@ -0,0 +1,111 @@
+import copy
+import random
+import pytest
+from types import SimpleNamespace
+from decimal import Decimal, ROUND_HALF_UP
+from datetime import datetime, timedelta
+
+np = pytest.importorskip("numpy")
+
+from app.utils.fifo_kernel import match_fifo, fifo_cutoff, to_scaled, to_scaled_array, from_scaled
+from app.api.v1.schemas.trade import Trade
+from app.services.processing_service import processing_service
+
+class TestFifoKernel:
+    """Test cases for the vectorized FIFO matching kernel."""
+
+    def test_scaled_round_trip(self):
+        """Test 4-dp values convert to scaled integers and back exactly."""
+        values = [Decimal("100.1234"), Decimal("0.0001"), None]
+
+        assert to_scaled(Decimal("100.1234")) == 1001234
+        assert to_scaled_array(values).tolist() == [1001234, 1, 0]
+        assert from_scaled(1001234) == Decimal("100.1234")
+
+    def test_cutoff_finds_last_touched_lot(self):
+        """Test the cumulative-sum cutoff stops at the lot that completes the sell."""
+        remaining = to_scaled_array([Decimal("50"), Decimal("30"), Decimal("20")])
+
+        assert fifo_cutoff(remaining, to_scaled(Decimal("50"))) == 1
+        assert fifo_cutoff(remaining, to_scaled(Decimal("60"))) == 2
+        assert fifo_cutoff(remaining, to_scaled(Decimal("500"))) == 3
+
+    def test_match_with_mixed_holding_periods(self):
+        """Test consumed quantity, charge allocation and the STCG/LTCG split."""
+        remaining = to_scaled_array([Decimal("100"), Decimal("50")])
+        match = match_fifo(
+            remaining,
+            to_scaled_array([Decimal("100"), Decimal("50")]),
+            to_scaled_array([Decimal("100"), Decimal("120")]),
+            to_scaled_array([Decimal("10"), Decimal("0")]),
+            open_date=[datetime(2022, 1, 1), datetime(2024, 1, 1)],
+            sell_qty=to_scaled(Decimal("120")),
+            sell_price=to_scaled(Decimal("150")),
+            sell_charges=to_scaled(Decimal("12")),
+            sell_date=datetime(2024, 6, 1),
+        )
+
+        assert [from_scaled(v) for v in match.consumed] == [Decimal("100"), Decimal("20")]
+        # Lot 1: (150 - 100) * 100 - (10/100 + 12/120) * 100 = 4980, long-term
+        # Lot 2: (150 - 120) * 20 - (0 + 12/120) * 20 = 598, short-term
+        assert [from_scaled(v) for v in match.realized_pnl] == [Decimal("4980"), Decimal("598")]
+        assert [from_scaled(v) for v in match.ltcg] == [Decimal("622.5"), Decimal("0")]
+        assert [from_scaled(v) for v in match.stcg] == [Decimal("0"), Decimal("149.5")]
+
+    def _lot(self, open_qty, remaining_qty, open_price, charges, open_date):
+        # Shaped like a BookLot
+        return SimpleNamespace(
+            open_qty=open_qty, remaining_qty=remaining_qty, close_qty=open_qty - remaining_qty,
+            open_price=open_price, charges=charges, open_date=open_date,
+            realized_pnl=Decimal("0"), stcg=Decimal("0"), ltcg=Decimal("0"),
+            status=None, close_date=None, close_price=None,
+        )
+
+    def _assert_same_as_decimal_loop(self, lots, trade):
+        expected, actual = copy.deepcopy(lots), copy.deepcopy(lots)
+        processing_service._match_sell(expected, trade, trade.price)
+        assert processing_service._match_sell_vectorized(actual, trade, trade.price) is not None
+
+        for lot, kernel_lot in zip(expected, actual):
+            assert kernel_lot.remaining_qty == lot.remaining_qty
+            assert kernel_lot.status == lot.status
+            for name in ("realized_pnl", "stcg", "ltcg"):
+                # Stored rounded to the Numeric(19, 4) column scale
+                stored = getattr(lot, name).quantize(Decimal("0.0001"), ROUND_HALF_UP)
+                assert getattr(kernel_lot, name) == stored, (name, lots, trade)
+
+    def test_charges_rounded_once(self, monkeypatch):
+        """Test a gain just below a rounding tie is not pushed over it by rounding each charge share."""
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "FIFO_VECTORIZE_MIN_LOTS", 0)
+
+        lots = [self._lot(Decimal("0.6083"), Decimal("0.6083"), Decimal("0.4511"), Decimal("0.3177"), datetime(2023, 7, 4))]
+        trade = Trade(user_id=123, security_id=1, side="SELL", quantity=Decimal("0.5887"), price=Decimal("0.3154"),
+                      timestamp=datetime(2025, 1, 1), charges=Decimal("0.2797"))
+
+        # Exactly -0.66704999..., so -0.6670 and not -0.6671
+        self._assert_same_as_decimal_loop(lots, trade)
+
+    def test_matches_decimal_loop_on_random_sells(self, monkeypatch):
+        """Test the kernel books the same P&L and taxes as _match_sell for random 4-dp sells."""
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "FIFO_VECTORIZE_MIN_LOTS", 0)
+        rng = random.Random(7)
+
+        def value(high):
+            return Decimal(rng.randint(1, high)).scaleb(-4)
+
+        for _ in range(2000):
+            # Small magnitudes stay in int64, large ones take the exact Python int path
+            size = rng.choice((10 ** 5, 10 ** 8))
+            lots = []
+            for _ in range(rng.randint(1, 6)):
+                open_qty = value(size)
+                lots.append(self._lot(
+                    open_qty, min(open_qty, value(size)), value(size), value(size // 100) - Decimal("0.0001"),
+                    datetime(2023, 1, 1) + timedelta(days=rng.randint(0, 700)),
+                ))
+            held = sum(lot.remaining_qty for lot in lots)
+            trade = Trade(user_id=123, security_id=1, side="SELL", quantity=value(int(held.scaleb(4))),
+                          price=value(size), timestamp=datetime(2025, 1, 1), charges=value(size // 100))
+            self._assert_same_as_decimal_loop(lots, trade)
@@ -0,0 +1,32 @@
+from app.services.event_bus import event_bus, TRADE_APPLIED
+from app.services.holdings_index import HoldingsIndex, holdings_index
+
+class TestHoldingsIndex:
+    """Test cases for the security -> holders reverse index."""
+
+    def test_not_loaded_returns_none(self):
+        """Test callers can tell an unloaded index from a security with no holders."""
+        index = HoldingsIndex()
+        index.set_holding(1, 10, True)
+
+        assert index.holders(10) is None
+
+    def test_open_and_close_transitions(self):
+        """Test positions opening and closing update the holders of a security."""
+        index = HoldingsIndex()
+        index._loaded = True
+        index.set_holding(1, 10, True)
+        index.set_holding(2, 10, True)
+        index.set_holding(1, 10, False)
+        index.set_holding(2, 10, None)  # Unknown: left as is
+
+        assert index.holders(10) == frozenset({2})
+        assert index.holders(11) == frozenset()
+
+    def test_trade_events_update_shared_index(self):
+        """Test committed trade events reach the shared index."""
+        event_bus.publish(TRADE_APPLIED, user_id=5, security_id=50, holding=True)
+        assert 5 in holdings_index._holders[50]
+
+        event_bus.publish(TRADE_APPLIED, user_id=5, security_id=50, holding=False)
+        assert 50 not in holdings_index._holders
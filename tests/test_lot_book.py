@@ -0,0 +1,180 @@
+import asyncio
+import pytest
+from collections import deque
+from decimal import Decimal
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import update
+from app.core.exceptions import StaleLotError
+from app.services.lot_book import BookLot, LotBook, insert_fifo, drop_closed
+from app.services.processing_service import processing_service
+from app.database.models.tax_lot import TaxLot, LotStatus
+from app.api.v1.schemas.trade import Trade
+
+class TestLotBook:
+    """Test cases for the in-memory FIFO lot book."""
+
+    def _lot(self, day: int, qty: str = "10.0", price: str = "100.0") -> BookLot:
+        return BookLot(
+            user_id=123,
+            security_id=1,
+            open_date=datetime(2024, 1, day, 10, 0, 0),
+            open_qty=Decimal(qty),
+            open_price=Decimal(price),
+        )
+
+    def test_insert_fifo_keeps_open_date_order(self):
+        """Test back-dated lots are placed ahead of later lots."""
+        lots = deque()
+        insert_fifo(lots, self._lot(1))
+        insert_fifo(lots, self._lot(10))
+        insert_fifo(lots, self._lot(5))
+
+        assert [lot.open_date.day for lot in lots] == [1, 5, 10]
+
+    def test_sell_matches_book_lots(self):
+        """Test the shared FIFO matcher works on book lots and drops closed ones."""
+        lots = deque([self._lot(1), self._lot(2)])
+        sell_trade = Trade(
+            user_id=123,
+            security_id=1,
+            side="SELL",
+            quantity=Decimal("15.0"),
+            price=Decimal("110.0"),
+            timestamp=datetime(2024, 2, 1, 10, 0, 0),
+            charges=Decimal("0")
+        )
+
+        touched = processing_service._match_sell(lots, sell_trade, Decimal("110.0"))
+        drop_closed(lots)
+
+        assert len(touched) == 2
+        assert touched[0].status == LotStatus.CLOSED
+        assert touched[0].realized_pnl == Decimal("100.0")
+        assert len(lots) == 1
+        assert lots[0].remaining_qty == Decimal("5.0")
+        assert lots[0].status == LotStatus.PARTIAL
+
+    def _book_with_position(self, *lots) -> LotBook:
+        book = LotBook(flush_batch_size=2, max_staleness_ms=60_000)
+        book._positions[(123, 1)] = deque(lots)
+        return book
+
+    def _sell(self, qty: str) -> Trade:
+        return Trade(
+            user_id=123,
+            security_id=1,
+            side="SELL",
+            quantity=Decimal(qty),
+            price=Decimal("110.0"),
+            timestamp=datetime(2024, 2, 1, 10, 0, 0),
+            charges=Decimal("0")
+        )
+
+    def test_dirty_tracking(self):
+        """Test lots are tracked once until flushed, starting when the transaction commits."""
+        book = self._book_with_position()
+        db = SimpleNamespace(info={})
+        lots = asyncio.run(book.get_position(db, 123, 1))
+        lot = self._lot(1)
+
+        book.add_lot(db, lots, lot)
+        book.touch(db, [lot])
+        assert book.dirty_count == 0
+        book.commit_changes(db)
+        assert book.dirty_count == 1
+        assert not book._should_flush()
+
+        book.mark_dirty([self._lot(2)])
+        assert book.dirty_count == 2
+        assert book._should_flush()
+
+    def test_discard_restores_position(self):
+        """Test a rolled back sell and buy leave the book as it was."""
+        first, second = self._lot(1), self._lot(2)
+        book = self._book_with_position(first, second)
+        db = SimpleNamespace(info={})
+
+        lots = asyncio.run(book.get_position(db, 123, 1))
+        book.touch(db, processing_service._match_sell(lots, self._sell("15.0"), Decimal("110.0")))
+        drop_closed(lots)
+        book.add_lot(db, lots, self._lot(3))
+        book.discard_changes(db)
+
+        lots = book._positions[(123, 1)]
+        assert list(lots) == [first, second]
+        assert first.remaining_qty == Decimal("10.0")
+        assert first.status == LotStatus.OPEN
+        assert first.realized_pnl == Decimal("0")
+        assert second.remaining_qty == Decimal("10.0")
+        assert book.dirty_count == 0
+        assert not book._locks[(123, 1)].locked()
+
+    def test_flush_skips_checked_out_positions(self):
+        """Test lots of a position in an open transaction are not flushed yet."""
+        lot = self._lot(1)
+        book = self._book_with_position(lot)
+        book.mark_dirty([lot])
+        db = SimpleNamespace(info={})
+
+        asyncio.run(book.get_position(db, 123, 1))
+        assert asyncio.run(book.flush()) == 0
+        assert book.dirty_count == 1
+
+    async def _stored_lot(self, test_db, security_id: int):
+        lot = TaxLot(
+            user_id=123,
+            security_id=security_id,
+            open_date=datetime(2024, 1, 1, 10, 0, 0),
+            open_qty=Decimal("10.0"),
+            remaining_qty=Decimal("10.0"),
+            open_price=Decimal("100.0"),
+            charges=Decimal("0.0"),
+            status=LotStatus.OPEN
+        )
+        test_db.add(lot)
+        await test_db.commit()
+        return lot
+
+    async def _sell_in_book(self, book, test_db, security_id: int, qty: str):
+        lots = await book.get_position(test_db, 123, security_id)
+        sell_trade = self._sell(qty).model_copy(update={"security_id": security_id})
+        book.touch(test_db, processing_service._match_sell(lots, sell_trade, Decimal("110.0")))
+        drop_closed(lots)
+        book.commit_changes(test_db)
+
+    @pytest.mark.asyncio
+    async def test_closed_position_forgotten_after_flush(self, test_db):
+        """Test a position left without open lots leaves the book once its lots are flushed."""
+        await self._stored_lot(test_db, 1)
+        book = LotBook()
+
+        await self._sell_in_book(book, test_db, 1, "10.0")
+        assert (123, 1) in book._positions
+
+        assert await book.flush() == 1
+        assert (123, 1) not in book._positions
+        assert (123, 1) not in book._locks
+
+    @pytest.mark.asyncio
+    async def test_stale_lot_drops_only_its_position(self, test_db):
+        """Test a lot changed outside the book reloads its position while other lots still flush."""
+        stale = await self._stored_lot(test_db, 1)
+        fresh = await self._stored_lot(test_db, 2)
+        book = LotBook()
+
+        await self._sell_in_book(book, test_db, 1, "4.0")
+        await self._sell_in_book(book, test_db, 2, "4.0")
+        await test_db.execute(update(TaxLot).where(TaxLot.id == stale.id).values(version=TaxLot.version + 1))
+        await test_db.commit()
+
+        with pytest.raises(StaleLotError):
+            await book.flush()
+        assert (123, 1) not in book._positions
+        assert book.dirty_count == 1
+
+        assert await book.flush() == 1
+        await test_db.refresh(fresh)
+        assert fresh.remaining_qty == Decimal("6.0")
+        lots = await book.get_position(test_db, 123, 1)
+        assert lots[0].remaining_qty == Decimal("10.0")
@@ -0,0 +1,38 @@
+from decimal import Decimal
+from datetime import datetime
+from app.services.lot_index import PositionIndex, LotIndex
+
+class TestLotIndex:
+    """Test cases for the prefix-sum open-lot index."""
+
+    def _index(self) -> PositionIndex:
+        return PositionIndex(
+            (lot_id, Decimal("10.0"), datetime(2024, 1, lot_id, 10, 0, 0))
+            for lot_id in (1, 2, 3)
+        )
+
+    def test_lots_for_returns_only_touched_lots(self):
+        """Test a sell resolves to the FIFO prefix it consumes."""
+        index = self._index()
+
+        assert index.lots_for(Decimal("15.0")) == [(1, Decimal("10.0")), (2, Decimal("10.0"))]
+        assert index.lots_for(Decimal("10.0")) == [(1, Decimal("10.0"))]
+
+    def test_consume_tracks_partial_lots(self):
+        """Test consumed quantity carries over into the next lookup."""
+        index = self._index()
+        index.consume(Decimal("15.0"))
+
+        assert index.open_quantity == Decimal("15.0")
+        assert index.lots_for(Decimal("8.0")) == [(2, Decimal("5.0")), (3, Decimal("10.0"))]
+
+    def test_append_requires_fifo_order(self):
+        """Test back-dated lots cannot be appended and the LRU bound is kept."""
+        index = self._index()
+        assert not index.can_append(datetime(2024, 1, 2, 10, 0, 0))
+        assert index.can_append(datetime(2024, 1, 5, 10, 0, 0))
+
+        lots = LotIndex(max_positions=1)
+        lots.build((1, 1), [])
+        lots.build((1, 2), [])
+        assert lots.get((1, 1)) is None
@@ -0,0 +1,104 @@
+import pytest
+from types import SimpleNamespace
+from decimal import Decimal
+from datetime import datetime
+from app.workers.lot_rebuilder import replay_position
+from app.database.models.tax_lot import LotStatus
+
+class TestLotRebuilder:
+    """Test cases for re-deriving tax lots from the trade journal."""
+
+    def _trade(self, side: str, day: int, qty: str, price: str, charges: str = "0.0"):
+        # Shaped like a row of the trades journal
+        return SimpleNamespace(
+            user_id=123,
+            security_id=1,
+            side=side,
+            quantity=Decimal(qty),
+            price=Decimal(price),
+            charges=Decimal(charges),
+            timestamp=datetime(2024, 1, day, 10, 0, 0),
+        )
+
+    def test_replay_matches_fifo(self):
+        """Test a replayed sell closes the oldest lot first at the journaled price."""
+        lots = replay_position([
+            self._trade("BUY", 1, "10.0", "100.0"),
+            self._trade("BUY", 2, "10.0", "110.0"),
+            self._trade("SELL", 3, "15.0", "120.0"),
+        ])
+
+        assert [lot.status for lot in lots] == [LotStatus.CLOSED, LotStatus.PARTIAL]
+        assert lots[0].realized_pnl == Decimal("200.0")
+        assert lots[1].remaining_qty == Decimal("5.0")
+        assert lots[1].realized_pnl == Decimal("50.0")
+
+    def test_replay_rounds_like_the_database(self):
+        """Test P&L is rounded to the column scale after every sell."""
+        lots = replay_position([
+            self._trade("BUY", 1, "3.0", "100.0", charges="1.0"),
+            self._trade("SELL", 2, "1.0", "100.0"),
+        ])
+
+        assert lots[0].realized_pnl == Decimal("-0.3333")
+
+    async def _rebuild(self, test_db):
+        from app.workers.lot_rebuilder import _prepare_staging, _rebuild_partition, _swap_in_staging
+        await test_db.commit()
+        await _prepare_staging()
+        await _rebuild_partition(0, 1, 100)
+        await _swap_in_staging()
+
+    async def _lots(self, test_db, user_id: int):
+        from sqlalchemy import select
+        from app.database.models.tax_lot import TaxLot
+        result = await test_db.execute(
+            select(TaxLot).where(TaxLot.user_id == user_id).order_by(TaxLot.open_date)
+        )
+        return result.scalars().all()
+
+    def _lot(self, user_id: int, day: int, qty: str, remaining: str):
+        from app.database.models.tax_lot import TaxLot
+        return TaxLot(
+            user_id=user_id,
+            security_id=1,
+            open_date=datetime(2024, 1, day, 10, 0, 0),
+            open_qty=Decimal(qty),
+            remaining_qty=Decimal(remaining),
+            open_price=Decimal("100.0"),
+            charges=Decimal("0.0"),
+            status=LotStatus.OPEN if qty == remaining else LotStatus.PARTIAL,
+        )
+
+    @pytest.mark.asyncio
+    async def test_rebuild_skips_position_with_pre_journal_lots(self, test_db):
+        """Test a position whose lots predate its journal keeps them instead of losing them."""
+        from app.repositories.crud_operations import crud_ops
+
+        # Bought before the journal existed, then partially sold through it
+        test_db.add(self._lot(123, 1, "10.0", "5.0"))
+        await crud_ops.append_trades(test_db, [
+            {**vars(self._trade("SELL", 2, "5.0", "120.0"))},
+        ])
+        await self._rebuild(test_db)
+
+        lots = await self._lots(test_db, 123)
+        assert len(lots) == 1
+        assert lots[0].remaining_qty == Decimal("5.0")
+
+    @pytest.mark.asyncio
+    async def test_rebuild_keeps_lots_of_positions_not_in_journal(self, test_db):
+        """Test rebuilt lots get new ids next to lots of positions the journal does not cover."""
+        from app.repositories.crud_operations import crud_ops
+
+        test_db.add_all([self._lot(456, 1, "10.0", "10.0"), self._lot(456, 2, "10.0", "10.0")])
+        await crud_ops.append_trades(test_db, [
+            {**vars(self._trade("BUY", 3, "10.0", "100.0"))},
+            {**vars(self._trade("SELL", 4, "4.0", "120.0"))},
+        ])
+        await self._rebuild(test_db)
+
+        assert len(await self._lots(test_db, 456)) == 2
+        lots = await self._lots(test_db, 123)
+        assert len(lots) == 1
+        assert lots[0].remaining_qty == Decimal("6.0")
@@ -0,0 +1,50 @@
+import json
+from decimal import Decimal
+from datetime import datetime
+from app.api.v1.schemas.portfolio import PortfolioSnapshot, PortfolioSummary, PortfolioPosition
+from app.services.portfolio_stream import _dump_snapshot, diff_snapshots
+
+class TestPortfolioStream:
+    """Test cases for portfolio stream deltas."""
+
+    def _snapshot(self, prices: dict[str, str], hour: int = 10) -> PortfolioSnapshot:
+        positions = [
+            PortfolioPosition(
+                security_id=security_id,
+                quantity=Decimal("10.0"),
+                avg_cost_basis=Decimal("100.0"),
+                current_price=Decimal(price),
+                market_value=Decimal(price) * 10,
+                unrealized_pnl=(Decimal(price) - 100) * 10,
+            )
+            for security_id, price in prices.items()
+        ]
+        summary = PortfolioSummary(
+            user_id=123,
+            total_market_value=sum((p.market_value for p in positions), Decimal(0)),
+            total_unrealized_pnl=sum((p.unrealized_pnl for p in positions), Decimal(0)),
+            realized_pnl_ytd=Decimal("0"),
+            stcg_ytd=Decimal("0"),
+            ltcg_ytd=Decimal("0"),
+            last_updated=datetime(2024, 1, 1, hour, 0, 0),
+        )
+        return PortfolioSnapshot(summary=summary, positions=positions)
+
+    def test_delta_contains_only_changes(self):
+        """Test a delta lists changed and removed positions and the new summary."""
+        delta = diff_snapshots(
+            self._snapshot({"1": "110.0", "2": "90.0"}),
+            self._snapshot({"1": "120.0", "3": "50.0"}),
+        )
+
+        assert [p.security_id for p in delta.positions] == ["1", "3"]
+        assert delta.removed == ["2"]
+        assert delta.summary.total_market_value == Decimal("1700.0")
+
+    def test_recompute_without_changes_is_not_a_delta(self):
+        """Test a new last_updated alone does not produce an event."""
+        assert diff_snapshots(self._snapshot({"1": "110.0"}), self._snapshot({"1": "110.0"}, hour=11)) is None
+
+    def test_empty_portfolio_snapshot(self):
+        """Test a user without a portfolio gets an empty snapshot, not an empty delta."""
+        assert json.loads(_dump_snapshot(None)) == {"summary": None, "positions": []}
@@ -0,0 +1,59 @@
+from decimal import Decimal
+from app.services.event_bus import event_bus, PRICE_UPDATED
+from app.services.price_cache import PriceCache, price_cache
+
+class TestPriceCache:
+    """Test cases for the latest-price cache."""
+
+    def test_invalidate_drops_entries(self):
+        """Test invalidated securities are read again while others stay cached."""
+        cache = PriceCache(max_size=10, ttl_seconds=0)
+        cache.put_many({1: Decimal("100"), 2: Decimal("50")}, cache.token())
+
+        cache.invalidate([1])
+        assert cache.get(1) is None
+        assert cache.get(2) == Decimal("50")
+
+    def test_price_read_before_change_not_cached(self):
+        """Test put_many() skips prices that raced with an invalidation or clear."""
+        cache = PriceCache(max_size=10, ttl_seconds=0)
+        token = cache.token()
+        cache.invalidate([1])
+        cache.put_many({1: Decimal("100"), 2: Decimal("50")}, token)
+        assert cache.get(1) is None
+        assert cache.get(2) == Decimal("50")
+
+        token = cache.token()
+        cache.clear()
+        cache.put_many({2: Decimal("51")}, token)
+        assert cache.get(2) is None
+
+    def test_size_bound_evicts_least_recently_used(self):
+        """Test entries beyond max_size are evicted in LRU order."""
+        cache = PriceCache(max_size=2, ttl_seconds=0)
+        cache.put_many({1: Decimal("1"), 2: Decimal("2")}, cache.token())
+        cache.get(1)
+        cache.put_many({3: Decimal("3")}, cache.token())
+
+        assert cache.get(2) is None
+        assert cache.get(1) == Decimal("1")
+        assert len(cache) == 2
+
+    def test_price_updated_event_invalidates(self):
+        """Test the module cache follows committed price updates in this process."""
+        price_cache.put_many({7: Decimal("10")}, price_cache.token())
+        event_bus.publish(PRICE_UPDATED, security_id=7, price=Decimal("11"))
+        assert price_cache.get(7) is None
+
+    def test_change_map_is_pruned(self):
+        """Test change tracking stays bounded and still rejects older reads."""
+        cache = PriceCache(max_size=10, ttl_seconds=0)
+        token = cache.token()
+        for security_id in range(100):
+            cache.invalidate([security_id])
+
+        assert len(cache._changed) <= 10
+        cache.put_many({500: Decimal("1")}, token)
+        assert cache.get(500) is None
+        cache.put_many({500: Decimal("1")}, cache.token())
+        assert cache.get(500) == Decimal("1")
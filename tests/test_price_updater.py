@@ -0,0 +1,68 @@
+import asyncio
+import json
+from decimal import Decimal
+from app.workers.price_updater import PriceUpdater
+
+class TestPriceUpdater:
+    """Test cases for price tick conflation."""
+
+    def _tick(self, security_id: int, price: str) -> bytes:
+        return json.dumps({"security_id": security_id, "price": price}).encode()
+
+    def test_last_tick_per_security_survives(self):
+        """Test a window keeps only the latest price of each security."""
+        updater = PriceUpdater(conflation_window_ms=100)
+        for price in ("100.0", "100.5", "101.0"):
+            updater.add_tick(self._tick(1, price))
+        updater.add_tick(self._tick(2, "50.0"))
+
+        assert updater._pending == {1: Decimal("101.0"), 2: Decimal("50.0")}
+        assert updater.ticks_received == 4
+
+    def test_malformed_ticks_dropped(self):
+        """Test invalid JSON and non-positive prices are skipped."""
+        updater = PriceUpdater(conflation_window_ms=100)
+        assert updater.add_tick(b"not json") is False
+        assert updater.add_tick(self._tick(1, "0")) is False
+        assert updater._pending == {}
+
+    def test_dead_loop_restarted(self):
+        """Test the update loop is logged and restarted when it dies."""
+        class _Consumer:
+            def __init__(self):
+                self.polls = 0
+                self.polled_again = asyncio.Event()
+
+            async def getmany(self, timeout_ms, max_records):
+                await asyncio.sleep(timeout_ms / 1000)
+                self.polls += 1
+                if self.polls == 1:
+                    raise RuntimeError("broker connection lost")
+                self.polled_again.set()
+                return {}
+
+            async def stop(self):
+                pass
+
+        async def run():
+            updater = PriceUpdater(conflation_window_ms=1, retry_backoff_ms=1)
+            updater._consumer = consumer = _Consumer()
+            updater._start_loop(updater._run())
+            await asyncio.wait_for(consumer.polled_again.wait(), timeout=5)
+            await updater.stop()
+            assert updater._task is None
+
+        asyncio.run(run())
+
+    def test_offset_commit_failure_keeps_offsets(self):
+        """Test offsets whose commit failed are retried with the next window."""
+        class _Consumer:
+            async def commit(self, offsets):
+                raise RuntimeError("rebalance in progress")
+
+        updater = PriceUpdater(conflation_window_ms=100)
+        updater._consumer = _Consumer()
+        updater._offsets = {"p0": 10}
+
+        assert asyncio.run(updater.flush()) == 0
+        assert updater._offsets == {"p0": 10}
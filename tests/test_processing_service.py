@@ -2,7 +2,7 @@ import pytest
 from decimal import Decimal
 from datetime import datetime, timedelta
 from app.services.processing_service import processing_service
-from app.models.tax_lot import TaxLot, LotStatus
+from app.database.models.tax_lot import TaxLot, LotStatus
 from app.api.v1.schemas.trade import Trade
 
 class TestProcessingService:
@@ -386,3 +386,490 @@ class TestProcessingService:
         assert lot_data.open_qty == Decimal("100.1234")
         assert lot_data.open_price == Decimal("150.5678")
         assert lot_data.charges == Decimal("5.9999")
+
+    @pytest.mark.asyncio
+    async def test_process_trades_batch(self, test_db):
+        """Test batch processing groups trades per position and matches FIFO in timestamp order."""
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+
+        # Deliberately out of order: the sell must still see both buys
+        trades = [
+            Trade(user_id=123, security_id=1, side="SELL", quantity=Decimal("75.0"),
+                  price=Decimal("170.0"), timestamp=datetime(2024, 2, 1, 10, 0, 0), charges=Decimal("0")),
+            Trade(user_id=123, security_id=1, side="BUY", quantity=Decimal("50.0"),
+                  price=Decimal("150.0"), timestamp=datetime(2024, 1, 1, 10, 0, 0), charges=Decimal("0")),
+            Trade(user_id=123, security_id=1, side="BUY", quantity=Decimal("50.0"),
+                  price=Decimal("160.0"), timestamp=datetime(2024, 1, 15, 10, 0, 0), charges=Decimal("0")),
+            Trade(user_id=456, security_id=1, side="BUY", quantity=Decimal("10.0"),
+                  price=Decimal("155.0"), timestamp=datetime(2024, 1, 1, 10, 0, 0), charges=Decimal("0")),
+        ]
+
+        processed = await processing_service.process_trades(test_db, trades)
+        assert processed == 4
+
+        from sqlalchemy import text
+        lots_result = await test_db.execute(
+            text("SELECT * FROM tax_lots WHERE user_id = 123 ORDER BY open_date")
+        )
+        lots = lots_result.fetchall()
+
+        assert len(lots) == 2
+        assert lots[0].remaining_qty == Decimal("0.0")
+        assert lots[0].status == "CLOSED"
+        assert lots[0].realized_pnl == Decimal("1000.0")  # (170 - 150) * 50
+        assert lots[1].remaining_qty == Decimal("25.0")
+        assert lots[1].status == "PARTIAL"
+        assert lots[1].realized_pnl == Decimal("250.0")  # (170 - 160) * 25
+
+        other_user = await test_db.execute(
+            text("SELECT * FROM tax_lots WHERE user_id = 456")
+        )
+        assert len(other_user.fetchall()) == 1
+
+    @pytest.mark.asyncio
+    async def test_sell_core_execution_mode(self, test_db, monkeypatch):
+        """Test the core sell mode books the same FIFO results with one set-based update."""
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "SELL_EXECUTION_MODE", "core")
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+
+        for day, price in ((1, "150.0"), (15, "160.0")):
+            test_db.add(TaxLot(
+                user_id=123,
+                security_id=1,
+                open_date=datetime(2024, 1, day, 10, 0, 0),
+                open_qty=Decimal("50.0"),
+                remaining_qty=Decimal("50.0"),
+                open_price=Decimal(price),
+                charges=Decimal("0.0"),
+                status=LotStatus.OPEN
+            ))
+        await test_db.commit()
+
+        sell_trade = Trade(
+            user_id=123,
+            security_id=1,
+            side="SELL",
+            quantity=Decimal("60.0"),
+            price=Decimal("170.0"),
+            timestamp=datetime(2024, 2, 1, 10, 0, 0),
+            charges=Decimal("0.0")
+        )
+
+        await processing_service.process_trade(test_db, sell_trade)
+
+        from sqlalchemy import text
+        lots_result = await test_db.execute(
+            text("SELECT * FROM tax_lots WHERE user_id = 123 ORDER BY open_date")
+        )
+        lots = lots_result.fetchall()
+
+        assert lots[0].remaining_qty == Decimal("0.0")
+        assert lots[0].status == "CLOSED"
+        assert lots[0].realized_pnl == Decimal("1000.0")  # (170 - 150) * 50
+        assert lots[1].remaining_qty == Decimal("40.0")
+        assert lots[1].status == "PARTIAL"
+        assert lots[1].realized_pnl == Decimal("100.0")  # (170 - 160) * 10
+
+    @pytest.mark.asyncio
+    async def test_lot_index_falls_back_for_unindexed_older_lot(self, test_db, monkeypatch):
+        """Test a lot the index has not seen that sorts first is still sold first."""
+        from sqlalchemy import select
+        from app.core.config import settings
+        from app.services.lot_index import lot_index
+        monkeypatch.setattr(settings, "LOT_INDEX_ENABLED", True)
+
+        def lot(day):
+            return TaxLot(
+                user_id=123,
+                security_id=1,
+                open_date=datetime(2024, 1, day, 10, 0, 0),
+                open_qty=Decimal("50.0"),
+                remaining_qty=Decimal("50.0"),
+                open_price=Decimal("150.0"),
+                charges=Decimal("0.0"),
+                status=LotStatus.OPEN
+            )
+
+        def sell(quantity):
+            return Trade(
+                user_id=123,
+                security_id=1,
+                side="SELL",
+                quantity=Decimal(quantity),
+                price=Decimal("170.0"),
+                timestamp=datetime(2024, 2, 1, 10, 0, 0),
+                charges=Decimal("0.0")
+            )
+
+        lot_index.invalidate((123, 1))
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+        test_db.add(lot(15))
+        await test_db.commit()
+        await processing_service.process_trade(test_db, sell("10.0"))
+        assert lot_index.get((123, 1)) is not None
+
+        # Committed by another writer, so the index does not know about it
+        test_db.add(lot(1))
+        await test_db.commit()
+        await processing_service.process_trade(test_db, sell("10.0"))
+
+        result = await test_db.execute(
+            select(TaxLot).where(TaxLot.user_id == 123).order_by(TaxLot.open_date)
+        )
+        lots = result.scalars().all()
+        assert lots[0].remaining_qty == Decimal("40.0")
+        assert lots[1].remaining_qty == Decimal("40.0")
+
+    @pytest.mark.asyncio
+    async def test_lot_index_mismatch_reads_full_position(self, test_db, monkeypatch):
+        """Test a sell reads one query from the index, and the full position once it is stale."""
+        from sqlalchemy import select, update
+        from app.core.config import settings
+        from app.repositories.crud_operations import crud_ops
+        from app.services.lot_index import lot_index
+        monkeypatch.setattr(settings, "LOT_INDEX_ENABLED", True)
+
+        calls = {"full": 0, "indexed": 0}
+        full_read, indexed_read = crud_ops.get_open_tax_lots_fifo, crud_ops.get_open_tax_lots_through
+        loaded = []
+        load_lots = processing_service._load_lots_for_sell
+
+        async def count_full(*args, **kwargs):
+            calls["full"] += 1
+            return await full_read(*args, **kwargs)
+
+        async def count_indexed(*args, **kwargs):
+            calls["indexed"] += 1
+            return await indexed_read(*args, **kwargs)
+
+        async def record_loaded(db, trade):
+            lots = await load_lots(db, trade)
+            loaded.append([lot.id for lot in lots])
+            return lots
+
+        monkeypatch.setattr(crud_ops, "get_open_tax_lots_fifo", count_full)
+        monkeypatch.setattr(crud_ops, "get_open_tax_lots_through", count_indexed)
+        monkeypatch.setattr(processing_service, "_load_lots_for_sell", record_loaded)
+
+        def sell():
+            return Trade(
+                user_id=123,
+                security_id=1,
+                side="SELL",
+                quantity=Decimal("10.0"),
+                price=Decimal("170.0"),
+                timestamp=datetime(2024, 2, 1, 10, 0, 0),
+                charges=Decimal("0.0")
+            )
+
+        lot_index.invalidate((123, 1))
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+        for day in (1, 2, 3):
+            test_db.add(TaxLot(
+                user_id=123,
+                security_id=1,
+                open_date=datetime(2024, 1, day, 10, 0, 0),
+                open_qty=Decimal("50.0"),
+                remaining_qty=Decimal("50.0"),
+                open_price=Decimal("150.0"),
+                charges=Decimal("0.0"),
+                status=LotStatus.OPEN
+            ))
+        await test_db.commit()
+
+        # Cold index: one full read builds it
+        await processing_service.process_trade(test_db, sell())
+        assert calls == {"full": 1, "indexed": 0}
+
+        # Warm index: one query for the lots the sell consumes
+        await processing_service.process_trade(test_db, sell())
+        assert calls == {"full": 1, "indexed": 1}
+
+        # Another writer sells from the first lot behind the index's back
+        result = await test_db.execute(select(TaxLot).where(TaxLot.user_id == 123).order_by(TaxLot.open_date))
+        first_id = result.scalars().first().id
+        await test_db.execute(
+            update(TaxLot)
+            .where(TaxLot.id == first_id)
+            .values(remaining_qty=Decimal("5.0"), status=LotStatus.PARTIAL, version=TaxLot.version + 1)
+        )
+        await test_db.commit()
+        expected = [lot.id for lot in await full_read(test_db, 123, 1)]
+
+        await processing_service.process_trade(test_db, sell())
+        assert calls == {"full": 2, "indexed": 2}
+        assert loaded[-1] == expected
+
+        result = await test_db.execute(select(TaxLot).where(TaxLot.user_id == 123).order_by(TaxLot.open_date))
+        lots = result.scalars().all()
+        assert [lot.remaining_qty for lot in lots] == [Decimal("0.0"), Decimal("45.0"), Decimal("50.0")]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_lot_update_retried(self, test_db, monkeypatch):
+        """Test a sell whose lot changed after it was read is retried, and fails once retries run out."""
+        from sqlalchemy import select, update
+        from sqlalchemy.orm.exc import StaleDataError
+        from app.core.config import settings
+        from app.repositories.crud_operations import crud_ops
+        monkeypatch.setattr(settings, "LOT_INDEX_ENABLED", False)
+
+        reads = {"count": 0, "conflicts": 0}
+        read_lots = crud_ops.get_open_tax_lots_fifo
+
+        async def read_then_bump_version(db, user_id, security_id):
+            lots = await read_lots(db, user_id, security_id)
+            reads["count"] += 1
+            if reads["count"] <= reads["conflicts"]:
+                # Another writer commits a change to the lot between our read and update
+                lots_table = TaxLot.__table__
+                await db.execute(
+                    update(lots_table)
+                    .where(lots_table.c.id == lots[0].id)
+                    .values(version=lots_table.c.version + 1)
+                )
+            return lots
+
+        monkeypatch.setattr(crud_ops, "get_open_tax_lots_fifo", read_then_bump_version)
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+
+        def sell(trade_id):
+            return Trade(
+                trade_id=trade_id,
+                user_id=123,
+                security_id=1,
+                side="SELL",
+                quantity=Decimal("10.0"),
+                price=Decimal("170.0"),
+                timestamp=datetime(2024, 2, 1, 10, 0, 0),
+                charges=Decimal("0.0")
+            )
+
+        test_db.add(TaxLot(
+            user_id=123,
+            security_id=1,
+            open_date=datetime(2024, 1, 1, 10, 0, 0),
+            open_qty=Decimal("50.0"),
+            remaining_qty=Decimal("50.0"),
+            open_price=Decimal("150.0"),
+            charges=Decimal("0.0"),
+            status=LotStatus.OPEN
+        ))
+        await test_db.commit()
+
+        # One conflict: the second attempt succeeds
+        reads["conflicts"] = 1
+        assert await processing_service.process_trade(test_db, sell("s1")) is True
+        assert reads["count"] == 2
+
+        # A conflict on every attempt: the error surfaces after the last retry
+        reads.update(count=0, conflicts=settings.TRADE_MAX_RETRIES)
+        with pytest.raises(StaleDataError):
+            await processing_service.process_trade(test_db, sell("s2"))
+        assert reads["count"] == settings.TRADE_MAX_RETRIES
+
+        result = await test_db.execute(select(TaxLot).where(TaxLot.user_id == 123))
+        lot = result.scalars().one()
+        assert lot.remaining_qty == Decimal("40.0")
+
+    @pytest.mark.asyncio
+    async def test_stale_lot_version_rejected(self, test_db):
+        """Test set-based lot updates refuse to overwrite a lot changed since it was read."""
+        from app.core.exceptions import StaleLotError
+        from app.repositories.crud_operations import crud_ops
+
+        lot = TaxLot(
+            user_id=123,
+            security_id=1,
+            open_date=datetime(2024, 1, 1, 10, 0, 0),
+            open_qty=Decimal("100.0"),
+            remaining_qty=Decimal("100.0"),
+            open_price=Decimal("150.0"),
+            charges=Decimal("0.0"),
+            status=LotStatus.OPEN
+        )
+        test_db.add(lot)
+        await test_db.commit()
+        assert lot.version == 1
+
+        update_row = {
+            "id": lot.id,
+            "version": 0,  # Stale: the lot is at version 1
+            "remaining_qty": Decimal("50.0"),
+            "close_qty": Decimal("50.0"),
+            "status": LotStatus.PARTIAL,
+            "close_date": datetime(2024, 2, 1, 10, 0, 0),
+            "close_price": Decimal("170.0"),
+            "realized_pnl": Decimal("1000.0"),
+            "stcg": Decimal("250.0"),
+            "ltcg": Decimal("0.0"),
+        }
+
+        with pytest.raises(StaleLotError):
+            await crud_ops.apply_lot_updates(test_db, [update_row])
+
+        update_row["version"] = 1
+        assert await crud_ops.apply_lot_updates(test_db, [update_row]) == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_lot_detected_without_multi_rowcount(self, test_db, monkeypatch):
+        """Test a stale lot in a multi-lot update is caught when executemany rowcounts are unreliable."""
+        from app.core.exceptions import StaleLotError
+        from app.repositories.crud_operations import crud_ops
+
+        lots = [
+            TaxLot(
+                user_id=123,
+                security_id=1,
+                open_date=datetime(2024, 1, day, 10, 0, 0),
+                open_qty=Decimal("100.0"),
+                remaining_qty=Decimal("100.0"),
+                open_price=Decimal("150.0"),
+                charges=Decimal("0.0"),
+                status=LotStatus.OPEN
+            )
+            for day in (1, 2)
+        ]
+        test_db.add_all(lots)
+        await test_db.commit()
+        monkeypatch.setattr(test_db.bind.dialect, "supports_sane_multi_rowcount", False)
+
+        update_rows = [
+            {
+                "id": lot.id,
+                "version": version,
+                "remaining_qty": Decimal("50.0"),
+                "close_qty": Decimal("50.0"),
+                "status": LotStatus.PARTIAL,
+                "close_date": datetime(2024, 2, 1, 10, 0, 0),
+                "close_price": Decimal("170.0"),
+                "realized_pnl": Decimal("1000.0"),
+                "stcg": Decimal("250.0"),
+                "ltcg": Decimal("0.0"),
+            }
+            for lot, version in zip(lots, (1, 0))  # The second lot is stale
+        ]
+
+        with pytest.raises(StaleLotError):
+            await crud_ops.apply_lot_updates(test_db, update_rows)
+
+    @pytest.mark.asyncio
+    async def test_duplicate_trade_id_ignored(self, test_db):
+        """Test a replayed trade_id does not book a second lot."""
+        buy_trade = Trade(
+            trade_id="broker-1",
+            user_id=123,
+            security_id=1,
+            side="BUY",
+            quantity=Decimal("100.0"),
+            price=Decimal("150.0"),
+            timestamp=datetime(2024, 1, 1, 10, 0, 0)
+        )
+
+        assert await processing_service.process_trade(test_db, buy_trade) is True
+        assert await processing_service.process_trade(test_db, buy_trade) is False
+        assert await processing_service.process_trades(test_db, [buy_trade, buy_trade]) == 0
+
+        from sqlalchemy import select
+        result = await test_db.execute(select(TaxLot).where(TaxLot.user_id == 123))
+        assert len(result.scalars().all()) == 1
+
+    @pytest.mark.asyncio
+    async def test_get_latest_prices_batch(self, test_db):
+        """Test prices for several securities come back from one lookup."""
+        from app.repositories.crud_operations import crud_ops
+
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+        await processing_service.update_price(test_db, 123, 2, Decimal("80.0"))
+
+        prices = await crud_ops.get_latest_prices(test_db, [1, 2, 3])
+        assert prices == {1: Decimal("170.0"), 2: Decimal("80.0")}
+        assert await crud_ops.get_latest_prices(test_db, []) == {}
+
+    @pytest.mark.asyncio
+    async def test_portfolio_summary_maintained(self, test_db):
+        """Test each trade refreshes its position's portfolio_summary row."""
+        from app.repositories.crud_portfolio import crud_portfolio
+
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+        for day, price in ((1, "150.0"), (2, "160.0")):
+            await processing_service.process_trade(test_db, Trade(
+                user_id=123,
+                security_id=1,
+                side="BUY",
+                quantity=Decimal("10.0"),
+                price=Decimal(price),
+                timestamp=datetime(2024, 1, day, 10, 0, 0)
+            ))
+        await processing_service.process_trade(test_db, Trade(
+            user_id=123,
+            security_id=1,
+            side="SELL",
+            quantity=Decimal("15.0"),
+            timestamp=datetime.now()
+        ))
+
+        summary, = await crud_portfolio.get_portfolio_by_user(test_db, 123)
+        assert summary.quantity == Decimal("5.0")
+        assert summary.total_cost == Decimal("800.0")
+        assert summary.avg_cost_basis == Decimal("160.0")
+        assert summary.realized_pnl_ytd == Decimal("250.0")
+
+    @pytest.mark.asyncio
+    async def test_portfolio_summary_zeroed_when_closed_in_earlier_year(self, test_db):
+        """Test a position closed by a back-dated sell keeps no quantity in its summary row."""
+        from app.repositories.crud_portfolio import crud_portfolio
+
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+        for side, timestamp in (("BUY", datetime(2023, 1, 1, 10, 0, 0)), ("SELL", datetime(2023, 6, 1, 10, 0, 0))):
+            await processing_service.process_trade(test_db, Trade(
+                user_id=123,
+                security_id=1,
+                side=side,
+                quantity=Decimal("10.0"),
+                price=Decimal("150.0"),
+                timestamp=timestamp
+            ))
+
+        summary, = await crud_portfolio.get_portfolio_by_user(test_db, 123)
+        assert summary.quantity == Decimal("0")
+        assert summary.total_cost == Decimal("0")
+        assert summary.realized_pnl_ytd == Decimal("0")
+
+    @pytest.mark.asyncio
+    async def test_security_exposure_maintained(self, test_db):
+        """Test trades add their open lot changes to security_exposure."""
+        from app.repositories.crud_portfolio import crud_portfolio
+
+        await processing_service.update_price(test_db, 123, 1, Decimal("170.0"))
+        for user_id in (123, 124):
+            await processing_service.process_trades(test_db, [
+                Trade(
+                    user_id=user_id,
+                    security_id=1,
+                    side="BUY",
+                    quantity=Decimal("10.0"),
+                    price=Decimal("150.0"),
+                    timestamp=datetime(2024, 1, day, 10, 0, 0)
+                )
+                for day in (1, 2)
+            ])
+        await processing_service.process_trade(test_db, Trade(
+            user_id=123,
+            security_id=1,
+            side="SELL",
+            quantity=Decimal("20.0"),
+            timestamp=datetime(2024, 2, 1, 10, 0, 0)
+        ))
+        await processing_service.process_trade(test_db, Trade(
+            user_id=124,
+            security_id=1,
+            side="SELL",
+            quantity=Decimal("5.0"),
+            timestamp=datetime(2024, 2, 1, 10, 0, 0)
+        ))
+
+        exposure = (await crud_portfolio.get_security_exposures(test_db, [1]))[1]
+        assert exposure.open_lots == 2
+        assert exposure.remaining_qty == Decimal("15.0")
+        assert exposure.holders == 1
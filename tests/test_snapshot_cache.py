@@ -0,0 +1,77 @@
+from decimal import Decimal
+from datetime import datetime
+from app.api.v1.schemas.portfolio import PortfolioSnapshot, PortfolioSummary
+from app.services.event_bus import event_bus, PRICE_UPDATED, TRADE_APPLIED
+from app.services.snapshot_cache import SnapshotCache, snapshot_cache
+
+class TestSnapshotCache:
+    """Test cases for the per-user snapshot cache."""
+
+    def _snapshot(self, user_id: int) -> PortfolioSnapshot:
+        summary = PortfolioSummary(
+            user_id=user_id,
+            total_market_value=Decimal("0"),
+            total_unrealized_pnl=Decimal("0"),
+            realized_pnl_ytd=Decimal("0"),
+            stcg_ytd=Decimal("0"),
+            ltcg_ytd=Decimal("0"),
+            last_updated=datetime(2024, 1, 1, 10, 0, 0),
+        )
+        return PortfolioSnapshot(summary=summary, positions=[])
+
+    def test_price_update_invalidates_holders_only(self):
+        """Test a price change drops the snapshots of users holding that security."""
+        cache = SnapshotCache(max_bytes=1 << 20, ttl_seconds=0)
+        cache.put(1, self._snapshot(1), [10, 11], cache.token())
+        cache.put(2, self._snapshot(2), [11], cache.token())
+
+        cache.invalidate_security(10)
+        assert cache.get(1) is None
+        assert cache.get(2) is not None
+
+        cache.invalidate_user(2)
+        assert cache.get(2) is None
+
+    def test_snapshot_computed_before_change_not_cached(self):
+        """Test put() rejects a snapshot that raced with an invalidation."""
+        cache = SnapshotCache(max_bytes=1 << 20, ttl_seconds=0)
+        token = cache.token()
+        cache.invalidate_security(10)
+
+        assert cache.put(1, self._snapshot(1), [10], token) is False
+        assert cache.put(1, self._snapshot(1), [10], cache.token()) is True
+
+    def test_memory_budget_evicts_least_recently_used(self):
+        """Test entries beyond the memory budget are evicted in LRU order."""
+        cache = SnapshotCache(max_bytes=2048, ttl_seconds=0)
+        cache.put(1, self._snapshot(1), [], cache.token())
+        cache.put(2, self._snapshot(2), [], cache.token())
+        cache.get(1)
+        cache.put(3, self._snapshot(3), [], cache.token())
+
+        assert cache.get(2) is None
+        assert cache.get(1) is not None
+        assert cache.size_bytes <= 2048
+
+    def test_events_reach_shared_cache(self):
+        """Test trade and price events invalidate the shared cache."""
+        snapshot_cache.put(7, self._snapshot(7), [70], snapshot_cache.token())
+        event_bus.publish(PRICE_UPDATED, security_id=70, price=Decimal("1.0"))
+        assert snapshot_cache.get(7) is None
+
+        snapshot_cache.put(7, self._snapshot(7), [70], snapshot_cache.token())
+        event_bus.publish(TRADE_APPLIED, user_id=7, security_id=70)
+        assert snapshot_cache.get(7) is None
+
+    def test_change_maps_are_pruned(self, monkeypatch):
+        """Test change tracking stays bounded and still rejects older snapshots."""
+        from app.services import snapshot_cache as module
+        monkeypatch.setattr(module, "_MAX_CHANGES", 10)
+        cache = SnapshotCache(max_bytes=1 << 20, ttl_seconds=0)
+        token = cache.token()
+        for user_id in range(100):
+            cache.invalidate_user(user_id)
+
+        assert len(cache._user_changed) <= 10
+        assert cache.put(500, self._snapshot(500), [], token) is False
+        assert cache.put(500, self._snapshot(500), [], cache.token()) is True
@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from app.api.v1.schemas.trade import Trade
+from app.workers.trade_consumer import TradeConsumer
+
+class _FlakyConsumer:
+    """Kafka consumer stand-in whose first offset commit fails."""
+
+    def __init__(self):
+        self.calls = 0
+        self.committed = []
+
+    async def commit(self, offsets):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("rebalance in progress")
+        self.committed.append(offsets)
+
+class _IdleConsumer:
+    """Kafka consumer stand-in with nothing to read."""
+
+    def __init__(self):
+        self.stopped = False
+
+    async def getmany(self, timeout_ms, max_records):
+        await asyncio.sleep(timeout_ms / 1000)
+        return {}
+
+    async def commit(self, offsets):
+        pass
+
+    async def stop(self):
+        self.stopped = True
+
+def _trade(trade_id, day):
+    return Trade(
+        trade_id=trade_id,
+        user_id=123,
+        security_id=1,
+        side="BUY",
+        quantity=Decimal("10.0"),
+        price=Decimal("150.0"),
+        timestamp=datetime(2024, 1, day, 10, 0, 0),
+        charges=Decimal("0.0")
+    )
+
+class TestTradeConsumer:
+    """Test cases for the trade consumer's batching, offset commits and shutdown."""
+
+    def test_commit_failure_keeps_committing(self):
+        """Test a failed offset commit is logged and later batches still commit."""
+        async def run():
+            consumer = TradeConsumer(lanes=1)
+            consumer._consumer = _FlakyConsumer()
+            consumer._pending_commits = asyncio.Queue()
+            consumer._commit_task = asyncio.create_task(consumer._run_commits())
+
+            loop = asyncio.get_running_loop()
+            for offset in (10, 20):
+                future = loop.create_future()
+                future.set_result(None)
+                await consumer._pending_commits.put(([future], {"p0": offset}))
+            await consumer._pending_commits.join()
+
+            assert not consumer._commit_task.done()
+            assert consumer._consumer.committed == [{"p0": 20}]
+            await consumer._stop_commits()
+
+        asyncio.run(run())
+
+    def test_unfinished_batch_not_committed(self):
+        """Test offsets are not committed for a batch a lane did not finish."""
+        async def run():
+            consumer = TradeConsumer(lanes=1)
+            consumer._consumer = _FlakyConsumer()
+            consumer._consumer.calls = 1
+            consumer._pending_commits = asyncio.Queue()
+            consumer._commit_task = asyncio.create_task(consumer._run_commits())
+
+            future = asyncio.get_running_loop().create_future()
+            future.cancel()
+            await consumer._pending_commits.put(([future], {"p0": 10}))
+            await consumer._pending_commits.join()
+
+            assert consumer._consumer.committed == []
+            await consumer._stop_commits()
+
+        asyncio.run(run())
+
+
+    def test_failed_batch_retried_in_trade_time_order(self, monkeypatch):
+        """Test trades from a failed batch are retried one at a time in trade time order."""
+        from app.services.processing_service import processing_service
+
+        async def fail_batch(db, trades):
+            raise RuntimeError("bad trade in batch")
+
+        retried = []
+
+        async def record(trade):
+            retried.append(trade.trade_id)
+
+        consumer = TradeConsumer(lanes=1)
+        monkeypatch.setattr(processing_service, "process_trades", fail_batch)
+        monkeypatch.setattr(consumer, "_process_with_retry", record)
+        trades = [_trade("t3", 3), _trade("t1", 1), _trade("t2a", 2), _trade("t2b", 2)]
+
+        asyncio.run(consumer._process_batch(trades))
+
+        assert retried == ["t1", "t2a", "t2b", "t3"]
+
+    def test_stop_bounded_by_timeout(self):
+        """Test stop() gives up on a stuck in-flight batch after the stop timeout."""
+        async def run():
+            consumer = TradeConsumer(lanes=1, stop_timeout_ms=50)
+
+            async def stuck(trades):
+                await asyncio.sleep(3600)
+
+            consumer._process_batch = stuck
+            consumer._consumer = kafka = _IdleConsumer()
+            consumer._start_lanes()
+            consumer._pending_commits = asyncio.Queue()
+            consumer._commit_task = asyncio.create_task(consumer._run_commits())
+            consumer._task = asyncio.create_task(consumer._run())
+
+            future = asyncio.get_running_loop().create_future()
+            await consumer._lanes[0].put(([_trade("t1", 1)], future))
+            await consumer._pending_commits.put(([future], {"p0": 10}))
+            await asyncio.sleep(0.01)
+
+            await asyncio.wait_for(consumer.stop(), 5)
+
+            assert kafka.stopped
+            assert future.cancelled()
+            assert consumer._lane_tasks == [] and consumer._commit_task is None
+
+        asyncio.run(run())